@@ -1,15 +1,43 @@
+import time
+# Startup phases (see startup_timings) are timed from here
+_import_started = time.perf_counter()
+
 import os
 import numpy as np
 from PIL import Image
-import tensorflow as tf
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import io
 import base64
+import functools
+import hmac
+import logging
+import math
+import threading
 import warnings
 
-# Suppress TensorFlow warnings
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+from batching import MicroBatcher
+from cache import PredictionCache, image_key
+from deadlines import DEFAULT_PRIORITY, ENVIRON_KEY, PRIORITY_CLASSES, DeadlineExceeded, Schedule, remaining
+from decode_pool import DecodedImage, DecodePool
+from hotswap import DrainGate, LoadedModel, ShadowComparator, SwapSignal
+from imaging import DEFAULT_MAX_PIXELS, ImageTooLargeError, decode_image, image_size
+from inference import KerasRunner, TFLiteRunner
+from ingress import AdmissionController, AdmissionMiddleware
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, InstrumentationMiddleware, Registry, worker_slot
+from phash import NearDuplicateIndex, dhash
+from postprocess import DEFAULT_TOP_K, postprocess
+from profiling import Profiler
+from quality import REASONS as QUALITY_REASONS, QualityGate
+from registry import ModelEntry, ModelRegistry, RegistryError
+from request_log import RequestLog
+from responses import ClassCatalog, dumps, render_batch, with_fields
+from similarity import SimilarityIndex
+from tiling import aggregate_tiles, heatmap, leaf_fractions, tile_batches, tile_grid
+
+# Suppress TensorFlow warnings (TensorFlow itself is imported when a model
+# that needs it is loaded)
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
 warnings.filterwarnings('ignore')
 
 # Handle numpy 2.0 compatibility
@@ -21,9 +49,322 @@ elif not hasattr(np, 'bool'):  # numpy >= 2.0
 app = Flask(__name__)
 CORS(app)
 
-# Load the model
-MODEL_PATH = r'D:\Redemtion\project\model_best\plant_disease_model_best.h5'
+# Keras model file (.h5 or .keras); TFLite variants are looked up next to it
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model_best', 'plant_disease_model_best.h5'
+))
 model = None
+runner = None
+catalog = None
+model_lock = threading.Lock()
+# The LoadedModel serving requests; model, runner, catalog, plant_masks,
+# class_names and loaded_model_version are its fields
+active_model = None
+
+# Inference backend: keras, or a TFLite variant exported by convert_tflite.py
+INFERENCE_BACKENDS = ('keras', 'tflite-fp32', 'tflite-fp16', 'tflite-int8')
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras').lower()
+TFLITE_MODEL_DIR = os.environ.get('TFLITE_MODEL_DIR', os.path.dirname(MODEL_PATH))
+TFLITE_NUM_THREADS = int(os.environ['TFLITE_NUM_THREADS']) if os.environ.get('TFLITE_NUM_THREADS') else None
+
+# Versioned model registry (see registry.py). When it holds no servable
+# version, MODEL_PATH is the only version, named after its file.
+MODEL_REGISTRY_DIR = os.environ.get('MODEL_REGISTRY_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model_registry'
+))
+# Version served at startup (default: the registry's ACTIVE file, else its newest version)
+MODEL_VERSION = os.environ.get('MODEL_VERSION')
+registry = ModelRegistry(MODEL_REGISTRY_DIR, INFERENCE_BACKEND)
+
+# Confidence-gated cascade: a small model (a registry version's cascade/
+# folder, or CASCADE_MODEL_PATH next to MODEL_PATH) answers first, and the full
+# model only runs when the small one's top-1 confidence or top-1/top-2 margin
+# is below these thresholds, or the requested plant holds too little of its
+# probability
+CASCADE_MODEL_PATH = os.environ.get('CASCADE_MODEL_PATH')
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('CASCADE_MIN_CONFIDENCE', 0.7))
+CASCADE_MIN_MARGIN = float(os.environ.get('CASCADE_MIN_MARGIN', 0.5))
+CASCADE_STAGES = ('small', 'full')
+CASCADE_ESCALATION_REASONS = ('confidence', 'margin', 'plant')
+cascade_runner = None
+cascade_batcher = None
+cascade_lock = threading.Lock()
+# Cascade image counts (summed over workers) when the serving version was
+# activated; GET /health reports the counts since then
+cascade_images_baseline = {}
+
+# Quality gate: uploads that are too dark, overexposed, blank, blurry or
+# hold (almost) no foliage get a 422 with the reason instead of a forward
+# pass. Off by default until the thresholds are validated on real uploads:
+# QUALITY_GATE=log runs the checks and logs what would have been rejected,
+# QUALITY_GATE=1 enforces them (an empty threshold disables one check)
+def quality_threshold(name, default):
+    value = os.environ.get(name, str(default))
+    return float(value) if value.strip() else None
+
+QUALITY_GATE_MODE = {'0': 'off', 'false': 'off', 'no': 'off', '': 'off', 'log': 'log'}.get(
+    os.environ.get('QUALITY_GATE', '0').strip().lower(), 'on')
+QUALITY_GATE = QUALITY_GATE_MODE != 'off'
+quality_gate = QualityGate(
+    min_brightness=quality_threshold('QUALITY_MIN_BRIGHTNESS', 20),
+    max_brightness=quality_threshold('QUALITY_MAX_BRIGHTNESS', 245),
+    max_clipped=quality_threshold('QUALITY_MAX_CLIPPED', 0.9),
+    min_contrast=quality_threshold('QUALITY_MIN_CONTRAST', 4),
+    min_sharpness=quality_threshold('QUALITY_MIN_SHARPNESS', 3),
+    min_green_ratio=quality_threshold('QUALITY_MIN_GREEN_RATIO', 0.02)
+) if QUALITY_GATE else None
+QUALITY_MESSAGES = {
+    'too_dark': 'Image is too dark, please retake it in better light',
+    'overexposed': 'Image is overexposed, please avoid direct glare',
+    'blank': 'Image appears to be blank',
+    'blurry': 'Image is too blurry, please hold the camera steady and focus on the leaf',
+    'not_plant': 'No plant found in the image, please photograph the affected leaf'
+}
+
+# Running average of forward-pass seconds per image, used to estimate the
+# inference time rejected images saved
+forward_seconds_per_image = None
+
+# Micro-batching: concurrent /predict calls share one forward pass
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 8))
+MAX_BATCH_WAIT_MS = float(os.environ.get('MAX_BATCH_WAIT_MS', 10))
+batcher = None
+
+# Tiled mode (/predict with tiled=1) for high-resolution field and drone
+# photos: the photo is cut into overlapping model-size tiles instead of being
+# squashed to one input (see tiling.py)
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', 0.25))
+TILED_MAX_TILES = int(os.environ.get('TILED_MAX_TILES', 256))
+TILE_BATCH_SIZE = int(os.environ.get('TILE_BATCH_SIZE', 32))
+# Tiles with a smaller share of foliage-coloured pixels are skipped
+TILE_MIN_LEAF_RATIO = float(os.environ.get('TILE_MIN_LEAF_RATIO', 0.2))
+# Share of the leaf tiles whose highest outputs are pooled per class
+TILE_TOP_FRACTION = float(os.environ.get('TILE_TOP_FRACTION', 0.1))
+TILED_MAX_IMAGE_PIXELS = int(os.environ.get('TILED_MAX_IMAGE_PIXELS', 120_000_000))
+# Largest decode buffer: JPEGs are decoded at a reduced DCT scale first,
+# other formats above this size are rejected
+TILED_MAX_DECODE_PIXELS = int(os.environ.get('TILED_MAX_DECODE_PIXELS', 32_000_000))
+# Tiled requests decoding or inferring at once, per worker (each holds up to
+# TILED_MAX_DECODE_PIXELS of decoded pixels)
+MAX_TILED_REQUESTS = int(os.environ.get('MAX_TILED_REQUESTS', 2))
+tiled_slots = threading.BoundedSemaphore(max(1, MAX_TILED_REQUESTS))
+
+# "Similar past cases": the model's penultimate-layer embeddings in an IVF
+# index per model version under SIMILARITY_INDEX_DIR (see similarity.py).
+# /predict returns a photo's embedding with embedding=1 and its closest cases
+# with similar=<k>, /similar looks up an image or an embedding, and cases are
+# added through /admin/similar.
+SIMILARITY_INDEX_DIR = os.environ.get('SIMILARITY_INDEX_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'similarity_index'
+))
+# Inverted lists searched per query (more: better recall, slower)
+SIMILAR_NPROBE = int(os.environ.get('SIMILAR_NPROBE', 16))
+SIMILAR_DEFAULT_K = 10
+SIMILAR_MAX_K = int(os.environ.get('SIMILAR_MAX_K', 100))
+# A new IVF segment is built in the background once the rows added since the
+# last build exceed this share of it
+SIMILAR_REBUILD_FRACTION = float(os.environ.get('SIMILAR_REBUILD_FRACTION', 0.1))
+# Model version -> SimilarityIndex
+similarity_indexes = {}
+similarity_lock = threading.Lock()
+
+# Startup: phase -> seconds, filled in as the service starts; `ready` is set
+# once the model is loaded, warmed up and the pipeline is running
+startup_timings = {}
+ready = threading.Event()
+load_error = None
+
+# Batch sizes run once at startup so real requests hit warmed kernels
+WARMUP_BATCH_SIZES = [
+    int(size) for size in os.environ.get('WARMUP_BATCH_SIZES', '').split(',') if size.strip()
+] or sorted({1, MAX_BATCH_SIZE, TILE_BATCH_SIZE} | {size for size in (2, 4, 16, 32) if size < MAX_BATCH_SIZE})
+
+# Decode size used until a model is loaded (afterwards: the model's input size)
+DEFAULT_INPUT_SIZE = (224, 224)
+
+# Uploads whose header reports more pixels than this are rejected before decoding
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', DEFAULT_MAX_PIXELS))
+
+# Cache of raw model outputs keyed on the uploaded bytes (0 MB disables it)
+PREDICTION_CACHE_MB = float(os.environ.get('PREDICTION_CACHE_MB', 64))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 0))
+prediction_cache = PredictionCache(
+    max_bytes=PREDICTION_CACHE_MB * 1024 * 1024,
+    ttl_seconds=PREDICTION_CACHE_TTL or None
+)
+
+# Perceptual-hash index of recent predictions; re-encoded or resized copies
+# of a recent upload reuse its output (0 capacity disables it)
+NEAR_DUPLICATE_CAPACITY = int(os.environ.get('NEAR_DUPLICATE_CAPACITY', 100_000))
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', 4))
+near_duplicate_index = NearDuplicateIndex(capacity=NEAR_DUPLICATE_CAPACITY, max_distance=NEAR_DUPLICATE_DISTANCE)
+
+# Image decoding in worker processes writing into shared memory (0 decodes
+# on the request thread)
+DECODE_PROCESSES = int(os.environ.get('DECODE_PROCESSES', 0))
+decode_pool = None
+
+# Identifies the loaded model; cached outputs from another version are dropped
+loaded_model_version = None
+
+# Upper bound on images accepted by /predict/batch
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 32))
+
+# Admission control: /predict, /predict/batch and /similar beyond these limits are
+# answered immediately with 503 + Retry-After instead of queueing unbounded
+MAX_IN_FLIGHT_REQUESTS = int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', 2 * MAX_BATCH_SIZE))
+MAX_QUEUED_REQUESTS = int(os.environ.get('MAX_QUEUED_REQUESTS', 64))
+MAX_QUEUED_MB = float(os.environ.get('MAX_QUEUED_MB', 256))
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 64))
+# What a chunked upload (no Content-Length) is counted as against MAX_QUEUED_MB
+UNKNOWN_UPLOAD_MB = float(os.environ.get('UNKNOWN_UPLOAD_MB', 8))
+QUEUE_TIMEOUT = float(os.environ.get('QUEUE_TIMEOUT', 10))
+
+# Deadline for requests without an X-Deadline-Ms header (the backend's axios
+# timeout); work that cannot finish before its deadline is dropped
+DEFAULT_DEADLINE_MS = float(os.environ.get('DEFAULT_DEADLINE_MS', 30000))
+MAX_DEADLINE_MS = float(os.environ.get('MAX_DEADLINE_MS', 600000))
+admission = AdmissionController(
+    max_in_flight=MAX_IN_FLIGHT_REQUESTS,
+    max_queued=MAX_QUEUED_REQUESTS,
+    max_queued_bytes=MAX_QUEUED_MB * 1024 * 1024,
+    max_request_bytes=MAX_UPLOAD_MB * 1024 * 1024,
+    unknown_request_bytes=UNKNOWN_UPLOAD_MB * 1024 * 1024,
+    queue_timeout=QUEUE_TIMEOUT
+)
+# Admission checks a declared size up front; this stops reading a chunked
+# upload (HTTP 413) once it passes the same limit
+app.config['MAX_CONTENT_LENGTH'] = admission.max_request_bytes
+# Shared-memory slots: one per image between decode and the end of its forward pass
+DECODE_SLOTS = int(os.environ.get('DECODE_SLOTS', MAX_IN_FLIGHT_REQUESTS + MAX_BATCH_IMAGES))
+
+# Metrics for GET /metrics. serve.py sets METRICS_WORKER_SLOTS to its worker
+# count so the (shared-memory) values of all workers are reported together.
+METRICS_WORKER_SLOTS = int(os.environ.get('METRICS_WORKER_SLOTS', 1))
+ENDPOINTS = {'/predict': 'predict', '/predict/batch': 'predict_batch', '/similar': 'similar'}
+STAGES = ('upload_read', 'decode', 'resize', 'quality_gate', 'cascade', 'inference', 'plant_filter', 'search', 'serialize', 'total')
+ERROR_TYPES = (
+    'model_not_loaded', 'bad_request', 'too_large', 'decode_failed', 'queue_full', 'queue_bytes',
+    'queue_timeout', 'expired', 'unsupported', 'internal'
+)
+RESPONSE_STATUSES = ('200', '400', '404', '405', '413', '422', '500', '501', '503', '504', 'other')
+metrics = Registry(METRICS_WORKER_SLOTS)
+stage_seconds = metrics.histogram(
+    'ai_service_stage_seconds', 'Time spent per request in each pipeline stage',
+    endpoint=tuple(ENDPOINTS.values()), stage=STAGES
+)
+requests_total = metrics.counter(
+    'ai_service_requests_total', 'Responses by endpoint and HTTP status',
+    endpoint=tuple(ENDPOINTS.values()) + ('other',), status=RESPONSE_STATUSES
+)
+errors_total = metrics.counter('ai_service_errors_total', 'Failed requests and images by error type', type=ERROR_TYPES)
+cache_lookups_total = metrics.counter(
+    'ai_service_cache_lookups_total', 'Prediction cache and near-duplicate index lookups',
+    cache=('exact', 'near_duplicate'), result=('hit', 'miss')
+)
+batch_size = metrics.histogram(
+    'ai_service_batch_size', 'Images per forward pass', buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+forward_seconds = metrics.histogram('ai_service_forward_pass_seconds', 'Duration of one forward pass')
+STARTUP_PHASES = ('import', 'tensorflow_import', 'model_load', 'warm_up', 'pipeline', 'total')
+startup_seconds = metrics.gauge('ai_service_startup_seconds', 'Time spent in each startup phase', phase=STARTUP_PHASES)
+model_swaps_total = metrics.counter(
+    'ai_service_model_swaps_total', 'Model version switches and shadow starts by result', result=('success', 'failed')
+)
+cascade_images_total = metrics.counter(
+    'ai_service_cascade_images_total', 'Images answered by each cascade stage', stage=CASCADE_STAGES
+)
+cascade_escalations_total = metrics.counter(
+    'ai_service_cascade_escalations_total', 'Escalations to the full model by reason (an image may have several)',
+    reason=CASCADE_ESCALATION_REASONS
+)
+rejected_images_total = metrics.counter(
+    'ai_service_rejected_images_total', 'Images rejected (in log mode: flagged) by the quality gate by reason', reason=QUALITY_REASONS
+)
+rejected_seconds_saved_total = metrics.counter(
+    'ai_service_rejected_inference_seconds_saved_total',
+    'Estimated forward-pass seconds not spent on rejected images'
+)
+tiles_total = metrics.counter(
+    'ai_service_tiles_total', 'Tiles of tiled /predict requests, inferred or skipped as non-leaf',
+    result=('inferred', 'skipped')
+)
+similar_lookups_skipped_total = metrics.counter(
+    'ai_service_similar_lookups_skipped_total',
+    'Similar-case lookups on /predict answered empty because the embedding could not be searched'
+)
+shadow_comparisons_total = metrics.counter(
+    'ai_service_shadow_comparisons_total', 'Shadow comparisons by top-1 agreement and the primary output\'s stage',
+    top1=('agree', 'disagree'), stage=CASCADE_STAGES
+)
+shadow_max_abs_diff = metrics.histogram(
+    'ai_service_shadow_max_abs_diff', 'Largest probability difference between primary and shadow outputs',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# Admission rejection reason -> error type
+ADMISSION_ERRORS = {
+    'too_large': 'too_large', 'queue_full': 'queue_full', 'bytes': 'queue_bytes',
+    'timeout': 'queue_timeout', 'expired': 'expired'
+}
+
+# Share of successful requests written to the structured request log (errors
+# are always logged)
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+request_log = RequestLog(LOG_SAMPLE_RATE)
+
+# WSGI environ keys holding a request's stage timings and log fields
+TIMINGS_KEY = 'ai_service.timings'
+LOG_FIELDS_KEY = 'ai_service.log_fields'
+
+def record_response(environ, status, seconds):
+    """
+    Count a finished response, observe its total time and log it if sampled
+    """
+    endpoint = ENDPOINTS.get(environ.get('PATH_INFO'), 'other')
+    status_label = str(status)
+    requests_total.inc(endpoint, status_label if status_label in RESPONSE_STATUSES else 'other')
+    if endpoint == 'other':
+        return
+    stage_seconds.observe(seconds, endpoint, 'total')
+    fields = environ.get(LOG_FIELDS_KEY, {})
+    timings = {f'{stage}_ms': round(value * 1000.0, 2) for stage, value in environ.get(TIMINGS_KEY, {}).items()}
+    request_log.request(
+        {'endpoint': endpoint, 'status': status, 'total_ms': round(seconds * 1000.0, 2), **timings, **fields},
+        failed=(status >= 500 and status not in (503, 504)) or 'error' in fields
+    )
+
+# Admin endpoints (/admin/...) are only served when ADMIN_TOKEN is set, to
+# requests carrying it in the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# On-demand profiling of /predict (POST /admin/profile); dumps go to PROFILE_DIR
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+MAX_PROFILED_REQUESTS = 1000
+profiler = Profiler(PROFILE_DIR)
+
+# Hot swaps (POST /admin/model) reach every serve.py worker through
+# swap_signal. During the switch, new requests wait up to SWAP_DRAIN_TIMEOUT
+# seconds for those in flight to finish on the old version.
+SWAP_DRAIN_TIMEOUT = float(os.environ.get('SWAP_DRAIN_TIMEOUT', 30))
+model_gate = DrainGate()
+swap_signal = SwapSignal(METRICS_WORKER_SLOTS)
+# ShadowComparator of the version being shadowed, if any
+shadow = None
+
+def record_rejection(reason):
+    errors_total.inc(ADMISSION_ERRORS[reason])
+
+app.wsgi_app = InstrumentationMiddleware(
+    AdmissionMiddleware(
+        app.wsgi_app, admission,
+        paths=tuple(ENDPOINTS),
+        default_timeout_ms=DEFAULT_DEADLINE_MS or None,
+        max_timeout_ms=MAX_DEADLINE_MS or None,
+        on_reject=record_rejection
+    ),
+    record_response
+)
 
 # Common plant disease classes (adjust based on your model)
 CLASS_NAMES = [
@@ -82,581 +423,1762 @@ CLASS_NAMES = [
 
 ]
 
-def load_model():
-    global model
+# Class names of the active version (a registry version may bring its own)
+class_names = CLASS_NAMES
+
+def load_model(start=True):
+    global load_error
     try:
-        # Set memory growth for GPU if available
-        gpus = tf.config.experimental.list_physical_devices('GPU')
-        if gpus:
-            try:
-                for gpu in gpus:
-                    tf.config.experimental.set_memory_growth(gpu, True)
-            except RuntimeError as e:
-                print(f"GPU setup warning: {e}")
-        
-        model = tf.keras.models.load_model(MODEL_PATH)
-        print(f"Model loaded successfully from {MODEL_PATH}!")
-        print(f"Model input shape: {model.input_shape}")
-        print(f"Model output shape: {model.output_shape}")
-        print(f"Model expects {model.output_shape[-1]} classes")
-        print(f"We have {len(CLASS_NAMES)} class names defined")
-        if model.output_shape[-1] != len(CLASS_NAMES):
-            print(f"WARNING: Mismatch between model classes ({model.output_shape[-1]}) and defined class names ({len(CLASS_NAMES)})")
+        if INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}' (expected one of {', '.join(INFERENCE_BACKENDS)})")
+        
+        if INFERENCE_BACKEND == 'keras':
+            started = time.perf_counter()
+            import tensorflow as tf
+            # serve.py may already have imported it before forking
+            startup_timings.setdefault('tensorflow_import', time.perf_counter() - started)
+            
+            # Set memory growth for GPU if available
+            gpus = tf.config.experimental.list_physical_devices('GPU')
+            if gpus:
+                try:
+                    for gpu in gpus:
+                        tf.config.experimental.set_memory_growth(gpu, True)
+                except RuntimeError as e:
+                    request_log.log('gpu_setup_failed', {'error': str(e)}, logging.WARNING)
+        
+        activate(load_version(model_entry(), startup_timings))
+        if start:
+            start_pipeline()
         return True
     except Exception as e:
-        print(f"Error loading model: {e}")
-        print(f"Make sure the model file exists at: {os.path.abspath(MODEL_PATH)}")
+        load_error = str(e)
+        # Where the model was expected, for the operator
+        fields = {'error': load_error, 'backend': INFERENCE_BACKEND, 'model_path': os.path.abspath(MODEL_PATH),
+                  'registry_dir': os.path.abspath(MODEL_REGISTRY_DIR)}
+        if INFERENCE_BACKEND != 'keras':
+            fields['tflite_model_dir'] = os.path.abspath(TFLITE_MODEL_DIR)
+        request_log.log('model_load_failed', fields, logging.ERROR)
         return False
 
-def preprocess_image(image_data, target_size=(224, 224)):
+def model_entry(version=None):
+    """
+    ModelEntry of a version (default: the startup version). Without a
+    registry, MODEL_PATH is the only version.
+    """
+    version = version or MODEL_VERSION
+    if registry.versions():
+        return registry.entry(version or registry.active())
+    name = os.path.splitext(os.path.basename(MODEL_PATH))[0]
+    if version not in (None, name):
+        raise RegistryError(f"Unknown model version '{version}' (no versions in {os.path.abspath(MODEL_REGISTRY_DIR)})")
+    return ModelEntry(name, os.path.dirname(MODEL_PATH), backend_model_path(MODEL_PATH), None,
+                      backend_model_path(CASCADE_MODEL_PATH) if CASCADE_MODEL_PATH else None)
+
+def backend_model_path(keras_path):
     """
-    Preprocess the image for model prediction
+    The file INFERENCE_BACKEND loads for a Keras model path: the model
+    itself, or its TFLite variant in TFLITE_MODEL_DIR
+    """
+    if INFERENCE_BACKEND == 'keras':
+        return keras_path
+    name = os.path.splitext(os.path.basename(keras_path))[0]
+    return os.path.join(TFLITE_MODEL_DIR, f"{name}_{INFERENCE_BACKEND.split('-', 1)[1]}.tflite")
+
+def build_runner(path):
+    """
+    (Keras model or None, inference runner) for a model file of INFERENCE_BACKEND
+    """
+    if INFERENCE_BACKEND == 'keras':
+        import tensorflow as tf
+        # Inference only: skip restoring the training configuration
+        model = tf.keras.models.load_model(path, compile=False)
+        # Trace the inference function once (warmed up by the caller)
+        return model, KerasRunner(model)
+    return None, TFLiteRunner(path, num_threads=TFLITE_NUM_THREADS)
+
+def set_inference_threads(num_threads):
+    """
+    Give the loaded TFLite interpreters (and later loads) num_threads
+    threads: serve.py preloads single-threaded ones before forking
+    """
+    global TFLITE_NUM_THREADS
+    TFLITE_NUM_THREADS = num_threads
+    started = time.perf_counter()
+    for loaded_runner in (runner, cascade_runner):
+        if isinstance(loaded_runner, TFLiteRunner):
+            loaded_runner.use_threads(num_threads)
+    # Rebuilding warms the interpreters up again
+    startup_timings['warm_up'] = startup_timings.get('warm_up', 0.0) + time.perf_counter() - started
+
+def load_version(entry, timings=None):
+    """
+    Load and warm up a model version next to the one serving, if any.
+    Returns a LoadedModel; the model_load and warm_up times go into timings.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    model, runner = build_runner(entry.model_path)
+    cascade = None
+    if entry.cascade_path:
+        _, cascade = build_runner(entry.cascade_path)
+        if cascade.num_classes != runner.num_classes:
+            raise ValueError(f"Cascade model {entry.cascade_path} has {cascade.num_classes} classes, "
+                             f"the full model {runner.num_classes}")
+    timings['model_load'] = time.perf_counter() - started
+    
+    names = entry.class_names or CLASS_NAMES
+    request_log.log('model_loaded', {
+        'version': entry.version, 'backend': INFERENCE_BACKEND, 'model_path': entry.model_path,
+        'input_shape': list(runner.input_shape), 'num_classes': runner.num_classes, 'class_names': len(names),
+        'cascade_path': entry.cascade_path, 'seconds': round(timings['model_load'], 3)
+    })
+    if runner.num_classes != len(names):
+        request_log.log('class_count_mismatch', {'version': entry.version, 'num_classes': runner.num_classes,
+                                                 'class_names': len(names)}, logging.WARNING)
+    
+    # Per-class response data is built and serialized once per model
+    catalog = ClassCatalog(names, DISEASE_INFO, DEFAULT_DISEASE_INFO, runner.num_classes,
+                           {'model_version': entry.version, **DETECTION_METADATA})
+    plant_masks = build_plant_masks(runner.num_classes, names)
+    
+    started = time.perf_counter()
+    for stage, stage_runner in (('full', runner), ('small', cascade)):
+        if stage_runner is not None:
+            warmup_timings = stage_runner.warm_up(WARMUP_BATCH_SIZES)
+            # Milliseconds per batch size
+            request_log.log('warm_up', {'version': entry.version, 'stage': stage, 'batch_ms': {
+                str(size): round(ms, 1) for size, ms in warmup_timings.items()
+            }})
+    timings['warm_up'] = time.perf_counter() - started
+    return LoadedModel(entry.version, model_fingerprint(entry.model_path, entry.version), model, runner, names,
+                       catalog, plant_masks, cascade)
+
+def activate(loaded):
+    """
+    Serve requests with a LoadedModel. Only called before requests are
+    served or while model_gate is drained.
+    """
+    global active_model, model, runner, catalog, plant_masks, class_names, loaded_model_version, cascade_runner, \
+        cascade_images_baseline, decode_pool
+    active_model = loaded
+    model, runner, catalog, plant_masks = loaded.model, loaded.runner, loaded.catalog, loaded.plant_masks
+    cascade_runner = loaded.cascade_runner
+    # The previous version's escalation rate says nothing about this one
+    cascade_images_baseline = {stage: cascade_images_total.value(stage) for stage in CASCADE_STAGES}
+    class_names = loaded.class_names
+    loaded_model_version = loaded.fingerprint
+    prediction_cache.set_model_version(loaded_model_version)
+    near_duplicate_index.set_model_version(loaded_model_version, runner.num_classes)
+    if decode_pool is not None and decode_pool.target_size != model_input_size():
+        # The pool's slots are sized for the previous version's input, and
+        # no request holds one while model_gate is drained
+        previous_pool = decode_pool
+        decode_pool = DecodePool(previous_pool.processes, previous_pool.num_slots, model_input_size(),
+                                 max_pixels=previous_pool.max_pixels)
+        previous_pool.close()
+        request_log.log('decode_pool_resized', {'version': loaded.version, 'target_size': list(decode_pool.target_size)})
+
+def start_pipeline():
+    """
+    Start the decode pool (if enabled), the micro-batching worker thread and
+    the hot-swap watcher. None of them survives fork(), so pre-forked serving
+    workers (serve.py) call this in each child.
+    """
+    global batcher, cascade_batcher, decode_pool
+    started = time.perf_counter()
+    if DECODE_PROCESSES > 0:
+        decode_pool = DecodePool(DECODE_PROCESSES, DECODE_SLOTS, model_input_size(), max_pixels=MAX_IMAGE_PIXELS)
+    # Every image in a micro-batch gets its embedding along with its probabilities
+    batcher = MicroBatcher(functools.partial(run_model, embeddings=True), max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+    request_log.log('pipeline_started', {'decode_processes': DECODE_PROCESSES if decode_pool is not None else 0,
+                                         'decode_slots': DECODE_SLOTS, 'max_batch_size': MAX_BATCH_SIZE,
+                                         'max_wait_ms': MAX_BATCH_WAIT_MS})
+    # Idle unless the serving version has a cascade model
+    cascade_batcher = MicroBatcher(run_cascade_model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+    warm_up_pipeline()
+    swap_signal.watch(apply_model_request, worker_slot())
+    startup_timings['pipeline'] = time.perf_counter() - started
+    mark_ready()
+    return batcher
+
+def warm_up_pipeline():
+    """
+    Push one synthetic photo through decode, the batcher and response
+    rendering, so the first real request doesn't initialize any of them
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (60, 120, 40)).save(buffer, format='JPEG')
+    with decode_upload(buffer.getvalue()) as decoded:
+        raw_predictions, _ = batcher.submit(decoded.array)
+        if cascade_runner is not None:
+            cascade_batcher.submit(decoded.array)
+    render_predictions(raw_predictions[np.newaxis, :], [None], [True], [{'cache_hit': False, 'near_duplicate': False}])
+
+def mark_ready():
+    """
+    Record the startup breakdown and start answering /ready with 200
+    """
+    startup_timings['total'] = time.perf_counter() - _import_started
+    for phase, seconds in startup_timings.items():
+        startup_seconds.set(seconds, phase)
+    request_log.log('ready', {'seconds': {phase: round(seconds, 3) for phase, seconds in startup_timings.items()}})
+    ready.set()
+
+def start_background_load():
+    """
+    Load, warm up and start the pipeline in a background thread, so the
+    server answers /live (and /ready with 503) while the model loads.
+    Returns the thread.
+    """
+    def load():
+        # A failure is logged by load_model(); /ready keeps answering 503
+        load_model()
+    thread = threading.Thread(target=load, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+def model_fingerprint(path, version=''):
+    """
+    Identifier of a loaded model file: backend, version, name, size and mtime
+    """
+    stat = os.stat(path)
+    return f'{INFERENCE_BACKEND}:{version}:{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}'
+
+def apply_model_request(version, shadow_mode, shadow_rate, report):
+    """
+    Carry out a swap request in this worker (on its watcher thread): shadow
+    version, or load it, drain the gate and switch to it. A shadowed version
+    that gets promoted is switched in without loading it again.
+    """
+    global shadow
+    try:
+        if shadow_mode:
+            if shadow is not None and shadow.candidate.version == version:
+                shadow.sample_rate = shadow_rate
+                return True
+            report('loading')
+            candidate = load_version(model_entry(version))
+            stop_shadow()
+            shadow = ShadowComparator(candidate, shadow_rate, record_shadow_result)
+            request_log.log('shadow_started', {'version': version, 'sample_rate': shadow_rate})
+        else:
+            candidate = shadow.candidate if shadow is not None and shadow.candidate.version == version else None
+            # Returns once the comparator has stopped using the candidate's
+            # runner, which request threads are about to share
+            stop_shadow()
+            if version == active_model.version:
+                return True
+            if candidate is None:
+                report('loading')
+                candidate = load_version(model_entry(version))
+            report('draining')
+            previous = active_model.version
+            started = time.perf_counter()
+            with model_gate.drained(SWAP_DRAIN_TIMEOUT):
+                drain_seconds = time.perf_counter() - started
+                activate(candidate)
+            if registry.versions():
+                registry.set_active(version)
+            request_log.log('model_swapped', {'from': previous, 'to': version, 'drain_ms': round(drain_seconds * 1000.0, 2)})
+        model_swaps_total.inc('success')
+        return True
+    except Exception as e:
+        model_swaps_total.inc('failed')
+        request_log.log('model_swap_failed', {'version': version, 'shadow': shadow_mode, 'error': str(e)}, logging.ERROR)
+        return False
+
+def stop_shadow():
+    global shadow
+    if shadow is not None:
+        comparator, shadow = shadow, None
+        comparator.close()
+
+def record_shadow_result(agrees, max_abs_diff, details):
+    shadow_comparisons_total.inc('agree' if agrees else 'disagree', details['primary_stage'])
+    if max_abs_diff is not None:
+        shadow_max_abs_diff.observe(max_abs_diff)
+    # Disagreements are logged at the request log's sample rate
+    if not agrees and request_log.sampled():
+        request_log.log('shadow_disagreement', details)
+
+def offer_to_shadow(pixels, output, stage):
+    """
+    Hand a sample of the answered images to the shadow comparator, whichever
+    stage (or cache) the answer came from, so the sample follows the traffic
+    """
+    comparator = shadow
+    if comparator is not None and comparator.sampled():
+        comparator.offer(pixels, output, active_model, stage)
+
+def offer_cached_to_shadow(image_data, output):
+    """
+    offer_to_shadow() for an exact cache hit, which skipped decoding: only a
+    sampled upload is decoded, for the comparator
+    """
+    comparator = shadow
+    if comparator is None or not comparator.sampled():
+        return
+    try:
+        with decode_upload(image_data) as decoded:
+            # Only full-model outputs are cached
+            comparator.offer(decoded.array, output, active_model, 'full')
+    except Exception:
+        pass
+
+def run_model(batch, embeddings=False):
+    """
+    Run one forward pass over a stacked uint8 batch of decoded images
+    (the runner scales, and if needed resizes, them in its graph). With
+    embeddings, returns (probabilities, embeddings) of the same pass.
+    """
+    # Serialize forward passes between the batcher and /predict/batch
+    with model_lock:
+        started = time.perf_counter()
+        outputs, embedding_rows = runner.forward(batch)
+    seconds = time.perf_counter() - started
+    forward_seconds.observe(seconds)
+    batch_size.observe(len(batch))
+    record_forward_time(seconds, len(batch))
+    return (outputs, embedding_rows) if embeddings else outputs
+
+def record_forward_time(seconds, images):
+    global forward_seconds_per_image
+    per_image = seconds / max(1, images)
+    if forward_seconds_per_image is None:
+        forward_seconds_per_image = per_image
+    else:
+        forward_seconds_per_image += 0.05 * (per_image - forward_seconds_per_image)
+
+def check_quality(pixels):
+    """
+    Run the quality gate on a decoded image: (reason, features) if it is
+    rejected (counted, with the inference time it saves), else None. In log
+    mode a failed check is counted and logged, and the image is served.
+    """
+    if quality_gate is None:
+        return None
+    gate_started = time.perf_counter()
+    reason, features = quality_gate.check(pixels)
+    record_stage('quality_gate', time.perf_counter() - gate_started)
+    if reason is None:
+        return None
+    rejected_images_total.inc(reason)
+    if QUALITY_GATE_MODE == 'log':
+        # Logged at the request log's sample rate
+        if request_log.sampled():
+            request_log.log('quality_flagged', {'reason': reason, **{name: round(value, 4) for name, value in features.items()}})
+        return None
+    if forward_seconds_per_image is not None:
+        rejected_seconds_saved_total.inc(amount=forward_seconds_per_image)
+    return reason, {name: round(value, 4) for name, value in features.items()}
+
+def quality_rejection(reason, features=None):
+    """
+    Response body of a rejected image
+    """
+    body = {'success': False, 'error': QUALITY_MESSAGES[reason], 'reason': reason}
+    if features is not None:
+        body['quality'] = features
+    return body
+
+def run_cascade_model(batch):
+    """
+    Forward pass of the cascade's small model (separate from run_model, so
+    the two stages don't wait for each other)
+    """
+    with cascade_lock:
+        return cascade_runner(batch)
+
+def cascade_escalations(predictions, plant_names):
+    """
+    Which rows of a (batch, classes) matrix of small-model outputs need the
+    full model: top-1 confidence or margin too low after plant filtering, or
+    too little probability on the requested plant. Counts the reasons.
+    """
+    filtered, plant_match = filter_predictions_batch(predictions, plant_names)
+    if filtered.shape[1] > 1:
+        second, confidence = np.partition(filtered, -2, axis=1)[:, -2:].T
+    else:
+        second, confidence = np.zeros(len(filtered)), filtered[:, 0]
+    margin = confidence - second
+    reasons = {
+        'confidence': confidence < CASCADE_MIN_CONFIDENCE,
+        'margin': margin < CASCADE_MIN_MARGIN,
+        'plant': ~plant_match
+    }
+    for reason, rows in reasons.items():
+        count = int(rows.sum())
+        if count:
+            cascade_escalations_total.inc(reason, amount=count)
+    return reasons['confidence'] | reasons['margin'] | reasons['plant']
+
+def record_cascade_stages(stages):
+    for stage in CASCADE_STAGES:
+        count = stages.count(stage)
+        if count:
+            cascade_images_total.inc(stage, amount=count)
+
+def model_input_size():
+    """
+    (width, height) images are decoded to: the loaded model's input size
+    """
+    if runner is not None:
+        height, width = runner.input_shape[:2]
+        return (width, height)
+    return DEFAULT_INPUT_SIZE
+
+def preprocess_image(image_data, target_size=None, timings=None):
+    """
+    Preprocess the image for model prediction: a (1, height, width, 3) uint8
+    array at the model's input size. Scaling to [0, 1] happens in the
+    runner's graph (inference.scale_pixels for other consumers).
     """
     try:
         # If image_data is base64 encoded, decode it
         if isinstance(image_data, str):
             image_data = base64.b64decode(image_data)
         
-        # Open image
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize image
-        image = image.resize(target_size)
+        # Decode (at reduced JPEG scale where possible), convert to RGB and resize
+        image = decode_image(image_data, target_size or model_input_size(), max_pixels=MAX_IMAGE_PIXELS, timings=timings)
         
         # Convert to numpy array
-        img_array = np.array(image)
-        
-        # Normalize pixel values to [0, 1]
-        img_array = img_array.astype(np.float32) / 255.0
+        img_array = np.asarray(image, dtype=np.uint8)
         
         # Add batch dimension
         img_array = np.expand_dims(img_array, axis=0)
         
         return img_array
+    except ImageTooLargeError:
+        raise
     except Exception as e:
         print(f"Error preprocessing image: {e}")
         return None
 
+def decode_upload(image_data):
+    """
+    Decode an upload into a uint8 DecodedImage at the model's input size, in
+    the decode pool when it is enabled. Release it once the model has
+    consumed it.
+    """
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+    if decode_pool is not None:
+        return decode_pool.decode(image_data)
+    timings = {}
+    image = decode_image(image_data, model_input_size(), max_pixels=MAX_IMAGE_PIXELS, timings=timings)
+    return DecodedImage(np.asarray(image, dtype=np.uint8), timings)
+
+# Disease knowledge base, enhanced with Bangladesh agricultural context
+DISEASE_INFO = {
+    # Apple Diseases
+    'Apple___Apple_scab': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Captan or Mancozeb fungicide every 7-14 days. Remove infected leaves and fruit immediately. Prune infected branches during dormant season.',
+        'prevention': 'Plant resistant varieties, ensure good air circulation, avoid overhead watering, remove fallen leaves',
+        'causes': 'Fungal infection (Venturia inaequalis), humid conditions, poor air circulation',
+        'symptoms': 'Dark spots on leaves and fruit, premature leaf drop, fruit cracking',
+        'best_practices': 'Apply preventive fungicide in early spring, maintain tree hygiene'
+    },
+    'Apple___Black_rot': {
+        'severity': 'High',
+        'treatment': 'Remove all infected parts immediately. Apply copper-based fungicide (Bordeaux mixture) or Thiophanate-methyl. Sterilize pruning tools.',
+        'prevention': 'Prune for good airflow, sanitize tools between cuts, remove mummified fruit',
+        'causes': 'Fungal infection (Botryosphaeria obtusa), wounds, stress conditions',
+        'symptoms': 'Black circular spots on fruit, cankers on branches, leaf spots with purple margins',
+        'best_practices': 'Regular inspection, proper pruning, avoid tree stress'
+    },
+    'Apple___Cedar_apple_rust': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Propiconazole or Myclobutanil fungicide. Remove nearby cedar trees if possible.',
+        'prevention': 'Plant resistant apple varieties, remove alternative hosts (cedar/juniper)',
+        'causes': 'Fungal infection requiring both apple and cedar/juniper hosts',
+        'symptoms': 'Yellow spots on leaves, orange pustules, premature defoliation',
+        'best_practices': 'Choose resistant varieties, monitor both host plants'
+    },
+
+    # Cherry Diseases  
+    'Cherry_(including_sour)___Powdery_mildew': {
+        'severity': 'Moderate',
+        'treatment': 'Apply sulfur-based fungicide or potassium bicarbonate. Spray early morning or evening. Use Trifloxystrobin for severe cases.',
+        'prevention': 'Ensure good air circulation, avoid overhead watering, plant in sunny locations, proper pruning',
+        'causes': 'Fungal infection (Podosphaera clandestina), high humidity, poor air circulation, warm days with cool nights',
+        'symptoms': 'White powdery coating on leaves, shoots, and fruit. Leaf curling and stunted growth',
+        'best_practices': 'Regular monitoring, preventive spraying, maintain plant hygiene'
+    },
+
+    # Corn Diseases
+    'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Azoxystrobin or Propiconazole fungicide. Remove infected plant debris.',
+        'prevention': 'Crop rotation, avoid dense planting, use resistant varieties',
+        'causes': 'Fungal infection (Cercospora zeae-maydis), warm humid weather',
+        'symptoms': 'Gray rectangular spots on leaves, yellowing, premature senescence',
+        'best_practices': 'Rotate with non-host crops, maintain field hygiene'
+    },
+    'Corn_(maize)___Common_rust_': {
+        'severity': 'Low to Moderate',
+        'treatment': 'Apply Propiconazole or Azoxystrobin if severe. Usually not needed for resistant varieties.',
+        'prevention': 'Plant resistant varieties, ensure good air circulation',
+        'causes': 'Fungal infection (Puccinia sorghi), moderate temperatures, high humidity',
+        'symptoms': 'Orange to reddish pustules on leaves, primarily upper surface',
+        'best_practices': 'Monitor weather conditions, use resistant hybrids'
+    },
+    'Corn_(maize)___Northern_Leaf_Blight': {
+        'severity': 'High',
+        'treatment': 'Apply Azoxystrobin or Propiconazole fungicide. Remove infected plant material.',
+        'prevention': 'Crop rotation, use resistant hybrids, avoid dense planting',
+        'causes': 'Fungal infection (Exserohilum turcicum), warm humid conditions',
+        'symptoms': 'Long elliptical gray-green lesions on leaves, yield reduction',
+        'best_practices': 'Plant resistant varieties, practice crop rotation'
+    },
+
+    # Grape Diseases
+    'Grape___Black_rot': {
+        'severity': 'High',
+        'treatment': 'Apply Mancozeb or Captan fungicide every 7-10 days. Remove infected fruit immediately.',
+        'prevention': 'Ensure good air circulation, avoid overhead watering, prune properly',
+        'causes': 'Fungal infection (Guignardia bidwellii), warm humid weather',
+        'symptoms': 'Circular brown spots on leaves, black mummified berries',
+        'best_practices': 'Remove mummies, preventive spraying, canopy management'
+    },
+    'Grape___Esca_(Black_Measles)': {
+        'severity': 'Very High',
+        'treatment': 'No effective chemical treatment. Remove infected vines, improve soil drainage.',
+        'prevention': 'Avoid pruning wounds during wet weather, use proper pruning techniques',
+        'causes': 'Complex of fungi, pruning wounds, vine stress',
+        'symptoms': 'Tiger stripe pattern on leaves, berry spots, vine dieback',
+        'best_practices': 'Minimize stress, proper pruning timing, vine nutrition'
+    },
+
+    # Potato Diseases
+    'Potato___Early_blight': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Chlorothalonil or Mancozeb fungicide every 7-14 days. Remove infected foliage.',
+        'prevention': 'Crop rotation, avoid overhead irrigation, use certified seed',
+        'causes': 'Fungal infection (Alternaria solani), warm temperatures, high humidity',
+        'symptoms': 'Dark concentric rings on leaves, stem lesions, tuber spots',
+        'best_practices': 'Rotate crops, maintain plant vigor, harvest timing'
+    },
+    'Potato___Late_blight': {
+        'severity': 'Very High',
+        'treatment': 'Immediate application of Metalaxyl or Copper-based fungicide. Remove infected plants.',
+        'prevention': 'Use certified seed, avoid overhead watering, ensure good drainage',
+        'causes': 'Oomycete pathogen (Phytophthora infestans), cool wet conditions',
+        'symptoms': 'Water-soaked lesions, white growth on leaf undersides, tuber rot',
+        'best_practices': 'Weather monitoring, preventive spraying, field sanitation'
+    },
+
+    # Tomato Diseases
+    'Tomato___Bacterial_spot': {
+        'severity': 'Moderate',
+        'treatment': 'Apply copper-based bactericide. Remove infected plants. Use streptomycin if available.',
+        'prevention': 'Use disease-free seeds, avoid overhead watering, crop rotation',
+        'causes': 'Bacterial infection (Xanthomonas species), warm wet conditions',
+        'symptoms': 'Small dark spots on leaves and fruit, yellow halos',
+        'best_practices': 'Sanitation, resistant varieties, copper sprays'
+    },
+    'Tomato___Early_blight': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Chlorothalonil or Azoxystrobin fungicide. Remove lower infected leaves.',
+        'prevention': 'Crop rotation, mulching, proper spacing, avoid overhead watering',
+        'causes': 'Fungal infection (Alternaria solani), warm humid conditions',
+        'symptoms': 'Dark spots with concentric rings on older leaves, stem lesions',
+        'best_practices': 'Lower leaf removal, adequate nutrition, disease monitoring'
+    },
+    'Tomato___Late_blight': {
+        'severity': 'Very High',
+        'treatment': 'Immediate Metalaxyl or Copper fungicide application. Remove infected plants immediately.',
+        'prevention': 'Avoid overhead watering, ensure good air circulation, use resistant varieties',
+        'causes': 'Oomycete pathogen (Phytophthora infestans), cool moist conditions',
+        'symptoms': 'Water-soaked lesions, white growth on leaf undersides, fruit rot',
+        'best_practices': 'Weather monitoring, preventive applications, field sanitation'
+    },
+    'Tomato___Leaf_Mold': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Chlorothalonil or Azoxystrobin fungicide. Improve ventilation.',
+        'prevention': 'Ensure good air circulation, avoid overhead watering, humidity control',
+        'causes': 'Fungal infection (Passalora fulva), high humidity, poor ventilation',
+        'symptoms': 'Yellow spots on upper leaf surface, olive-green growth underneath',
+        'best_practices': 'Greenhouse ventilation, humidity management, resistant varieties'
+    },
+    'Tomato___Septoria_leaf_spot': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Chlorothalonil or Copper fungicide. Remove infected lower leaves.',
+        'prevention': 'Mulching, proper spacing, avoid overhead watering, crop rotation',
+        'causes': 'Fungal infection (Septoria lycopersici), warm wet conditions',
+        'symptoms': 'Small circular spots with dark borders and gray centers',
+        'best_practices': 'Lower leaf removal, mulching, adequate spacing'
+    },
+    'Tomato___Spider_mites Two-spotted_spider_mite': {
+        'severity': 'Moderate',
+        'treatment': 'Apply miticide or insecticidal soap. Increase humidity around plants.',
+        'prevention': 'Regular monitoring, avoid over-fertilization, maintain humidity',
+        'causes': 'Spider mite infestation (Tetranychus urticae), hot dry conditions',
+        'symptoms': 'Yellow stippling on leaves, fine webbing, leaf bronzing',
+        'best_practices': 'Regular inspection, biological control, avoid drought stress'
+    },
+    'Tomato___Target_Spot': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Azoxystrobin or Chlorothalonil fungicide. Remove infected debris.',
+        'prevention': 'Crop rotation, avoid overhead watering, proper plant spacing',
+        'causes': 'Fungal infection (Corynespora cassiicola), warm humid conditions',
+        'symptoms': 'Circular spots with concentric rings, yellow halos',
+        'best_practices': 'Field sanitation, resistant varieties, preventive spraying'
+    },
+    'Tomato___Tomato_Yellow_Leaf_Curl_Virus': {
+        'severity': 'Very High',
+        'treatment': 'No chemical treatment. Remove infected plants. Control whitefly vectors.',
+        'prevention': 'Use resistant varieties, control whiteflies, remove infected plants',
+        'causes': 'Viral infection transmitted by whiteflies (Bemisia tabaci)',
+        'symptoms': 'Yellow curled leaves, stunted growth, reduced fruit production',
+        'best_practices': 'Vector control, resistant varieties, field sanitation'
+    },
+    'Tomato___Tomato_mosaic_virus': {
+        'severity': 'High',
+        'treatment': 'No chemical treatment. Remove infected plants. Disinfect tools.',
+        'prevention': 'Use virus-free seeds, avoid tobacco use, sanitize tools',
+        'causes': 'Viral infection, mechanical transmission, infected seeds',
+        'symptoms': 'Mosaic pattern on leaves, fruit distortion, stunted growth',
+        'best_practices': 'Sanitation, certified seeds, tool disinfection'
+    },
+
+    # Additional Diseases
+    'Pepper,_bell___Bacterial_spot': {
+        'severity': 'Moderate',
+        'treatment': 'Apply copper-based bactericide. Remove infected plants.',
+        'prevention': 'Use disease-free seeds, avoid overhead watering, crop rotation',
+        'causes': 'Bacterial infection (Xanthomonas species), warm wet conditions',
+        'symptoms': 'Small dark spots on leaves and fruit, yellow halos',
+        'best_practices': 'Sanitation, resistant varieties, copper applications'
+    },
+    'Squash___Powdery_mildew': {
+        'severity': 'Moderate',
+        'treatment': 'Apply sulfur or potassium bicarbonate fungicide. Improve air circulation.',
+        'prevention': 'Plant resistant varieties, ensure good spacing, avoid overhead watering',
+        'causes': 'Fungal infection, high humidity, poor air circulation',
+        'symptoms': 'White powdery coating on leaves, reduced photosynthesis',
+        'best_practices': 'Resistant varieties, proper spacing, preventive treatments'
+    },
+    'Strawberry___Leaf_scorch': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Captan or Myclobutanil fungicide. Remove infected leaves.',
+        'prevention': 'Proper spacing, avoid overhead watering, crop rotation',
+        'causes': 'Fungal infection (Diplocarpon earlianum), warm humid conditions',
+        'symptoms': 'Purple to dark red spots on leaves, leaf margins turn brown',
+        'best_practices': 'Variety selection, field sanitation, preventive spraying'
+    },
+
+    # Wheat Diseases
+    'Wheat___Yellow_Rust': {
+        'severity': 'High',
+        'treatment': 'Apply Propiconazole or Tebuconazole fungicide immediately. Multiple applications may be needed.',
+        'prevention': 'Plant resistant varieties, monitor weather conditions, early detection',
+        'causes': 'Fungal infection (Puccinia striiformis), cool moist conditions, susceptible varieties',
+        'symptoms': 'Yellow to orange pustules in stripes on leaves, reduced grain yield',
+        'best_practices': 'Use resistant varieties, timely fungicide application, field monitoring'
+    },
+    'Wheat___healthy': {
+        'severity': 'None',
+        'treatment': 'No treatment needed - maintain current management practices',
+        'prevention': 'Continue regular monitoring and good agricultural practices',
+        'causes': 'Plant is healthy',
+        'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
+        'best_practices': 'Balanced nutrition, proper irrigation, regular field inspection'
+    },
+    'Wheat___black_rust': {
+        'severity': 'Very High',
+        'treatment': 'Immediate application of Propiconazole or Triazole fungicides. Remove severely infected plants.',
+        'prevention': 'Plant resistant varieties, eliminate alternate hosts (barberry), monitor conditions',
+        'causes': 'Fungal infection (Puccinia graminis), warm temperatures, moderate humidity',
+        'symptoms': 'Black pustules on stems and leaves, plant weakness, lodging',
+        'best_practices': 'Resistant varieties, early detection, fungicide rotation'
+    },
+    'Wheat___brown_leaf_rust': {
+        'severity': 'Moderate to High',
+        'treatment': 'Apply Propiconazole or Azoxystrobin fungicide. Monitor and repeat if needed.',
+        'prevention': 'Plant resistant varieties, proper field hygiene, timely harvesting',
+        'causes': 'Fungal infection (Puccinia triticina), moderate temperatures, humidity',
+        'symptoms': 'Brown circular pustules on leaf surface, yellowing of leaves',
+        'best_practices': 'Variety selection, field sanitation, preventive spraying'
+    },
+    'Wheat___leaf_blight': {
+        'severity': 'Moderate',
+        'treatment': 'Apply Mancozeb or Chlorothalonil fungicide. Remove infected debris.',
+        'prevention': 'Crop rotation, balanced fertilization, avoid dense planting',
+        'causes': 'Fungal infection (various species), warm humid conditions, poor drainage',
+        'symptoms': 'Brown to gray lesions on leaves, premature senescence, yield loss',
+        'best_practices': 'Field drainage, proper spacing, residue management'
+    },
+    'Wheat___mite': {
+        'severity': 'Moderate',
+        'treatment': 'Apply miticide or insecticidal soap. Use Abamectin or Spiromesifen for severe infestations.',
+        'prevention': 'Regular monitoring, avoid drought stress, maintain field hygiene',
+        'causes': 'Mite infestation (various species), hot dry conditions, plant stress',
+        'symptoms': 'Yellow stippling on leaves, fine webbing, reduced vigor',
+        'best_practices': 'Early detection, biological control, avoid over-fertilization'
+    },
+    'Wheat___powdery_mildew': {
+        'severity': 'Moderate',
+        'treatment': 'Apply sulfur-based fungicide or Propiconazole. Improve air circulation.',
+        'prevention': 'Plant resistant varieties, avoid dense planting, proper nutrition',
+        'causes': 'Fungal infection (Blumeria graminis), high humidity, poor air circulation',
+        'symptoms': 'White powdery coating on leaves, reduced photosynthesis, stunted growth',
+        'best_practices': 'Resistant varieties, balanced fertilization, field monitoring'
+    },
+    'Wheat___scab': {
+        'severity': 'Very High',
+        'treatment': 'Apply Metconazole or Prothioconazole at flowering. Multiple applications may be needed.',
+        'prevention': 'Crop rotation, residue management, avoid susceptible varieties',
+        'causes': 'Fungal infection (Fusarium graminearum), wet conditions during flowering',
+        'symptoms': 'Bleached spikelets, pink-orange fungal growth, shriveled grains, mycotoxins',
+        'best_practices': 'Timely fungicide application, crop rotation, residue management'
+    },
+    'Wheat___stem_fly': {
+        'severity': 'Moderate',
+        'treatment': 'Apply appropriate insecticide (Chlorpyrifos or Cypermethrin) during early infestation.',
+        'prevention': 'Early planting, destroy crop residues, use pheromone traps',
+        'causes': 'Insect pest (stem fly larvae), environmental conditions favoring pest development',
+        'symptoms': 'Yellowing and wilting of plants, stem damage, reduced tillering',
+        'best_practices': 'Integrated pest management, field sanitation, resistant varieties'
+    },
+    
+    # Rice Diseases
+    'Rice___Brown_spot': {
+        'severity': 'Moderate to High',
+        'treatment': 'Apply Mancozeb or Propiconazole fungicide. Improve field drainage and avoid over-fertilization with nitrogen.',
+        'prevention': 'Balanced fertilization, proper water management, use resistant varieties',
+        'causes': 'Fungal infection (Bipolaris oryzae), nitrogen deficiency, poor water management',
+        'symptoms': 'Brown spots with yellow halos on leaves, reduced grain quality, stunted growth',
+        'best_practices': 'Balanced nutrition, proper water management, seed treatment'
+    },
+    'Rice___Blast': {
+        'severity': 'Very High',
+        'treatment': 'Apply Tricyclazole or Azoxystrobin immediately. Multiple applications may be needed.',
+        'prevention': 'Use resistant varieties, avoid excessive nitrogen, proper water management',
+        'causes': 'Fungal infection (Magnaporthe oryzae), high humidity, excessive nitrogen',
+        'symptoms': 'Diamond-shaped lesions on leaves, neck rot, panicle blast, yield loss',
+        'best_practices': 'Resistant varieties, balanced fertilization, early detection'
+    },
+    'Rice___healthy': {
+        'severity': 'None',
+        'treatment': 'No treatment needed - maintain current management practices',
+        'prevention': 'Continue regular monitoring and good agricultural practices',
+        'causes': 'Plant is healthy',
+        'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
+        'best_practices': 'Balanced nutrition, proper water management, regular field inspection'
+    },
+    
+    # Cotton Diseases
+    'Cotton___diseased': {
+        'severity': 'Moderate to High',
+        'treatment': 'Apply appropriate fungicide or insecticide based on specific disease/pest identification. Consult agricultural expert.',
+        'prevention': 'Use resistant varieties, proper spacing, field sanitation, crop rotation',
+        'causes': 'Various fungal, bacterial, or pest-related issues',
+        'symptoms': 'Yellowing, spots, wilting, or other abnormal appearance',
+        'best_practices': 'Regular monitoring, integrated pest management, proper cultural practices'
+    },
+    'Cotton___healthy': {
+        'severity': 'None',
+        'treatment': 'No treatment needed - maintain current management practices',
+        'prevention': 'Continue regular monitoring and good agricultural practices',
+        'causes': 'Plant is healthy',
+        'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
+        'best_practices': 'Balanced nutrition, proper irrigation, regular field inspection'
+    }
+}
+
+# Used for classes without a DISEASE_INFO entry
+DEFAULT_DISEASE_INFO = {
+    'severity': 'Unknown',
+    'treatment': 'Consult with local agricultural expert or extension service for specific treatment recommendations',
+    'prevention': 'Follow general plant care practices: proper spacing, good drainage, crop rotation',
+    'causes': 'Disease cause requires further investigation',
+    'symptoms': 'Monitor plant for unusual changes in appearance',
+    'best_practices': 'Regular monitoring, proper cultural practices, seek expert advice'
+}
+
 def get_disease_info(disease_name):
     """
     Get comprehensive information about the detected disease
     Enhanced with Bangladesh agricultural context
     """
-    disease_info = {
-        # Apple Diseases
-        'Apple___Apple_scab': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Captan or Mancozeb fungicide every 7-14 days. Remove infected leaves and fruit immediately. Prune infected branches during dormant season.',
-            'prevention': 'Plant resistant varieties, ensure good air circulation, avoid overhead watering, remove fallen leaves',
-            'causes': 'Fungal infection (Venturia inaequalis), humid conditions, poor air circulation',
-            'symptoms': 'Dark spots on leaves and fruit, premature leaf drop, fruit cracking',
-            'best_practices': 'Apply preventive fungicide in early spring, maintain tree hygiene'
-        },
-        'Apple___Black_rot': {
-            'severity': 'High',
-            'treatment': 'Remove all infected parts immediately. Apply copper-based fungicide (Bordeaux mixture) or Thiophanate-methyl. Sterilize pruning tools.',
-            'prevention': 'Prune for good airflow, sanitize tools between cuts, remove mummified fruit',
-            'causes': 'Fungal infection (Botryosphaeria obtusa), wounds, stress conditions',
-            'symptoms': 'Black circular spots on fruit, cankers on branches, leaf spots with purple margins',
-            'best_practices': 'Regular inspection, proper pruning, avoid tree stress'
-        },
-        'Apple___Cedar_apple_rust': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Propiconazole or Myclobutanil fungicide. Remove nearby cedar trees if possible.',
-            'prevention': 'Plant resistant apple varieties, remove alternative hosts (cedar/juniper)',
-            'causes': 'Fungal infection requiring both apple and cedar/juniper hosts',
-            'symptoms': 'Yellow spots on leaves, orange pustules, premature defoliation',
-            'best_practices': 'Choose resistant varieties, monitor both host plants'
-        },
+    return DISEASE_INFO.get(disease_name, DEFAULT_DISEASE_INFO)
 
-        # Cherry Diseases  
-        'Cherry_(including_sour)___Powdery_mildew': {
-            'severity': 'Moderate',
-            'treatment': 'Apply sulfur-based fungicide or potassium bicarbonate. Spray early morning or evening. Use Trifloxystrobin for severe cases.',
-            'prevention': 'Ensure good air circulation, avoid overhead watering, plant in sunny locations, proper pruning',
-            'causes': 'Fungal infection (Podosphaera clandestina), high humidity, poor air circulation, warm days with cool nights',
-            'symptoms': 'White powdery coating on leaves, shoots, and fruit. Leaf curling and stunted growth',
-            'best_practices': 'Regular monitoring, preventive spraying, maintain plant hygiene'
-        },
+def cascade_stats():
+    if cascade_runner is None:
+        # Counts left over from a previous version's cascade are not shown
+        return {'enabled': False, 'min_confidence': CASCADE_MIN_CONFIDENCE, 'min_margin': CASCADE_MIN_MARGIN,
+                'images': None, 'escalation_rate': None, 'batching': None}
+    # Images per stage since the serving version was activated, summed over
+    # all serve.py workers
+    images = {
+        stage: int(cascade_images_total.value(stage) - cascade_images_baseline.get(stage, 0.0))
+        for stage in CASCADE_STAGES
+    }
+    total = sum(images.values())
+    return {
+        'enabled': True,
+        'min_confidence': CASCADE_MIN_CONFIDENCE,
+        'min_margin': CASCADE_MIN_MARGIN,
+        'images': images,
+        'escalation_rate': (images['full'] / total) if total else None,
+        'batching': cascade_batcher.stats() if cascade_batcher is not None else None
+    }
 
-        # Corn Diseases
-        'Corn_(maize)___Cercospora_leaf_spot Gray_leaf_spot': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Azoxystrobin or Propiconazole fungicide. Remove infected plant debris.',
-            'prevention': 'Crop rotation, avoid dense planting, use resistant varieties',
-            'causes': 'Fungal infection (Cercospora zeae-maydis), warm humid weather',
-            'symptoms': 'Gray rectangular spots on leaves, yellowing, premature senescence',
-            'best_practices': 'Rotate with non-host crops, maintain field hygiene'
-        },
-        'Corn_(maize)___Common_rust_': {
-            'severity': 'Low to Moderate',
-            'treatment': 'Apply Propiconazole or Azoxystrobin if severe. Usually not needed for resistant varieties.',
-            'prevention': 'Plant resistant varieties, ensure good air circulation',
-            'causes': 'Fungal infection (Puccinia sorghi), moderate temperatures, high humidity',
-            'symptoms': 'Orange to reddish pustules on leaves, primarily upper surface',
-            'best_practices': 'Monitor weather conditions, use resistant hybrids'
-        },
-        'Corn_(maize)___Northern_Leaf_Blight': {
-            'severity': 'High',
-            'treatment': 'Apply Azoxystrobin or Propiconazole fungicide. Remove infected plant material.',
-            'prevention': 'Crop rotation, use resistant hybrids, avoid dense planting',
-            'causes': 'Fungal infection (Exserohilum turcicum), warm humid conditions',
-            'symptoms': 'Long elliptical gray-green lesions on leaves, yield reduction',
-            'best_practices': 'Plant resistant varieties, practice crop rotation'
-        },
+def quality_stats():
+    # Rejections are summed over all serve.py workers
+    rejected = {reason: int(rejected_images_total.value(reason)) for reason in QUALITY_REASONS}
+    return {
+        'enabled': quality_gate is not None,
+        'mode': QUALITY_GATE_MODE,
+        'rejected': rejected,
+        'inference_seconds_saved': round(rejected_seconds_saved_total.value(), 3)
+    }
 
-        # Grape Diseases
-        'Grape___Black_rot': {
-            'severity': 'High',
-            'treatment': 'Apply Mancozeb or Captan fungicide every 7-10 days. Remove infected fruit immediately.',
-            'prevention': 'Ensure good air circulation, avoid overhead watering, prune properly',
-            'causes': 'Fungal infection (Guignardia bidwellii), warm humid weather',
-            'symptoms': 'Circular brown spots on leaves, black mummified berries',
-            'best_practices': 'Remove mummies, preventive spraying, canopy management'
-        },
-        'Grape___Esca_(Black_Measles)': {
-            'severity': 'Very High',
-            'treatment': 'No effective chemical treatment. Remove infected vines, improve soil drainage.',
-            'prevention': 'Avoid pruning wounds during wet weather, use proper pruning techniques',
-            'causes': 'Complex of fungi, pruning wounds, vine stress',
-            'symptoms': 'Tiger stripe pattern on leaves, berry spots, vine dieback',
-            'best_practices': 'Minimize stress, proper pruning timing, vine nutrition'
-        },
+def similarity_index(version):
+    """
+    SimilarityIndex of a model version's embeddings (its files are created by
+    the first add)
+    """
+    with similarity_lock:
+        index = similarity_indexes.get(version)
+        if index is None:
+            index = SimilarityIndex(os.path.join(SIMILARITY_INDEX_DIR, version), nprobe=SIMILAR_NPROBE,
+                                    rebuild_fraction=SIMILAR_REBUILD_FRACTION)
+            similarity_indexes[version] = index
+        return index
 
-        # Potato Diseases
-        'Potato___Early_blight': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Chlorothalonil or Mancozeb fungicide every 7-14 days. Remove infected foliage.',
-            'prevention': 'Crop rotation, avoid overhead irrigation, use certified seed',
-            'causes': 'Fungal infection (Alternaria solani), warm temperatures, high humidity',
-            'symptoms': 'Dark concentric rings on leaves, stem lesions, tuber spots',
-            'best_practices': 'Rotate crops, maintain plant vigor, harvest timing'
-        },
-        'Potato___Late_blight': {
-            'severity': 'Very High',
-            'treatment': 'Immediate application of Metalaxyl or Copper-based fungicide. Remove infected plants.',
-            'prevention': 'Use certified seed, avoid overhead watering, ensure good drainage',
-            'causes': 'Oomycete pathogen (Phytophthora infestans), cool wet conditions',
-            'symptoms': 'Water-soaked lesions, white growth on leaf undersides, tuber rot',
-            'best_practices': 'Weather monitoring, preventive spraying, field sanitation'
-        },
+def similarity_stats():
+    return {
+        'embedding_size': runner.embedding_size if runner is not None else None,
+        'path': os.path.abspath(SIMILARITY_INDEX_DIR),
+        'index': similarity_index(active_model.version).stats() if active_model is not None else None
+    }
 
-        # Tomato Diseases
-        'Tomato___Bacterial_spot': {
-            'severity': 'Moderate',
-            'treatment': 'Apply copper-based bactericide. Remove infected plants. Use streptomycin if available.',
-            'prevention': 'Use disease-free seeds, avoid overhead watering, crop rotation',
-            'causes': 'Bacterial infection (Xanthomonas species), warm wet conditions',
-            'symptoms': 'Small dark spots on leaves and fruit, yellow halos',
-            'best_practices': 'Sanitation, resistant varieties, copper sprays'
-        },
-        'Tomato___Early_blight': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Chlorothalonil or Azoxystrobin fungicide. Remove lower infected leaves.',
-            'prevention': 'Crop rotation, mulching, proper spacing, avoid overhead watering',
-            'causes': 'Fungal infection (Alternaria solani), warm humid conditions',
-            'symptoms': 'Dark spots with concentric rings on older leaves, stem lesions',
-            'best_practices': 'Lower leaf removal, adequate nutrition, disease monitoring'
-        },
-        'Tomato___Late_blight': {
-            'severity': 'Very High',
-            'treatment': 'Immediate Metalaxyl or Copper fungicide application. Remove infected plants immediately.',
-            'prevention': 'Avoid overhead watering, ensure good air circulation, use resistant varieties',
-            'causes': 'Oomycete pathogen (Phytophthora infestans), cool moist conditions',
-            'symptoms': 'Water-soaked lesions, white growth on leaf undersides, fruit rot',
-            'best_practices': 'Weather monitoring, preventive applications, field sanitation'
-        },
-        'Tomato___Leaf_Mold': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Chlorothalonil or Azoxystrobin fungicide. Improve ventilation.',
-            'prevention': 'Ensure good air circulation, avoid overhead watering, humidity control',
-            'causes': 'Fungal infection (Passalora fulva), high humidity, poor ventilation',
-            'symptoms': 'Yellow spots on upper leaf surface, olive-green growth underneath',
-            'best_practices': 'Greenhouse ventilation, humidity management, resistant varieties'
-        },
-        'Tomato___Septoria_leaf_spot': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Chlorothalonil or Copper fungicide. Remove infected lower leaves.',
-            'prevention': 'Mulching, proper spacing, avoid overhead watering, crop rotation',
-            'causes': 'Fungal infection (Septoria lycopersici), warm wet conditions',
-            'symptoms': 'Small circular spots with dark borders and gray centers',
-            'best_practices': 'Lower leaf removal, mulching, adequate spacing'
-        },
-        'Tomato___Spider_mites Two-spotted_spider_mite': {
-            'severity': 'Moderate',
-            'treatment': 'Apply miticide or insecticidal soap. Increase humidity around plants.',
-            'prevention': 'Regular monitoring, avoid over-fertilization, maintain humidity',
-            'causes': 'Spider mite infestation (Tetranychus urticae), hot dry conditions',
-            'symptoms': 'Yellow stippling on leaves, fine webbing, leaf bronzing',
-            'best_practices': 'Regular inspection, biological control, avoid drought stress'
-        },
-        'Tomato___Target_Spot': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Azoxystrobin or Chlorothalonil fungicide. Remove infected debris.',
-            'prevention': 'Crop rotation, avoid overhead watering, proper plant spacing',
-            'causes': 'Fungal infection (Corynespora cassiicola), warm humid conditions',
-            'symptoms': 'Circular spots with concentric rings, yellow halos',
-            'best_practices': 'Field sanitation, resistant varieties, preventive spraying'
-        },
-        'Tomato___Tomato_Yellow_Leaf_Curl_Virus': {
-            'severity': 'Very High',
-            'treatment': 'No chemical treatment. Remove infected plants. Control whitefly vectors.',
-            'prevention': 'Use resistant varieties, control whiteflies, remove infected plants',
-            'causes': 'Viral infection transmitted by whiteflies (Bemisia tabaci)',
-            'symptoms': 'Yellow curled leaves, stunted growth, reduced fruit production',
-            'best_practices': 'Vector control, resistant varieties, field sanitation'
-        },
-        'Tomato___Tomato_mosaic_virus': {
-            'severity': 'High',
-            'treatment': 'No chemical treatment. Remove infected plants. Disinfect tools.',
-            'prevention': 'Use virus-free seeds, avoid tobacco use, sanitize tools',
-            'causes': 'Viral infection, mechanical transmission, infected seeds',
-            'symptoms': 'Mosaic pattern on leaves, fruit distortion, stunted growth',
-            'best_practices': 'Sanitation, certified seeds, tool disinfection'
-        },
+@app.route('/health', methods=['GET'])
+def health_check():
+    # Not subject to admission control, so it answers even when saturated
+    batching = batcher.stats() if batcher is not None else None
+    admission_stats = admission.stats()
+    return jsonify({
+        'status': 'healthy',
+        'model_loaded': runner is not None,
+        'ready': ready.is_set(),
+        'startup_seconds': startup_timings,
+        'inference_backend': INFERENCE_BACKEND,
+        'model_version': active_model.version if active_model is not None else None,
+        'shadow': shadow.stats() if shadow is not None else None,
+        'cascade': cascade_stats(),
+        'quality_gate': quality_stats(),
+        'similarity': similarity_stats(),
+        'queue_depth': admission_stats['queued'] + (batching['queue_depth'] if batching else 0),
+        'admission': admission_stats,
+        'batching': batching,
+        'decode_pool': decode_pool.stats() if decode_pool is not None else None,
+        'prediction_cache': prediction_cache.stats(),
+        'near_duplicates': near_duplicate_index.stats()
+    })
 
-        # Additional Diseases
-        'Pepper,_bell___Bacterial_spot': {
-            'severity': 'Moderate',
-            'treatment': 'Apply copper-based bactericide. Remove infected plants.',
-            'prevention': 'Use disease-free seeds, avoid overhead watering, crop rotation',
-            'causes': 'Bacterial infection (Xanthomonas species), warm wet conditions',
-            'symptoms': 'Small dark spots on leaves and fruit, yellow halos',
-            'best_practices': 'Sanitation, resistant varieties, copper applications'
-        },
-        'Squash___Powdery_mildew': {
-            'severity': 'Moderate',
-            'treatment': 'Apply sulfur or potassium bicarbonate fungicide. Improve air circulation.',
-            'prevention': 'Plant resistant varieties, ensure good spacing, avoid overhead watering',
-            'causes': 'Fungal infection, high humidity, poor air circulation',
-            'symptoms': 'White powdery coating on leaves, reduced photosynthesis',
-            'best_practices': 'Resistant varieties, proper spacing, preventive treatments'
-        },
-        'Strawberry___Leaf_scorch': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Captan or Myclobutanil fungicide. Remove infected leaves.',
-            'prevention': 'Proper spacing, avoid overhead watering, crop rotation',
-            'causes': 'Fungal infection (Diplocarpon earlianum), warm humid conditions',
-            'symptoms': 'Purple to dark red spots on leaves, leaf margins turn brown',
-            'best_practices': 'Variety selection, field sanitation, preventive spraying'
-        },
+@app.route('/live', methods=['GET'])
+def liveness():
+    # The process is up and serving HTTP; only a failed model load makes it
+    # worth restarting
+    if load_error is not None:
+        return jsonify({'status': 'failed', 'error': load_error}), 503
+    return jsonify({'status': 'alive'})
 
-        # Wheat Diseases
-        'Wheat___Yellow_Rust': {
-            'severity': 'High',
-            'treatment': 'Apply Propiconazole or Tebuconazole fungicide immediately. Multiple applications may be needed.',
-            'prevention': 'Plant resistant varieties, monitor weather conditions, early detection',
-            'causes': 'Fungal infection (Puccinia striiformis), cool moist conditions, susceptible varieties',
-            'symptoms': 'Yellow to orange pustules in stripes on leaves, reduced grain yield',
-            'best_practices': 'Use resistant varieties, timely fungicide application, field monitoring'
-        },
-        'Wheat___healthy': {
-            'severity': 'None',
-            'treatment': 'No treatment needed - maintain current management practices',
-            'prevention': 'Continue regular monitoring and good agricultural practices',
-            'causes': 'Plant is healthy',
-            'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
-            'best_practices': 'Balanced nutrition, proper irrigation, regular field inspection'
-        },
-        'Wheat___black_rust': {
-            'severity': 'Very High',
-            'treatment': 'Immediate application of Propiconazole or Triazole fungicides. Remove severely infected plants.',
-            'prevention': 'Plant resistant varieties, eliminate alternate hosts (barberry), monitor conditions',
-            'causes': 'Fungal infection (Puccinia graminis), warm temperatures, moderate humidity',
-            'symptoms': 'Black pustules on stems and leaves, plant weakness, lodging',
-            'best_practices': 'Resistant varieties, early detection, fungicide rotation'
-        },
-        'Wheat___brown_leaf_rust': {
-            'severity': 'Moderate to High',
-            'treatment': 'Apply Propiconazole or Azoxystrobin fungicide. Monitor and repeat if needed.',
-            'prevention': 'Plant resistant varieties, proper field hygiene, timely harvesting',
-            'causes': 'Fungal infection (Puccinia triticina), moderate temperatures, humidity',
-            'symptoms': 'Brown circular pustules on leaf surface, yellowing of leaves',
-            'best_practices': 'Variety selection, field sanitation, preventive spraying'
-        },
-        'Wheat___leaf_blight': {
-            'severity': 'Moderate',
-            'treatment': 'Apply Mancozeb or Chlorothalonil fungicide. Remove infected debris.',
-            'prevention': 'Crop rotation, balanced fertilization, avoid dense planting',
-            'causes': 'Fungal infection (various species), warm humid conditions, poor drainage',
-            'symptoms': 'Brown to gray lesions on leaves, premature senescence, yield loss',
-            'best_practices': 'Field drainage, proper spacing, residue management'
-        },
-        'Wheat___mite': {
-            'severity': 'Moderate',
-            'treatment': 'Apply miticide or insecticidal soap. Use Abamectin or Spiromesifen for severe infestations.',
-            'prevention': 'Regular monitoring, avoid drought stress, maintain field hygiene',
-            'causes': 'Mite infestation (various species), hot dry conditions, plant stress',
-            'symptoms': 'Yellow stippling on leaves, fine webbing, reduced vigor',
-            'best_practices': 'Early detection, biological control, avoid over-fertilization'
-        },
-        'Wheat___powdery_mildew': {
-            'severity': 'Moderate',
-            'treatment': 'Apply sulfur-based fungicide or Propiconazole. Improve air circulation.',
-            'prevention': 'Plant resistant varieties, avoid dense planting, proper nutrition',
-            'causes': 'Fungal infection (Blumeria graminis), high humidity, poor air circulation',
-            'symptoms': 'White powdery coating on leaves, reduced photosynthesis, stunted growth',
-            'best_practices': 'Resistant varieties, balanced fertilization, field monitoring'
-        },
-        'Wheat___scab': {
-            'severity': 'Very High',
-            'treatment': 'Apply Metconazole or Prothioconazole at flowering. Multiple applications may be needed.',
-            'prevention': 'Crop rotation, residue management, avoid susceptible varieties',
-            'causes': 'Fungal infection (Fusarium graminearum), wet conditions during flowering',
-            'symptoms': 'Bleached spikelets, pink-orange fungal growth, shriveled grains, mycotoxins',
-            'best_practices': 'Timely fungicide application, crop rotation, residue management'
-        },
-        'Wheat___stem_fly': {
-            'severity': 'Moderate',
-            'treatment': 'Apply appropriate insecticide (Chlorpyrifos or Cypermethrin) during early infestation.',
-            'prevention': 'Early planting, destroy crop residues, use pheromone traps',
-            'causes': 'Insect pest (stem fly larvae), environmental conditions favoring pest development',
-            'symptoms': 'Yellowing and wilting of plants, stem damage, reduced tillering',
-            'best_practices': 'Integrated pest management, field sanitation, resistant varieties'
-        },
-        
-        # Rice Diseases
-        'Rice___Brown_spot': {
-            'severity': 'Moderate to High',
-            'treatment': 'Apply Mancozeb or Propiconazole fungicide. Improve field drainage and avoid over-fertilization with nitrogen.',
-            'prevention': 'Balanced fertilization, proper water management, use resistant varieties',
-            'causes': 'Fungal infection (Bipolaris oryzae), nitrogen deficiency, poor water management',
-            'symptoms': 'Brown spots with yellow halos on leaves, reduced grain quality, stunted growth',
-            'best_practices': 'Balanced nutrition, proper water management, seed treatment'
-        },
-        'Rice___Blast': {
-            'severity': 'Very High',
-            'treatment': 'Apply Tricyclazole or Azoxystrobin immediately. Multiple applications may be needed.',
-            'prevention': 'Use resistant varieties, avoid excessive nitrogen, proper water management',
-            'causes': 'Fungal infection (Magnaporthe oryzae), high humidity, excessive nitrogen',
-            'symptoms': 'Diamond-shaped lesions on leaves, neck rot, panicle blast, yield loss',
-            'best_practices': 'Resistant varieties, balanced fertilization, early detection'
-        },
-        'Rice___healthy': {
-            'severity': 'None',
-            'treatment': 'No treatment needed - maintain current management practices',
-            'prevention': 'Continue regular monitoring and good agricultural practices',
-            'causes': 'Plant is healthy',
-            'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
-            'best_practices': 'Balanced nutrition, proper water management, regular field inspection'
-        },
-        
-        # Cotton Diseases
-        'Cotton___diseased': {
-            'severity': 'Moderate to High',
-            'treatment': 'Apply appropriate fungicide or insecticide based on specific disease/pest identification. Consult agricultural expert.',
-            'prevention': 'Use resistant varieties, proper spacing, field sanitation, crop rotation',
-            'causes': 'Various fungal, bacterial, or pest-related issues',
-            'symptoms': 'Yellowing, spots, wilting, or other abnormal appearance',
-            'best_practices': 'Regular monitoring, integrated pest management, proper cultural practices'
+@app.route('/ready', methods=['GET'])
+def readiness():
+    # 200 once the model is loaded, warmed up and the pipeline is running
+    if not ready.is_set():
+        return jsonify({'status': 'failed' if load_error is not None else 'loading', 'startup_seconds': startup_timings}), 503
+    return jsonify({'status': 'ready', 'inference_backend': INFERENCE_BACKEND, 'model_version': active_model.version,
+                    'startup_seconds': startup_timings})
+
+def admin_error():
+    """
+    Error response if the request may not use admin endpoints, else None
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """
+    GET: profiler status. DELETE: disarm. POST: profile the next `requests`
+    /predict calls (optional: sample_rate, max_seconds, tf_trace).
+    """
+    error = admin_error()
+    if error is not None:
+        return error
+    if request.method == 'DELETE':
+        return jsonify(profiler.disarm())
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    
+    params = request.get_json(silent=True) or request.values
+    try:
+        requests = int(params.get('requests', 10))
+        sample_rate = float(params.get('sample_rate', 1.0))
+        max_seconds = float(params.get('max_seconds', 300))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'requests, sample_rate and max_seconds must be numbers'}), 400
+    if not 1 <= requests <= MAX_PROFILED_REQUESTS or not 0 < sample_rate <= 1 or max_seconds <= 0:
+        return jsonify({'error': f'Expected 1 <= requests <= {MAX_PROFILED_REQUESTS}, 0 < sample_rate <= 1, max_seconds > 0'}), 400
+    # Without a tf_trace parameter the profiler traces if TensorFlow is installed
+    tf_trace = params.get('tf_trace')
+    if tf_trace is not None:
+        tf_trace = str(tf_trace).lower() not in ('0', 'false', 'no')
+    return jsonify(profiler.arm(requests, sample_rate, max_seconds, tf_trace))
+
+def model_status():
+    generation, version, shadow_mode, shadow_rate = swap_signal.current()
+    comparator = shadow
+    return {
+        'version': active_model.version if active_model is not None else None,
+        'shadow': comparator.stats() if comparator is not None else None,
+        'registry': {
+            'path': os.path.abspath(MODEL_REGISTRY_DIR),
+            'versions': registry.versions(),
+            'active': registry.active()
         },
-        'Cotton___healthy': {
-            'severity': 'None',
-            'treatment': 'No treatment needed - maintain current management practices',
-            'prevention': 'Continue regular monitoring and good agricultural practices',
-            'causes': 'Plant is healthy',
-            'symptoms': 'Green healthy leaves, normal growth, no visible disease symptoms',
-            'best_practices': 'Balanced nutrition, proper irrigation, regular field inspection'
-        }
+        'request': {
+            'generation': generation, 'version': version, 'shadow': shadow_mode, 'shadow_rate': shadow_rate
+        } if generation else None,
+        'workers': swap_signal.workers()
     }
+
+@app.route('/admin/model', methods=['GET', 'POST', 'DELETE'])
+def admin_model():
+    """
+    GET: serving version, shadow comparison, registry versions and each
+    worker's progress on the latest request. POST: switch every worker to
+    `version`, or with `shadow` compare it on `shadow_rate` of the traffic.
+    DELETE: stop shadowing. Swaps happen in the background (202).
+    """
+    error = admin_error()
+    if error is not None:
+        return error
+    if request.method == 'GET':
+        return jsonify(model_status())
+    if active_model is None:
+        return jsonify({'error': 'Model is not loaded'}), 503
+    if request.method == 'DELETE':
+        swap_signal.request(active_model.version)
+        return jsonify(model_status()), 202
     
-    return disease_info.get(disease_name, {
-        'severity': 'Unknown',
-        'treatment': 'Consult with local agricultural expert or extension service for specific treatment recommendations',
-        'prevention': 'Follow general plant care practices: proper spacing, good drainage, crop rotation',
-        'causes': 'Disease cause requires further investigation',
-        'symptoms': 'Monitor plant for unusual changes in appearance',
-        'best_practices': 'Regular monitoring, proper cultural practices, seek expert advice'
-    })
+    params = request.get_json(silent=True) or request.values
+    version = params.get('version')
+    shadow_mode = str(params.get('shadow', False)).lower() in ('1', 'true', 'yes')
+    try:
+        shadow_rate = float(params.get('shadow_rate', 0.1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'shadow_rate must be a number'}), 400
+    if not version or not 0 < shadow_rate <= 1:
+        return jsonify({'error': 'Expected a version and 0 < shadow_rate <= 1'}), 400
+    try:
+        model_entry(version)
+    except (RegistryError, OSError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if shadow_mode and version == active_model.version:
+        return jsonify({'error': f'Version {version} is already serving'}), 400
+    swap_signal.request(version, shadow_mode, shadow_rate)
+    return jsonify(model_status()), 202
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({'status': 'healthy', 'model_loaded': model is not None})
+@app.route('/admin/similar', methods=['GET', 'POST'])
+def admin_similar():
+    """
+    GET: the serving version's similar-cases index. POST: add `cases`
+    ([{"id", "embedding", "metadata"}], embeddings from /predict with
+    embedding=1) to it, and/or start a background `rebuild` of its IVF
+    segment.
+    """
+    error = admin_error()
+    if error is not None:
+        return error
+    if active_model is None or runner is None:
+        return jsonify({'error': 'Model is not loaded'}), 503
+    if request.method == 'GET':
+        return jsonify(similarity_stats())
+    if not runner.embedding_size:
+        return jsonify({'error': f'Embeddings are not available with the {INFERENCE_BACKEND} backend'}), 501
+    
+    params = request.get_json(silent=True) or {}
+    cases = params.get('cases') or []
+    index = similarity_index(active_model.version)
+    try:
+        if not isinstance(cases, list):
+            raise ValueError('cases must be a list')
+        if cases:
+            ids = [str(case['id']) for case in cases]
+            metadata = [case.get('metadata') or {} for case in cases]
+            if not all(isinstance(meta, dict) for meta in metadata):
+                raise ValueError('metadata must be an object')
+            embeddings = np.array([case['embedding'] for case in cases], dtype=np.float32)
+            if embeddings.ndim != 2 or embeddings.shape[1] != runner.embedding_size:
+                raise ValueError(f'each embedding must have {runner.embedding_size} values')
+            index.add(ids, embeddings, metadata)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return jsonify({'error': f'Invalid cases: {e}'}), 400
+    rebuild = str(params.get('rebuild', False)).lower() in ('1', 'true', 'yes')
+    rebuild_started = index.rebuild_in_background() if rebuild else False
+    return jsonify({'added': len(cases), 'rebuild_started': rebuild_started, **similarity_stats()})
 
-def filter_predictions_by_plant(predictions, plant_name=None):
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text format; summed over all serve.py workers
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Plant-specific class filtering
+PLANT_FILTERS = {
+    'apple': ['Apple___'],
+    'cherry': ['Cherry_(including_sour)___'],
+    'corn': ['Corn_(maize)___'],
+    'maize': ['Corn_(maize)___'],
+    'grape': ['Grape___'],
+    'orange': ['Orange___'],
+    'peach': ['Peach___'],
+    'pepper': ['Pepper,_bell___'],
+    'potato': ['Potato___'],
+    'raspberry': ['Raspberry___'],
+    'soybean': ['Soybean___'],
+    'squash': ['Squash___'],
+    'strawberry': ['Strawberry___'],
+    'tomato': ['Tomato___'],
+    'blueberry': ['Blueberry___'],
+    'wheat': ['Wheat___'],
+    'rice': ['Rice___'],
+    'cotton': ['Cotton___']
+}
+
+# Static part of detection_metadata in every prediction response (after the
+# model_version of the version that served it)
+DETECTION_METADATA = {
+    'detection_timestamp': '2025-09-08',
+    'confidence_threshold': 0.5
+}
+
+# Minimum share of probability mass the specified plant must hold
+PLANT_CONFIDENCE_THRESHOLD = 0.15
+
+# plant name / alias -> read-only boolean mask over the model outputs,
+# built once per loaded model by build_plant_masks()
+plant_masks = {}
+
+def build_plant_masks(num_classes, names=None):
+    """
+    Precompute the class mask of every plant (and alias) in PLANT_FILTERS
+    over a model's class names (default: CLASS_NAMES)
+    """
+    names = CLASS_NAMES if names is None else names
+    class_names = np.array(list(names[:num_classes]) + [''] * max(0, num_classes - len(names)))
+    masks = {}
+    for plant, prefixes in PLANT_FILTERS.items():
+        mask = np.zeros(num_classes, dtype=bool)
+        for prefix in prefixes:
+            mask |= np.char.startswith(class_names, prefix)
+        if mask.any():
+            mask.setflags(write=False)
+            masks[plant] = mask
+    return masks
+
+def plant_filter_mask(plant_name):
     """
-    Filter predictions based on specified plant name to improve accuracy
+    Class mask for a plant_name, which may list several plants separated by
+    commas (e.g. 'tomato,potato' for mixed plots). Unknown plants are
+    ignored; returns None when no listed plant is known.
     """
     if not plant_name:
-        return predictions
-    
-    plant_name = plant_name.lower().strip()
-    
-    # Plant-specific class filtering
-    plant_filters = {
-        'apple': ['Apple___'],
-        'cherry': ['Cherry_(including_sour)___'],
-        'corn': ['Corn_(maize)___'],
-        'maize': ['Corn_(maize)___'],
-        'grape': ['Grape___'],
-        'orange': ['Orange___'],
-        'peach': ['Peach___'],
-        'pepper': ['Pepper,_bell___'],
-        'potato': ['Potato___'],
-        'raspberry': ['Raspberry___'],
-        'soybean': ['Soybean___'],
-        'squash': ['Squash___'],
-        'strawberry': ['Strawberry___'],
-        'tomato': ['Tomato___'],
-        'blueberry': ['Blueberry___'],
-        'wheat': ['Wheat___'],
-        'rice': ['Rice___'],
-        'cotton': ['Cotton___']
-    }
-    
-    # Get relevant class prefixes for the specified plant
-    relevant_prefixes = plant_filters.get(plant_name, [])
+        return None
+    masks = [plant_masks[name] for name in (part.strip().lower() for part in plant_name.split(',')) if name in plant_masks]
+    if not masks:
+        return None
+    return masks[0] if len(masks) == 1 else np.logical_or.reduce(masks)
+
+def filter_predictions_batch(predictions, plant_names):
+    """
+    Apply plant filtering to a (batch, classes) prediction matrix in one pass.
+    plant_names holds one entry per row (None or '' for auto-detect).
+    Returns the filtered matrix and a per-row plant match confidence flag.
+    """
+    num_rows, num_classes = predictions.shape
     
-    if not relevant_prefixes:
-        # If plant not in our filter list, return original predictions
-        return predictions, True
+    # One mask per distinct plant_name, expanded to rows by fancy indexing
+    unique_names, row_names = np.unique(np.array([name or '' for name in plant_names]), return_inverse=True)
+    name_masks = [plant_filter_mask(name) for name in unique_names]
+    no_filter = np.ones(num_classes, dtype=bool)
+    masks = np.stack([no_filter if mask is None else mask for mask in name_masks])[row_names]
+    has_filter = np.array([mask is not None for mask in name_masks])[row_names]
     
-    # Create a mask for relevant classes
-    relevant_indices = []
-    for i, class_name in enumerate(CLASS_NAMES):
-        for prefix in relevant_prefixes:
-            if class_name.startswith(prefix):
-                relevant_indices.append(i)
-                break
+    # Plant confidence check and renormalization for every row at once
+    masked = predictions * masks
+    plant_confidence = masked.sum(axis=1)
+    plant_match = ~has_filter | (plant_confidence >= PLANT_CONFIDENCE_THRESHOLD)
     
-    if not relevant_indices:
-        # No matching classes found, return original predictions
+    # Rows that are filtered with good confidence get renormalized; the
+    # rest keep their original predictions
+    apply = has_filter & plant_match & (plant_confidence > 0)
+    safe_totals = np.where(apply, plant_confidence, 1.0)[:, np.newaxis]
+    filtered = np.where(apply[:, np.newaxis], masked / safe_totals, predictions)
+    return filtered.astype(predictions.dtype, copy=False), plant_match
+
+def filter_predictions_by_plant(predictions, plant_name=None):
+    """
+    Filter predictions based on specified plant name to improve accuracy.
+    Works on a (classes,) vector or a (batch, classes) matrix; plant_name may
+    list several plants ('tomato,potato'). Returns the filtered predictions
+    and whether the plant(s) held enough probability in every row.
+    """
+    if not plant_name:
         return predictions, True
     
-    # Create filtered predictions array
-    filtered_predictions = np.zeros_like(predictions)
-    
-    # Calculate total confidence for the specified plant before filtering
-    plant_confidence = 0.0
-    for idx in relevant_indices:
-        plant_confidence += predictions[0][idx]
-        filtered_predictions[0][idx] = predictions[0][idx]
-    
-    # If the plant confidence is too low, it might be the wrong plant
-    confidence_threshold = 0.15  # 15% threshold
-    if plant_confidence < confidence_threshold:
-        print(f"Warning: Low confidence ({plant_confidence:.2%}) for specified plant '{plant_name}'. Image might be a different plant.")
-        # Return original predictions with a warning flag
-        return predictions, False  # False indicates low plant confidence
-    
-    # Renormalize the predictions only if confidence is good
-    total = np.sum(filtered_predictions[0])
-    if total > 0:
-        filtered_predictions[0] = filtered_predictions[0] / total
+    matrix = np.atleast_2d(predictions)
+    filtered, plant_match = filter_predictions_batch(matrix, [plant_name] * len(matrix))
+    return filtered.reshape(np.shape(predictions)), bool(plant_match.all())
+
+def request_top_k():
+    """
+    Number of top predictions requested via the 'k' query/form parameter
+    (default 5, capped at the number of model classes); None if invalid
+    """
+    k = request.values.get('k', DEFAULT_TOP_K)
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        return None
+    if k < 1:
+        return None
+    return min(k, catalog.num_classes)
+
+def render_predictions(predictions, plant_names, plant_match, metadata_rows, k=DEFAULT_TOP_K):
+    """
+    Post-process a (batch, classes) matrix in one vectorized pass, then
+    render each row's JSON result
+    """
+    result = postprocess(predictions, k, len(class_names), DETECTION_METADATA['confidence_threshold'])
+    if not result.predicted_in_range.all():
+        request_log.log('class_index_out_of_range',
+                        {'indices': result.predicted_indices[~result.predicted_in_range].tolist()}, logging.WARNING)
     
-    return filtered_predictions, True  # True indicates good plant confidence
+    confidences = result.confidences.tolist()
+    confident = result.confident.tolist()
+    rendered = []
+    for row in range(len(predictions)):
+        # Top predictions only list classes with curated names
+        keep = result.top_in_range[row]
+        rendered.append(catalog.render_prediction(
+            result.predicted_indices[row], confidences[row],
+            result.top_indices[row][keep].tolist(), result.top_confidences[row][keep].tolist(),
+            plant_names[row], plant_match[row], metadata_rows[row], confident[row]
+        ))
+    return rendered
+
+def request_schedule():
+    """
+    Deadline and priority parsed by the admission middleware
+    """
+    return request.environ.get(ENVIRON_KEY) or Schedule(math.inf, PRIORITY_CLASSES[DEFAULT_PRIORITY])
+
+def deadline_expired(schedule, stage, expected_seconds=0.0):
+    """
+    True (and counted) if the request cannot finish before its deadline
+    """
+    if remaining(schedule.deadline) < expected_seconds:
+        admission.record_expired(stage)
+        return True
+    return False
+
+def record_stage(stage, seconds):
+    """
+    Observe one pipeline stage of the current request. Stages that repeat
+    (once per image in a batch) add up in the request's log line.
+    """
+    stage_seconds.observe(seconds, ENDPOINTS[request.path], stage)
+    timings = request.environ.setdefault(TIMINGS_KEY, {})
+    timings[stage] = timings.get(stage, 0.0) + seconds
+
+def record_decode(decoded):
+    """
+    Observe the decode and resize stages of a DecodedImage
+    """
+    timings = decoded.timings or {}
+    record_stage('decode', (timings.get('open_ms', 0.0) + timings.get('decode_ms', 0.0) + timings.get('convert_ms', 0.0)) / 1000.0)
+    record_stage('resize', timings.get('resize_ms', 0.0) / 1000.0)
+
+def log_fields(**fields):
+    """
+    Attach fields to the current request's log line
+    """
+    request.environ.setdefault(LOG_FIELDS_KEY, {}).update(fields)
+
+def record_error(error_type, message=None):
+    """
+    Count a failed request (or image) and make sure it is logged
+    """
+    errors_total.inc(error_type)
+    log_fields(error=error_type, **({'message': message} if message else {}))
+
+def record_cache_lookup(cache, hit):
+    cache_lookups_total.inc(cache, 'hit' if hit else 'miss')
+
+def not_ready_response():
+    record_error('model_not_loaded')
+    if load_error is not None:
+        return jsonify({'error': 'Model failed to load'}), 500
+    # Still loading or warming up
+    return jsonify({'error': 'Model is loading, please retry shortly'}), 503, {'Retry-After': '5'}
+
+def holds_model(view):
+    """
+    Run a view inside model_gate, so a hot swap waits for it to finish
+    """
+    @functools.wraps(view)
+    def gated(*args, **kwargs):
+        with model_gate:
+            return view(*args, **kwargs)
+    return gated
+
+def expired_response():
+    record_error('expired')
+    return jsonify({'error': 'Request deadline passed', 'reason': 'expired'}), 504
+
+def embeddings_unavailable_response():
+    record_error('unsupported')
+    return jsonify({'error': f'Embeddings are not available with the {INFERENCE_BACKEND} backend'}), 501
+
+def request_similar_k():
+    """
+    Number of similar cases requested via the 'similar' parameter of /predict
+    (0 when absent, capped at SIMILAR_MAX_K); None if invalid
+    """
+    try:
+        k = int(request.values.get('similar', 0))
+    except (TypeError, ValueError):
+        return None
+    return min(k, SIMILAR_MAX_K) if k >= 0 else None
+
+def similar_cases(version, embedding, k, nprobe=None):
+    """
+    The k past cases of a model version closest to an embedding, as JSON-ready
+    dicts, most similar first
+    """
+    search_started = time.perf_counter()
+    neighbours = similarity_index(version).search(embedding, k, nprobe)
+    record_stage('search', time.perf_counter() - search_started)
+    return [
+        {'id': case_id, 'similarity': round(similarity, 4), 'metadata': metadata}
+        for similarity, case_id, metadata in neighbours
+    ]
+
+def embedding_list(embedding):
+    return [round(value, 6) for value in np.asarray(embedding, dtype=np.float64).tolist()]
 
 @app.route('/predict', methods=['POST'])
+@holds_model
 def predict_disease():
+    # Profiled only while an admin has armed the profiler
+    capture = profiler.capture('predict')
+    if capture is None:
+        return predict_single()
+    with capture:
+        return predict_single()
+
+def predict_single():
     try:
-        if model is None:
-            return jsonify({'error': 'Model not loaded'}), 500
+        started = time.perf_counter()
+        if not ready.is_set():
+            return not_ready_response()
         
-        # Check if image is provided in form data
+        # Check if image is provided in form data (reads the upload)
         if 'image' not in request.files:
+            record_error('bad_request')
             return jsonify({'error': 'No image provided'}), 400
         
         # Get plant name if provided
         plant_name = request.form.get('plant_name')
         
+        top_k = request_top_k()
+        if top_k is None:
+            record_error('bad_request')
+            return jsonify({'error': 'k must be a positive integer'}), 400
+        
+        # The embedding and similar past cases come from the full model's
+        # forward pass, so those requests skip the caches and the cascade
+        want_embedding = str(request.values.get('embedding', '')).lower() in ('1', 'true', 'yes')
+        similar_k = request_similar_k()
+        if similar_k is None:
+            record_error('bad_request')
+            return jsonify({'error': 'similar must be a non-negative integer'}), 400
+        needs_embedding = want_embedding or similar_k > 0
+        if needs_embedding and not runner.embedding_size:
+            return embeddings_unavailable_response()
+        version = active_model.version
+        
+        schedule = request_schedule()
+        
         # Get image data from form
         file = request.files['image']
         image_data = file.read()
+        record_stage('upload_read', time.perf_counter() - started)
         
-        # Preprocess image
-        processed_image = preprocess_image(image_data)
-        if processed_image is None:
-            return jsonify({'error': 'Failed to process image'}), 400
+        if str(request.values.get('tiled', '')).lower() in ('1', 'true', 'yes'):
+            if needs_embedding:
+                record_error('bad_request')
+                return jsonify({'error': 'embedding and similar are not available in tiled mode'}), 400
+            return predict_tiled(image_data, plant_name, top_k, schedule)
+        
+        # Resubmitted photos reuse the cached raw output
+        cache_key = image_key(image_data)
+        raw_predictions = None if needs_embedding else prediction_cache.get(cache_key)
+        cache_hit = raw_predictions is not None
+        if not needs_embedding:
+            record_cache_lookup('exact', cache_hit)
+        near_duplicate_distance = None
+        embedding = None
+        model_stage = 'full'
+        
+        if not cache_hit:
+            # Abandoned requests are dropped before spending decode and inference on them
+            if deadline_expired(schedule, 'before_decode', admission.expected_service_time()):
+                return expired_response()
+            
+            # Decode and resize (in the decode pool when enabled)
+            try:
+                decoded = decode_upload(image_data)
+            except ImageTooLargeError as e:
+                record_error('too_large')
+                return jsonify({'error': str(e)}), 413
+            except Exception as e:
+                record_error('decode_failed', str(e))
+                return jsonify({'error': 'Failed to process image'}), 400
+            record_decode(decoded)
+            
+            with decoded:
+                # Unusable photos are turned away before any model runs
+                rejection = check_quality(decoded.array)
+                if rejection is not None:
+                    reason, features = rejection
+                    log_fields(rejected=reason)
+                    return jsonify(quality_rejection(reason, features)), 422
+                
+                # Near-duplicates of a recent upload skip the model
+                model_version = loaded_model_version
+                image_hash = dhash(decoded.array)
+                if not needs_embedding:
+                    raw_predictions, near_duplicate_distance = near_duplicate_index.lookup(image_hash)
+                    record_cache_lookup('near_duplicate', raw_predictions is not None)
+                if raw_predictions is None:
+                    try:
+                        # The cascade's small model answers when it is sure enough
+                        if cascade_runner is not None and not needs_embedding:
+                            cascade_started = time.perf_counter()
+                            small = cascade_batcher.submit(decoded.array, deadline=schedule.deadline, priority=schedule.priority)
+                            record_stage('cascade', time.perf_counter() - cascade_started)
+                            if not cascade_escalations(small[np.newaxis, :], [plant_name])[0]:
+                                raw_predictions, model_stage = small, 'small'
+                        if raw_predictions is None:
+                            # Make prediction (grouped with concurrent requests by the batcher)
+                            inference_started = time.perf_counter()
+                            raw_predictions, embedding = batcher.submit(
+                                decoded.array, deadline=schedule.deadline, priority=schedule.priority
+                            )
+                            record_stage('inference', time.perf_counter() - inference_started)
+                            near_duplicate_index.add(image_hash, raw_predictions, model_version)
+                    except DeadlineExceeded:
+                        admission.record_expired('before_inference')
+                        return expired_response()
+                    if cascade_runner is not None and not needs_embedding:
+                        record_cascade_stages([model_stage])
+                offer_to_shadow(decoded.array, raw_predictions, model_stage)
+            # Only the full model's own outputs are cached: a small-model answer
+            # was accepted under this request's plant filter, and a
+            # near-duplicate's output belongs to a different photo
+            if model_stage == 'full' and near_duplicate_distance is None:
+                prediction_cache.put(cache_key, raw_predictions, model_version)
+        else:
+            offer_cached_to_shadow(image_data, raw_predictions)
         
-        # Make prediction
-        predictions = model.predict(processed_image)
+        predictions = raw_predictions[np.newaxis, :]
         
         # Apply plant-specific filtering if plant name is provided
         plant_match_confidence = True  # Default to true for auto-detect
         if plant_name:
-            print(f"Filtering predictions for plant: {plant_name}")
+            filter_started = time.perf_counter()
             predictions, plant_match_confidence = filter_predictions_by_plant(predictions, plant_name)
+            record_stage('plant_filter', time.perf_counter() - filter_started)
+        
+        metadata = {
+            'cache_hit': cache_hit, 'near_duplicate': near_duplicate_distance is not None, 'model_stage': model_stage
+        }
+        if near_duplicate_distance is not None:
+            metadata['near_duplicate_distance'] = near_duplicate_distance
+        log_fields(plant_name=plant_name, plant_match=plant_match_confidence, **metadata)
+        fields = {}
+        if similar_k:
+            try:
+                fields['similar_cases'] = similar_cases(version, embedding, similar_k)
+            except ValueError as e:
+                # An all-zero (blank photo) or non-finite embedding, or an index of
+                # another dimension: the prediction itself still stands
+                similar_lookups_skipped_total.inc()
+                log_fields(similar_cases_skipped=str(e))
+                fields['similar_cases'] = []
+        serialize_started = time.perf_counter()
+        body = render_predictions(predictions, [plant_name], [plant_match_confidence], [metadata], top_k)[0]
+        if want_embedding:
+            fields['embedding'] = embedding_list(embedding)
+        if fields:
+            body = with_fields(body, fields)
+        record_stage('serialize', time.perf_counter() - serialize_started)
+        return Response(body, mimetype='application/json')
+        
+    except Exception as e:
+        record_error('internal', str(e))
+        return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
+
+def predict_tiled(image_data, plant_name, top_k, schedule):
+    """
+    /predict of a high-resolution photo in tiles: one result pooled over the
+    leaf tiles, plus a per-tile heatmap of the predicted class
+    """
+    # Bounds the decoded photos held at once; waits at most until the deadline
+    wait = remaining(schedule.deadline)
+    if not tiled_slots.acquire(timeout=None if math.isinf(wait) else max(0.0, wait)):
+        admission.record_expired('before_decode')
+        return expired_response()
+    try:
+        try:
+            width, height = image_size(image_data, TILED_MAX_IMAGE_PIXELS)
+            grid = tile_grid(width, height, min(model_input_size()), TILE_OVERLAP, TILED_MAX_TILES)
+            timings = {}
+            image = decode_image(image_data, grid.image_size, max_pixels=TILED_MAX_IMAGE_PIXELS, timings=timings,
+                                 max_decoded_pixels=TILED_MAX_DECODE_PIXELS)
+        except ImageTooLargeError as e:
+            record_error('too_large')
+            message = str(e)
+            if e.max_pixels == TILED_MAX_DECODE_PIXELS:
+                message += ' after reduced-scale decoding; send large photos as JPEG'
+            return jsonify({'error': message}), 413
+        except Exception as e:
+            record_error('decode_failed', str(e))
+            return jsonify({'error': 'Failed to process image'}), 400
+        pixels = np.asarray(image, dtype=np.uint8)
+        del image
+        record_decode(DecodedImage(pixels, timings))
         
-        predicted_class_index = np.argmax(predictions[0])
-        confidence = float(predictions[0][predicted_class_index])
+        # Soil, sky and sheeting tiles skip the model
+        select_started = time.perf_counter()
+        fractions = leaf_fractions(pixels, grid)
+        selected = list(zip(*np.nonzero(fractions >= TILE_MIN_LEAF_RATIO)))
+        record_stage('quality_gate', time.perf_counter() - select_started)
+        tile_count = fractions.size
+        tiles_total.inc('skipped', amount=tile_count - len(selected))
+        if not selected:
+            rejected_images_total.inc('not_plant')
+            if forward_seconds_per_image is not None:
+                rejected_seconds_saved_total.inc(amount=forward_seconds_per_image * tile_count)
+            log_fields(rejected='not_plant', tiled=True)
+            return jsonify(quality_rejection('not_plant')), 422
         
-        print(f"Predicted class index: {predicted_class_index}, Total classes: {len(CLASS_NAMES)}")
-        print(f"Predictions shape: {predictions[0].shape}")
+        # Large batches through the model, one batch of tiles copied at a time
+        inference_started = time.perf_counter()
+        outputs = []
+        for batch in tile_batches(pixels, grid, selected, TILE_BATCH_SIZE):
+            if deadline_expired(schedule, 'before_inference'):
+                return expired_response()
+            outputs.append(run_model(batch))
+        outputs = np.concatenate(outputs)
+        record_stage('inference', time.perf_counter() - inference_started)
+        tiles_total.inc('inferred', amount=len(selected))
+    finally:
+        tiled_slots.release()
+    
+    weights = np.array([fractions[row, column] for row, column in selected])
+    predictions = aggregate_tiles(outputs, weights, TILE_TOP_FRACTION)[np.newaxis, :]
+    plant_match_confidence = True
+    if plant_name:
+        filter_started = time.perf_counter()
+        predictions, plant_match_confidence = filter_predictions_by_plant(predictions, plant_name)
+        record_stage('plant_filter', time.perf_counter() - filter_started)
+    
+    metadata = {'cache_hit': False, 'near_duplicate': False, 'model_stage': 'full', 'tiled': True}
+    log_fields(plant_name=plant_name, plant_match=plant_match_confidence, tiles=tile_count,
+               leaf_tiles=len(selected), **metadata)
+    serialize_started = time.perf_counter()
+    body = render_predictions(predictions, [plant_name], [plant_match_confidence], [metadata], top_k)[0]
+    predicted = int(np.argmax(predictions[0]))
+    # Leaf tiles per top-1 class, most frequent first
+    tile_classes, counts = np.unique(np.argmax(outputs, axis=1), return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:top_k]
+    body = with_fields(body, {'tiles': {
+        'source_size': [width, height],
+        'working_size': list(grid.image_size),
+        'tile_size': grid.tile_size,
+        'grid': [len(grid.ys), len(grid.xs)],
+        'leaf_tiles': len(selected),
+        'skipped_tiles': tile_count - len(selected),
+        'tile_classes': [
+            {'class': catalog[int(tile_classes[i])].full_class, 'tiles': int(counts[i])} for i in order
+        ],
+        'heatmap_class': catalog[predicted].full_class,
+        'heatmap': heatmap(outputs[:, predicted], selected, grid)
+    }})
+    record_stage('serialize', time.perf_counter() - serialize_started)
+    return Response(body, mimetype='application/json')
+
+@app.route('/predict/batch', methods=['POST'])
+@holds_model
+def predict_disease_batch():
+    """
+    Predict diseases for several images in one request. Images are sent as
+    repeated 'images' fields; 'plant_name' may be sent once (applies to all
+    images) or once per image in the same order. Results keep upload order.
+    """
+    try:
+        started = time.perf_counter()
+        if not ready.is_set():
+            return not_ready_response()
         
-        # Get class name
-        if predicted_class_index < len(CLASS_NAMES):
-            predicted_class = CLASS_NAMES[predicted_class_index]
-        else:
-            print(f"Warning: Predicted class index {predicted_class_index} is out of range")
-            predicted_class = f'Class_{predicted_class_index}'
-        
-        # Parse disease information
-        disease_parts = predicted_class.split('___')
-        plant_name_detected = disease_parts[0] if len(disease_parts) > 0 else 'Unknown'
-        disease_name = disease_parts[1] if len(disease_parts) > 1 else 'Unknown'
-        
-        # Get additional disease information
-        disease_info = get_disease_info(predicted_class)
-        
-        # Get top 5 predictions for additional context
-        top_5_indices = np.argsort(predictions[0])[-5:][::-1]
-        top_5_predictions = []
-        for i in top_5_indices:
-            if i < len(CLASS_NAMES):
-                top_5_predictions.append({
-                    'class': CLASS_NAMES[i],
-                    'confidence': float(predictions[0][i])
-                })
-        
-        # Enhanced recommendation based on severity and disease info
-        is_healthy = 'healthy' in disease_name.lower()
-        if is_healthy:
-            recommendation = f'Your {plant_name_detected.replace("_", " ")} appears to be healthy! Continue with regular care: {disease_info.get("best_practices", "proper watering, fertilization, and monitoring")}'
+        files = request.files.getlist('images')
+        if not files:
+            record_error('bad_request')
+            return jsonify({'error': 'No images provided'}), 400
+        if len(files) > MAX_BATCH_IMAGES:
+            record_error('bad_request')
+            return jsonify({'error': f'Too many images (maximum {MAX_BATCH_IMAGES} per request)'}), 400
+        
+        top_k = request_top_k()
+        if top_k is None:
+            record_error('bad_request')
+            return jsonify({'error': 'k must be a positive integer'}), 400
+        
+        plant_names = request.form.getlist('plant_name')
+        if len(plant_names) == 1:
+            plant_names = plant_names * len(files)
+        elif not plant_names:
+            plant_names = [None] * len(files)
+        elif len(plant_names) != len(files):
+            record_error('bad_request')
+            return jsonify({'error': 'plant_name must be given once or once per image'}), 400
+        
+        schedule = request_schedule()
+        if deadline_expired(schedule, 'before_decode'):
+            return expired_response()
+        
+        # Look up cached outputs, then preprocess the rest; failed images are
+        # reported in place
+        raw_rows = [None] * len(files)
+        processed = {}
+        cache_keys = {}
+        image_hashes = {}
+        near_duplicate_distances = {}
+        answered_small = set()
+        rejected = {}
+        model_version = loaded_model_version
+        results = [dumps({'success': False, 'error': 'Failed to process image'}) for _ in files]
+        # Form parsing reads the whole body; file.read() copies each upload out
+        upload_read = time.perf_counter() - started
+        try:
+            for i, file in enumerate(files):
+                read_started = time.perf_counter()
+                image_data = file.read()
+                upload_read += time.perf_counter() - read_started
+                cache_keys[i] = image_key(image_data)
+                raw_rows[i] = prediction_cache.get(cache_keys[i])
+                record_cache_lookup('exact', raw_rows[i] is not None)
+                if raw_rows[i] is not None:
+                    offer_cached_to_shadow(image_data, raw_rows[i])
+                    continue
+                try:
+                    decoded = decode_upload(image_data)
+                except ImageTooLargeError as e:
+                    errors_total.inc('too_large')
+                    results[i] = dumps({'success': False, 'error': str(e)})
+                    continue
+                except Exception:
+                    errors_total.inc('decode_failed')
+                    continue
+                record_decode(decoded)
+                
+                rejection = check_quality(decoded.array)
+                if rejection is not None:
+                    decoded.release()
+                    rejected[i] = rejection[0]
+                    results[i] = dumps(quality_rejection(*rejection))
+                    continue
+                
+                # Near-duplicates of a recent upload skip the model
+                image_hashes[i] = dhash(decoded.array)
+                raw_rows[i], distance = near_duplicate_index.lookup(image_hashes[i])
+                record_cache_lookup('near_duplicate', raw_rows[i] is not None)
+                if raw_rows[i] is not None:
+                    offer_to_shadow(decoded.array, raw_rows[i], 'full')
+                    decoded.release()
+                    near_duplicate_distances[i] = distance
+                else:
+                    processed[i] = decoded
+            
+            record_stage('upload_read', upload_read)
+            
+            if processed:
+                if deadline_expired(schedule, 'before_inference'):
+                    return expired_response()
+                pending = list(processed)
+                pixels = np.stack([decoded.array for decoded in processed.values()])
+                if cascade_runner is not None:
+                    # The small model answers the images it is sure about
+                    cascade_started = time.perf_counter()
+                    small = run_cascade_model(pixels)
+                    record_stage('cascade', time.perf_counter() - cascade_started)
+                    escalate = cascade_escalations(small, [plant_names[i] for i in pending])
+                    for i, row, escalated in zip(pending, small, escalate):
+                        if not escalated:
+                            raw_rows[i] = row
+                            answered_small.add(i)
+                            offer_to_shadow(processed[i].array, row, 'small')
+                    pending = [i for i, escalated in zip(pending, escalate) if escalated]
+                    pixels = pixels[escalate]
+                    record_cascade_stages(['small'] * len(answered_small) + ['full'] * len(pending))
+                if pending:
+                    # One forward pass for every image that missed both caches
+                    inference_started = time.perf_counter()
+                    outputs = run_model(pixels)
+                    record_stage('inference', time.perf_counter() - inference_started)
+                    for i, row in zip(pending, outputs):
+                        raw_rows[i] = row
+                        prediction_cache.put(cache_keys[i], row, model_version)
+                        near_duplicate_index.add(image_hashes[i], row, model_version)
+                        offer_to_shadow(processed[i].array, row, 'full')
+        finally:
+            for decoded in processed.values():
+                decoded.release()
+        
+        valid_rows = [i for i, row in enumerate(raw_rows) if row is not None]
+        if valid_rows:
+            predictions = np.stack([raw_rows[i] for i in valid_rows])
+            filter_started = time.perf_counter()
+            predictions, plant_match = filter_predictions_batch(predictions, [plant_names[i] for i in valid_rows])
+            record_stage('plant_filter', time.perf_counter() - filter_started)
+            
+            metadata_rows = []
+            for i in valid_rows:
+                metadata = {
+                    'cache_hit': i not in processed and i not in near_duplicate_distances,
+                    'near_duplicate': i in near_duplicate_distances,
+                    'model_stage': 'small' if i in answered_small else 'full'
+                }
+                if i in near_duplicate_distances:
+                    metadata['near_duplicate_distance'] = near_duplicate_distances[i]
+                metadata_rows.append(metadata)
+            
+            # Vectorized argmax and top-k over the (N, classes) matrix
+            serialize_started = time.perf_counter()
+            rendered = render_predictions(predictions, [plant_names[i] for i in valid_rows], plant_match, metadata_rows, top_k)
+            for i, body in zip(valid_rows, rendered):
+                results[i] = body
         else:
-            severity = disease_info.get('severity', 'Unknown')
-            treatment = disease_info.get('treatment', 'Consult agricultural expert')
-            recommendation = f'Disease detected: {disease_name.replace("_", " ")} (Severity: {severity}). Immediate action needed: {treatment}'
-        
-        result = {
-            'success': True,
-            'prediction': {
-                'plant': plant_name_detected,
-                'disease': disease_name,
-                'full_class': predicted_class,
-                'confidence': confidence,
-                'is_healthy': is_healthy,
-                'plant_filter_applied': bool(plant_name),
-                'plant_match_confidence': plant_match_confidence
-            },
-            'disease_info': disease_info,
-            'top_predictions': top_5_predictions,
-            'recommendation': recommendation,
-            'detection_metadata': {
-                'model_version': '1.0',
-                'detection_timestamp': '2025-09-08',
-                'confidence_threshold': 0.5,
-                'plant_specific_filtering': bool(plant_name)
-            }
-        }
+            serialize_started = time.perf_counter()
+        
+        body = render_batch(results)
+        record_stage('serialize', time.perf_counter() - serialize_started)
+        log_fields(images=len(files), failed=len(files) - len(valid_rows), inferred=len(processed),
+                   answered_small=len(answered_small), rejected=len(rejected))
+        return Response(body, mimetype='application/json')
+        
+    except Exception as e:
+        record_error('internal', str(e))
+        return jsonify({'error': f'Batch prediction failed: {str(e)}'}), 500
+
+@app.route('/similar', methods=['POST'])
+@holds_model
+def similar():
+    """
+    Past cases most similar to an uploaded 'image' (embedded by the serving
+    model) or to a JSON {"embedding": [...]}: 'k' neighbours (default 10),
+    optionally searching 'nprobe' inverted lists
+    """
+    try:
+        started = time.perf_counter()
+        if not ready.is_set():
+            return not_ready_response()
+        if not runner.embedding_size:
+            return embeddings_unavailable_response()
+        version = active_model.version
         
-        # Add warning if plant type seems wrong
-        if plant_name and not plant_match_confidence:
-            result['warning'] = f"Low confidence for {plant_name}. The image might be a different plant type. Consider using auto-detect or selecting the correct plant."
+        params = (request.get_json(silent=True) if request.is_json else None) or request.values
+        try:
+            k = int(params.get('k', SIMILAR_DEFAULT_K))
+            nprobe = int(params['nprobe']) if params.get('nprobe') else None
+        except (TypeError, ValueError):
+            k = nprobe = None
+        if k is None or k < 1 or (nprobe is not None and nprobe < 1):
+            record_error('bad_request')
+            return jsonify({'error': 'k and nprobe must be positive integers'}), 400
+        k = min(k, SIMILAR_MAX_K)
+        
+        if 'image' in request.files:
+            image_data = request.files['image'].read()
+            record_stage('upload_read', time.perf_counter() - started)
+            schedule = request_schedule()
+            if deadline_expired(schedule, 'before_decode', admission.expected_service_time()):
+                return expired_response()
+            try:
+                decoded = decode_upload(image_data)
+            except ImageTooLargeError as e:
+                record_error('too_large')
+                return jsonify({'error': str(e)}), 413
+            except Exception as e:
+                record_error('decode_failed', str(e))
+                return jsonify({'error': 'Failed to process image'}), 400
+            record_decode(decoded)
+            with decoded:
+                rejection = check_quality(decoded.array)
+                if rejection is not None:
+                    log_fields(rejected=rejection[0])
+                    return jsonify(quality_rejection(*rejection)), 422
+                try:
+                    inference_started = time.perf_counter()
+                    _, embedding = batcher.submit(decoded.array, deadline=schedule.deadline, priority=schedule.priority)
+                    record_stage('inference', time.perf_counter() - inference_started)
+                except DeadlineExceeded:
+                    admission.record_expired('before_inference')
+                    return expired_response()
+        elif params.get('embedding') is not None:
+            try:
+                embedding = np.asarray(params['embedding'], dtype=np.float32)
+            except (TypeError, ValueError):
+                embedding = None
+            if embedding is None or embedding.shape != (runner.embedding_size,):
+                record_error('bad_request')
+                return jsonify({'error': f'embedding must be a list of {runner.embedding_size} numbers'}), 400
+        else:
+            record_error('bad_request')
+            return jsonify({'error': 'No image or embedding provided'}), 400
         
-        return jsonify(result)
+        try:
+            neighbours = similar_cases(version, embedding, k, nprobe)
+        except ValueError as e:
+            record_error('bad_request')
+            return jsonify({'error': str(e)}), 400
+        log_fields(k=k, neighbours=len(neighbours))
+        return jsonify({'success': True, 'model_version': version, 'neighbours': neighbours})
         
     except Exception as e:
-        print(f"Error in prediction: {e}")
-        return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
+        record_error('internal', str(e))
+        return jsonify({'error': f'Similar-case lookup failed: {str(e)}'}), 500
+
+startup_timings['import'] = time.perf_counter() - _import_started
 
 if __name__ == '__main__':
-    print("Loading plant disease detection model...")
-    if load_model():
-        print("Starting Flask server...")
-        app.run(host='0.0.0.0', port=5001, debug=True)
-    else:
-        print("Failed to load model. Exiting...")
+    # The server starts at once; /ready answers 200 when the model is warm
+    print("Loading plant disease detection model in the background...")
+    start_background_load()
+    print("Starting Flask server...")
+    # Development server only; the reloader would load the model twice.
+    # Use serve.py for multi-worker serving. The debugger stays off unless
+    # FLASK_DEBUG=1 is set, and then only on a trusted network.
+    app.run(host='0.0.0.0', port=5001, use_reloader=False)
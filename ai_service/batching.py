@@ -0,0 +1,162 @@
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent /predict requests submit single images to a shared queue. A
+background worker groups whatever is waiting (up to max_batch_size, or until
+max_wait_ms has passed since the oldest request arrived) into one forward
+pass and hands each caller back its own row of the output (a tuple of rows
+when predict_fn returns a tuple of arrays).
+
+Waiting items are served in (priority, deadline) order. Items whose deadline
+would pass before a forward pass could finish are failed with
+DeadlineExceeded instead of being run, and items whose caller stopped
+waiting (submit() timed out) are dropped.
+"""
+
+import itertools
+import math
+import threading
+import time
+import queue
+
+import numpy as np
+
+from deadlines import DeadlineExceeded
+
+# Smoothing factor of the forward-pass duration estimate
+_RUN_TIME_ALPHA = 0.2
+
+
+class _PendingItem:
+    __slots__ = ('inputs', 'enqueued_at', 'deadline', 'done', 'result', 'error', 'cancelled')
+
+    def __init__(self, inputs, deadline=math.inf):
+        self.inputs = inputs
+        self.enqueued_at = time.perf_counter()
+        self.deadline = deadline
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single-image predictions into batched forward passes
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._run_time = 0.0
+        self._expired = 0
+        self._cancelled = 0
+        self._stats_lock = threading.Lock()
+        self._batch_size_counts = {}
+        self._batches = 0
+        self._items = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs, timeout=None, deadline=math.inf, priority=0):
+        """
+        Queue one image (without batch dimension) and block until its
+        prediction row (or tuple of rows) is available. deadline is a
+        time.monotonic() value.
+        """
+        item = _PendingItem(inputs, deadline)
+        self._queue.put((priority, deadline, next(self._sequence), item))
+        if not item.done.wait(timeout):
+            # Nobody reads the result any more; skipped if still queued
+            item.cancelled = True
+            raise TimeoutError('Timed out waiting for batched prediction')
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _live(self, entry):
+        """
+        Return the queued item, or None if its caller gave up waiting or
+        after failing it if it cannot finish before its deadline
+        """
+        item = entry[-1]
+        if item.cancelled:
+            with self._stats_lock:
+                self._cancelled += 1
+            return None
+        if item.deadline - time.monotonic() < self._run_time:
+            item.error = DeadlineExceeded('Deadline passed before inference')
+            item.done.set()
+            with self._stats_lock:
+                self._expired += 1
+            return None
+        return item
+
+    def _collect(self):
+        first = None
+        while first is None:
+            first = self._live(self._queue.get())
+        batch = [first]
+        wait_until = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = wait_until - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    entry = self._queue.get_nowait()
+                else:
+                    entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            item = self._live(entry)
+            if item is not None:
+                batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                outputs = self.predict_fn(np.stack([item.inputs for item in batch]))
+                rows = zip(*outputs) if isinstance(outputs, tuple) else outputs
+                for item, row in zip(batch, rows):
+                    item.result = row
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            self._run_time += _RUN_TIME_ALPHA * ((time.perf_counter() - started) - self._run_time)
+            self._record(batch, started)
+            for item in batch:
+                item.done.set()
+
+    def _record(self, batch, started):
+        waits = [started - item.enqueued_at for item in batch]
+        with self._stats_lock:
+            size = len(batch)
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._batches += 1
+            self._items += size
+            self._queue_wait_total += sum(waits)
+            self._queue_wait_max = max(self._queue_wait_max, max(waits))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'images': self._items,
+                'avg_batch_size': (self._items / self._batches) if self._batches else 0.0,
+                'batch_size_distribution': {str(k): v for k, v in sorted(self._batch_size_counts.items())},
+                'avg_queue_wait_ms': (self._queue_wait_total / self._items * 1000.0) if self._items else 0.0,
+                'max_queue_wait_ms': self._queue_wait_max * 1000.0,
+                'avg_run_ms': self._run_time * 1000.0,
+                'expired': self._expired,
+                'cancelled': self._cancelled
+            }
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and peak memory of image preprocessing for large uploads.
+
+Compares the original full-resolution decode + resize against the reduced
+scale JPEG decode in imaging.decode_image, on synthetic 4, 12 and 48 MP
+photos. Each measurement runs in a fresh process so peak RSS is not shared
+between cases (peak RSS is read from /proc or the Unix resource module).
+
+Usage: python benchmarks/bench_decode.py [--sizes 4,12,48] [--repeat 5]
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import stand_in  # noqa: F401  (puts the service modules on sys.path)
+
+# Megapixels -> (width, height) at the 4:3 ratio phone cameras use
+RESOLUTIONS = {
+    4: (2304, 1728),
+    12: (4000, 3000),
+    48: (8000, 6000),
+}
+
+
+def synthetic_photo(width, height, seed=0):
+    """
+    Smooth gradients plus mild noise, so JPEG sizes resemble real photos
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    ys = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    for channel, (fx, fy) in enumerate(((3, 2), (5, 7), (2, 9))):
+        plane = 127 + 80 * np.sin(fx * np.pi * xs + channel) * np.cos(fy * np.pi * ys)
+        plane += rng.normal(0, 6, size=(height, width)).astype(np.float32)
+        image[..., channel] = np.clip(plane, 0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def peak_rss_mb():
+    # VmHWM is per address space; ru_maxrss on Linux survives exec and
+    # would report the parent's peak from generating the test images
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def legacy_decode(image_data, timings):
+    """
+    The original preprocess_image decode: full resolution, then resize
+    """
+    from PIL import Image
+
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    decoded = time.perf_counter()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    converted = time.perf_counter()
+    image = image.resize((224, 224))
+    resized = time.perf_counter()
+    timings['decode_ms'] = (decoded - started) * 1000.0
+    timings['convert_ms'] = (converted - decoded) * 1000.0
+    timings['resize_ms'] = (resized - converted) * 1000.0
+    return image
+
+
+def run_child(path, mode, repeat):
+    from imaging import decode_image
+
+    with open(path, 'rb') as f:
+        image_data = f.read()
+    baseline_rss = peak_rss_mb()
+
+    samples = []
+    for _ in range(repeat):
+        timings = {}
+        started = time.perf_counter()
+        if mode == 'legacy':
+            image = legacy_decode(image_data, timings)
+        else:
+            image = decode_image(image_data, (224, 224), max_pixels=None, timings=timings)
+        normalize_started = time.perf_counter()
+        np.expand_dims(np.asarray(image).astype(np.float32) / 255.0, axis=0)
+        timings['normalize_ms'] = (time.perf_counter() - normalize_started) * 1000.0
+        timings['total_ms'] = (time.perf_counter() - started) * 1000.0
+        samples.append(timings)
+
+    stages = [key for key in samples[0] if key.endswith('_ms')]
+    result = {stage: float(np.median([sample[stage] for sample in samples])) for stage in stages}
+    result['decoded_size'] = samples[0].get('decoded_size')
+    result['baseline_rss_mb'] = baseline_rss
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='4,12,48', help='Megapixel sizes to test (4, 12, 48)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', nargs=2, metavar=('PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    print(f"{'MP':>3} {'path':<7} {'file MB':>8} {'decoded':>11} {'open':>7} {'decode':>8} {'convert':>8} "
+          f"{'resize':>7} {'norm':>6} {'total ms':>9} {'peak RSS MB':>12} {'+decode MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in [int(size) for size in args.sizes.split(',')]:
+            width, height = RESOLUTIONS[megapixels]
+            path = os.path.join(tmp, f'{megapixels}mp.jpg')
+            with open(path, 'wb') as f:
+                f.write(synthetic_photo(width, height))
+            file_mb = os.path.getsize(path) / 1e6
+
+            for mode in ('legacy', 'draft'):
+                output = subprocess.run(
+                    [sys.executable, __file__, '--child', path, mode, '--repeat', str(args.repeat)],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                row = json.loads(output.strip().splitlines()[-1])
+                decoded = 'x'.join(str(v) for v in row['decoded_size']) if row['decoded_size'] else f'{width}x{height}'
+                peak = row['peak_rss_mb']
+                delta = peak - row['baseline_rss_mb'] if peak is not None else None
+                print(f"{megapixels:>3} {mode:<7} {file_mb:>8.2f} {decoded:>11} {row.get('open_ms', 0.0):>7.2f} "
+                      f"{row['decode_ms']:>8.2f} {row['convert_ms']:>8.2f} {row['resize_ms']:>7.2f} "
+                      f"{row['normalize_ms']:>6.2f} {row['total_ms']:>9.2f} "
+                      f"{peak if peak is not None else float('nan'):>12.1f} "
+                      f"{delta if delta is not None else float('nan'):>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Throughput of the decode + inference pipeline with images decoded inline on
+the request threads versus in the DecodePool worker processes, at several
+levels of concurrency. Each client thread loops: decode one JPEG, submit it
+to a MicroBatcher running the stand-in model, release the decoded slot.
+
+Usage: python benchmarks/bench_decode_pool.py [--concurrency 1,4,8,16,32] [--processes 4]
+"""
+
+import argparse
+import io
+import os
+import threading
+import time
+
+import numpy as np
+
+from stand_in import build_stand_in_model
+
+
+def make_photos(count, size, seed=0):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    photos = []
+    for _ in range(count):
+        # Smooth content compresses like a photo, unlike per-pixel noise
+        small = rng.integers(0, 256, size=(size[1] // 32, size[0] // 32, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize(size, Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+def run(decode, batcher, photos, concurrency, duration):
+    completed = [0] * concurrency
+    stop_at = time.perf_counter() + duration
+
+    def client(n):
+        i = n
+        while time.perf_counter() < stop_at:
+            with decode(photos[i % len(photos)]) as decoded:
+                batcher.submit(decoded.array)
+            completed[n] += 1
+            i += concurrency
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(completed) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,8,16,32')
+    parser.add_argument('--processes', type=int, default=max(1, len(os.sched_getaffinity(0)) - 1))
+    parser.add_argument('--photo-size', default='4000x3000')
+    parser.add_argument('--photos', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    from batching import MicroBatcher
+    from decode_pool import DecodedImage, DecodePool
+    from imaging import decode_image
+    from inference import KerasRunner
+
+    runner = KerasRunner(build_stand_in_model())
+    runner.warm_up(range(1, args.max_batch_size + 1))
+
+    batcher = MicroBatcher(runner, max_batch_size=args.max_batch_size, max_wait_ms=10)
+
+    def inline(image_data):
+        return DecodedImage(np.asarray(decode_image(image_data), dtype=np.uint8))
+
+    concurrencies = [int(n) for n in args.concurrency.split(',')]
+    pool = DecodePool(args.processes, slots=max(concurrencies))
+
+    width, height = (int(v) for v in args.photo_size.split('x'))
+    photos = make_photos(args.photos, (width, height))
+    print(f"{len(os.sched_getaffinity(0))} CPUs, {args.photo_size} JPEGs, {args.processes} decode processes, "
+          f"max batch {args.max_batch_size}")
+    print(f"{'clients':>7} {'inline img/s':>13} {'pool img/s':>11} {'speedup':>8}")
+    for concurrency in concurrencies:
+        inline_rate = run(inline, batcher, photos, concurrency, args.duration)
+        pool_rate = run(pool.decode, batcher, photos, concurrency, args.duration)
+        print(f"{concurrency:>7} {inline_rate:>13.1f} {pool_rate:>11.1f} {pool_rate / inline_rate:>7.2f}x")
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Compare per-call latency of model.predict on NumPy-normalized float32 input
+against the traced KerasRunner used by the AI service, which takes uint8
+pixels and scales them in its graph, on a stand-in model.
+
+Usage: python benchmarks/bench_inference.py [--batch-sizes 1,8] [--iterations 200]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from stand_in import build_stand_in_model
+
+
+def time_calls(fn, batch, iterations):
+    fn(batch)  # exclude one-time setup from the measurement
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(batch)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return np.array(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-sizes', default='1,8')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--num-classes', type=int, default=52)
+    args = parser.parse_args()
+
+    from inference import KerasRunner, scale_pixels
+
+    model = build_stand_in_model(num_classes=args.num_classes)
+    runner = KerasRunner(model)
+
+    print(f"{'batch':>5}  {'path':<16} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        batch = np.random.randint(0, 256, size=(batch_size, 224, 224, 3), dtype=np.uint8)
+        paths = [
+            ('model.predict', lambda b: model.predict(scale_pixels(b), verbose=0)),
+            ('KerasRunner', runner),
+        ]
+        for name, fn in paths:
+            samples = time_calls(fn, batch, args.iterations)
+            print(f"{batch_size:>5}  {name:<16} {np.percentile(samples, 50):>8.2f} "
+                  f"{np.percentile(samples, 95):>8.2f} {samples.mean():>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Lookup latency and memory of the near-duplicate index at large sizes.
+
+Fills a NearDuplicateIndex with random 64-bit hashes, then times lookups for
+near copies of stored hashes (a few flipped bits) and for unrelated hashes.
+
+Usage: python benchmarks/bench_near_duplicate.py [--entries 1000000] [--distance 4]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import stand_in  # noqa: F401  (puts the service modules on sys.path)
+from phash import NearDuplicateIndex
+
+
+def flip_bits(value, count, rng):
+    for bit in rng.choice(64, size=count, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--distance', type=int, default=4)
+    parser.add_argument('--num-classes', type=int, default=52)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = NearDuplicateIndex(capacity=args.entries, num_classes=args.num_classes, max_distance=args.distance)
+    hashes = rng.integers(0, 2 ** 63, size=args.entries, dtype=np.int64).astype(np.uint64) << np.uint64(1)
+    probabilities = np.full(args.num_classes, 1.0 / args.num_classes, dtype=np.float32)
+
+    started = time.perf_counter()
+    for value in hashes:
+        index.add(int(value), probabilities)
+    fill_seconds = time.perf_counter() - started
+    # Lookups are timed on the sorted tables, not during the last rebuild
+    index.wait_for_rebuild()
+    print(f"Added {args.entries:,} entries in {fill_seconds:.1f}s "
+          f"({fill_seconds / args.entries * 1e6:.1f} us/add incl. starting background rebuilds)")
+
+    for label, make_query in (
+        ('near copy', lambda: flip_bits(int(hashes[rng.integers(len(hashes))]), int(rng.integers(1, args.distance + 1)), rng)),
+        ('unrelated', lambda: int(rng.integers(0, 2 ** 63)) << 1 | 1),
+    ):
+        queries = [make_query() for _ in range(args.queries)]
+        samples = []
+        found = 0
+        for query in queries:
+            started = time.perf_counter()
+            result, _ = index.lookup(query)
+            samples.append((time.perf_counter() - started) * 1e6)
+            found += result is not None
+        samples = np.array(samples)
+        print(f"{label:<10} p50 {np.percentile(samples, 50):7.1f} us  p99 {np.percentile(samples, 99):7.1f} us  "
+              f"found {found}/{len(queries)}")
+
+    print(f"Index memory: {index.stats()['memory_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the post-inference stage of /predict: everything from the
+model's probability row to the serialized JSON body.
+
+'legacy' rebuilds the disease table, formats the recommendation and runs
+jsonify on every call, as /predict originally did. 'catalog' renders from
+the precompiled ClassCatalog fragments. Both outputs are checked to decode
+to the same JSON.
+
+Usage: python benchmarks/bench_postprocess.py [--iterations 20000]
+"""
+
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+
+import stand_in  # noqa: F401  (puts the service modules on sys.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--plant-name', default=None)
+    args = parser.parse_args()
+
+    import app
+    from flask import jsonify
+    from postprocess import postprocess
+    from responses import ClassCatalog
+
+    num_classes = len(app.CLASS_NAMES)
+    catalog = ClassCatalog(app.CLASS_NAMES, app.DISEASE_INFO, app.DEFAULT_DISEASE_INFO, num_classes, app.DETECTION_METADATA)
+    rng = np.random.default_rng(0)
+    rows = rng.dirichlet(np.ones(num_classes), size=256).astype(np.float32)
+    metadata = {'cache_hit': False, 'near_duplicate': False}
+    plant_name = args.plant_name
+
+    def legacy(predictions):
+        # The original /predict response building, with the disease table
+        # rebuilt per call as the old get_disease_info() literal did
+        predicted_class_index = int(np.argmax(predictions))
+        confidence = float(predictions[predicted_class_index])
+        predicted_class = app.CLASS_NAMES[predicted_class_index]
+        disease_parts = predicted_class.split('___')
+        plant_name_detected = disease_parts[0]
+        disease_name = disease_parts[1] if len(disease_parts) > 1 else 'Unknown'
+        disease_info = copy.deepcopy(app.DISEASE_INFO).get(predicted_class, dict(app.DEFAULT_DISEASE_INFO))
+        top_5_indices = np.argsort(predictions)[-5:][::-1]
+        top_5_predictions = [
+            {'class': app.CLASS_NAMES[i], 'confidence': float(predictions[i])}
+            for i in top_5_indices if i < len(app.CLASS_NAMES)
+        ]
+        is_healthy = 'healthy' in disease_name.lower()
+        if is_healthy:
+            recommendation = f'Your {plant_name_detected.replace("_", " ")} appears to be healthy! Continue with regular care: {disease_info.get("best_practices", "proper watering, fertilization, and monitoring")}'
+        else:
+            recommendation = f'Disease detected: {disease_name.replace("_", " ")} (Severity: {disease_info.get("severity", "Unknown")}). Immediate action needed: {disease_info.get("treatment", "Consult agricultural expert")}'
+        result = {
+            'success': True,
+            'prediction': {
+                'plant': plant_name_detected,
+                'disease': disease_name,
+                'full_class': predicted_class,
+                'confidence': confidence,
+                'is_healthy': is_healthy,
+                'plant_filter_applied': bool(plant_name),
+                'plant_match_confidence': True
+            },
+            'disease_info': disease_info,
+            'top_predictions': top_5_predictions,
+            'recommendation': recommendation,
+            'detection_metadata': dict(app.DETECTION_METADATA, plant_specific_filtering=bool(plant_name), **metadata)
+        }
+        return jsonify(result).get_data()
+
+    def precompiled(predictions):
+        result = postprocess(predictions, 5, len(app.CLASS_NAMES))
+        keep = result.top_in_range[0]
+        return catalog.render_prediction(
+            result.predicted_indices[0], result.confidences.tolist()[0],
+            result.top_indices[0][keep].tolist(), result.top_confidences[0][keep].tolist(),
+            plant_name, True, metadata
+        )
+
+    with app.app.app_context():
+        for row in rows[:32]:
+            assert json.loads(legacy(row)) == json.loads(precompiled(row)), 'responses differ'
+
+        print(f"{'path':<9} {'us/response':>12} {'responses/s':>12}")
+        for name, fn in (('legacy', legacy), ('catalog', precompiled)):
+            started = time.perf_counter()
+            for i in range(args.iterations):
+                fn(rows[i % len(rows)])
+            elapsed = time.perf_counter() - started
+            print(f"{name:<9} {elapsed / args.iterations * 1e6:>12.1f} {args.iterations / elapsed:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Lookup latency, recall and build time of the similar-cases index at large
+sizes.
+
+Fills a SimilarityIndex in a temporary folder with clustered random
+embeddings (cases of one disease lie close together), builds its IVF
+segment, then times lookups for noisy copies of stored cases at several
+nprobe values and reports recall@k against an exact scan. Finally times a
+lookup with unindexed recent adds, which are scanned exactly.
+
+Usage: python benchmarks/bench_similarity.py [--entries 1000000] [--dim 128]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+import stand_in  # noqa: F401  (puts the service modules on sys.path)
+from similarity import SimilarityIndex, normalize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--clusters', type=int, default=2000)
+    parser.add_argument('--spread', type=float, default=0.5, help='noise norm around a cluster centre')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', default='4,8,16')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = normalize(rng.standard_normal((args.clusters, args.dim)))
+
+    def cases(count):
+        labels = rng.integers(args.clusters, size=count)
+        return centers[labels] + args.spread * rng.standard_normal((count, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # No background builds: the segment is built explicitly below
+        index = SimilarityIndex(directory, min_segment_rows=2 ** 62)
+        started = time.perf_counter()
+        for start in range(0, args.entries, 100_000):
+            count = min(100_000, args.entries - start)
+            index.add([f'case{start + i}' for i in range(count)], cases(count))
+        print(f"Added {args.entries:,} entries in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        index.rebuild()
+        stats = index.stats()
+        print(f"Built {stats['lists']} lists in {time.perf_counter() - started:.1f}s")
+
+        queries = cases(args.queries)
+        exact = [{case_id for _, case_id, _ in index.search(query, args.k, nprobe=stats['lists'])} for query in queries]
+        for nprobe in [int(value) for value in args.nprobe.split(',')]:
+            samples, hits = [], 0
+            for query, truth in zip(queries, exact):
+                started = time.perf_counter()
+                found = index.search(query, args.k, nprobe=nprobe)
+                samples.append((time.perf_counter() - started) * 1000.0)
+                hits += len(truth & {case_id for _, case_id, _ in found})
+            samples = np.array(samples)
+            print(f"nprobe {nprobe:<3} p50 {np.percentile(samples, 50):6.2f} ms  p99 {np.percentile(samples, 99):6.2f} ms  "
+                  f"recall@{args.k} {hits / (len(queries) * args.k):.3f}")
+
+        recent = args.entries // 10
+        index.add([f'recent{i}' for i in range(recent)], cases(recent))
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, args.k)
+            samples.append((time.perf_counter() - started) * 1000.0)
+        print(f"With {recent:,} unindexed adds: p50 {np.percentile(samples, 50):6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Top-k selection cost as the number of classes grows: full np.argsort versus
+postprocess.top_k (argpartition, then sorting only k items), for a batch.
+
+Usage: python benchmarks/bench_topk.py [--batch 8] [--k 5]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import stand_in  # noqa: F401  (puts the service modules on sys.path)
+from postprocess import top_k
+
+
+def best_of(fn, repeat=200):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--classes', default='52,500,5000,50000')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'classes':>8} {'argsort us':>11} {'top_k us':>9}")
+    for num_classes in [int(n) for n in args.classes.split(',')]:
+        predictions = rng.dirichlet(np.ones(num_classes), size=args.batch).astype(np.float32)
+        expected = np.argsort(predictions, axis=1)[:, -args.k:][:, ::-1]
+        assert (top_k(predictions, args.k)[0] == expected).all()
+        full = best_of(lambda: np.argsort(predictions, axis=1)[:, -args.k:][:, ::-1])
+        partial = best_of(lambda: top_k(predictions, args.k))
+        print(f"{num_classes:>8} {full:>11.1f} {partial:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
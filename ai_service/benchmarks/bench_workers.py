@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Throughput of serve.py as the number of worker processes grows, on a
+stand-in model. For each worker count the server is started with
+--threads-per-worker = CPUs / workers (so the cores are always fully used
+but never oversubscribed) and driven by a closed-loop client: a fixed number
+of connections, each sending its next /predict as soon as the previous one
+returns. The prediction cache and near-duplicate index are disabled so every
+request runs decode and inference. After each run the proportional set
+size (PSS) of the master and its workers is summed from /proc, so memory
+shared copy-on-write is counted once.
+
+The client shares the machine with the server; on small boxes, pass
+--cpus to reserve cores for it (serve.py only sees the given CPUs).
+
+Usage: python benchmarks/bench_workers.py [--workers 1,2,4,8] [--concurrency 32] [--duration 20]
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from stand_in import AI_SERVICE_DIR, DEFAULT_INPUT_SIZE
+
+BOUNDARY = 'bench-workers-boundary'
+
+
+def make_jpegs(count, size=(640, 480), seed=0):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, size=(size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def multipart_body(image_bytes):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="leaf.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode('ascii') + image_bytes + f'\r\n--{BOUNDARY}--\r\n'.encode('ascii')
+
+
+def prepare_model(directory, backend):
+    """
+    Save the stand-in model (and its TFLite export) where serve.py --model
+    will look for it
+    """
+    import tensorflow as tf
+    from stand_in import save_stand_in_model
+
+    model_path = os.path.join(directory, 'stand_in.keras')
+    model = save_stand_in_model(model_path)
+    if backend.startswith('tflite'):
+        if backend != 'tflite-fp32':
+            raise SystemExit('bench_workers.py exports the fp32 variant only; use convert_tflite.py for others')
+        with open(os.path.join(directory, 'stand_in_fp32.tflite'), 'wb') as f:
+            f.write(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+    return model_path
+
+
+def start_server(model_path, backend, workers, threads, port, cpus):
+    # Every upload reaches the model: no caches, and no quality gate (the
+    # synthetic photos are noise, not foliage)
+    env = dict(os.environ, INFERENCE_BACKEND=backend, PREDICTION_CACHE_MB='0', NEAR_DUPLICATE_CAPACITY='0',
+               QUALITY_GATE='0')
+    env.pop('TFLITE_NUM_THREADS', None)
+    command = [
+        sys.executable, os.path.join(AI_SERVICE_DIR, 'serve.py'), '--model', model_path,
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads-per-worker', str(threads)
+    ]
+    if cpus:
+        command = ['taskset', '-c', ','.join(map(str, cpus))] + command
+    server = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    # Ready once every worker has loaded, warmed up and started its pipeline
+    ready = 0
+    for line in server.stdout:
+        if line.startswith('{') and json.loads(line).get('event') == 'ready':
+            ready += 1
+            if ready == workers:
+                break
+    else:
+        server.kill()
+        raise RuntimeError(f'serve.py with {workers} workers exited before it was ready')
+    threading.Thread(target=server.stdout.read, daemon=True).start()
+    return server
+
+
+def server_memory_mb(pid):
+    """
+    Total PSS of a serve.py master and its workers in MB, or None where
+    /proc/<pid>/smaps_rollup is not available
+    """
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids = [pid] + [int(child) for child in f.read().split()]
+        total_kb = 0
+        for process in pids:
+            with open(f'/proc/{process}/smaps_rollup') as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+    except (OSError, StopIteration):
+        return None
+    return total_kb / 1024.0
+
+
+def load_test(port, bodies, concurrency, duration, warmup):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        i = offset
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            body = bodies[i % len(bodies)]
+            i += concurrency
+            try:
+                connection.request('POST', '/predict', body=body, headers={
+                    'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'
+                })
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                ok = False
+            finished = time.perf_counter()
+            if started >= measure_from and finished <= stop_at:
+                with lock:
+                    if ok:
+                        latencies.append((finished - started) * 1000.0)
+                    else:
+                        errors[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=None, help='comma-separated worker counts (default: 1,2,4,... up to CPUs)')
+    parser.add_argument('--cpus', default=None, help='CPU list for the server, e.g. 0-15 (default: all)')
+    parser.add_argument('--backend', default='keras', choices=('keras', 'tflite-fp32'))
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--images', type=int, default=256)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    cpus = None
+    if args.cpus:
+        cpus = []
+        for part in args.cpus.split(','):
+            low, _, high = part.partition('-')
+            cpus.extend(range(int(low), int(high or low) + 1))
+    num_cpus = len(cpus) if cpus else len(os.sched_getaffinity(0))
+    worker_counts = [int(n) for n in args.workers.split(',')] if args.workers else \
+        [n for n in (1, 2, 4, 8, 16, 32, 64, 128) if n <= num_cpus]
+
+    bodies = [multipart_body(image) for image in make_jpegs(args.images)]
+    print(f"{num_cpus} CPUs, backend {args.backend}, {args.concurrency} connections, "
+          f"{args.duration:.0f} s per run, input {DEFAULT_INPUT_SIZE}x{DEFAULT_INPUT_SIZE}")
+    print(f"{'workers':>7} {'threads':>7} {'images/s':>9} {'scaling':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'PSS MB':>8} {'MB/worker':>9}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = prepare_model(directory, args.backend)
+        baseline = None
+        for workers in worker_counts:
+            threads = max(1, num_cpus // workers)
+            server = start_server(model_path, args.backend, workers, threads, args.port, cpus)
+            try:
+                latencies, errors = load_test(args.port, bodies, args.concurrency, args.duration, args.warmup)
+                memory = server_memory_mb(server.pid)
+            finally:
+                server.terminate()
+                server.wait()
+            throughput = len(latencies) / args.duration
+            baseline = baseline or throughput
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+            memory_columns = f"{memory:>8.0f} {memory / workers:>9.0f}" if memory is not None else f"{'-':>8} {'-':>9}"
+            print(f"{workers:>7} {threads:>7} {throughput:>9.1f} {throughput / baseline:>7.2f}x "
+                  f"{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {errors:>6} {memory_columns}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Small stand-in Keras model with the same input/output shapes as
+plant_disease_model_best.h5, used by the benchmark scripts so they run
+without the real model file.
+"""
+
+import os
+import sys
+
+# Let benchmark scripts import the service modules (app, inference, ...)
+AI_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if AI_SERVICE_DIR not in sys.path:
+    sys.path.insert(0, AI_SERVICE_DIR)
+
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+DEFAULT_NUM_CLASSES = 52
+DEFAULT_INPUT_SIZE = 224
+
+
+def build_stand_in_model(num_classes=DEFAULT_NUM_CLASSES, input_size=DEFAULT_INPUT_SIZE, width=32, seed=0):
+    """
+    Build a compact CNN classifier (input_size x input_size x 3 -> softmax)
+    """
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    inputs = tf.keras.Input(shape=(input_size, input_size, 3))
+    x = tf.keras.layers.Conv2D(width, 3, strides=2, padding='same', activation='relu')(inputs)
+    x = tf.keras.layers.Conv2D(width * 2, 3, strides=2, padding='same', activation='relu')(x)
+    x = tf.keras.layers.Conv2D(width * 4, 3, strides=2, padding='same', activation='relu')(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.Dense(width * 4, activation='relu')(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    return tf.keras.Model(inputs, outputs, name='stand_in')
+
+
+def save_stand_in_model(path, **kwargs):
+    model = build_stand_in_model(**kwargs)
+    model.save(path)
+    return model
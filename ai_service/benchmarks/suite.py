@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark suite for the AI service, with regression checks.
+
+Runs on the stand-in model (same input/output shapes as
+plant_disease_model_best.h5) and seeded synthetic photos, in two parts:
+
+  micro  per-stage microbenchmarks in this process: JPEG decode + resize at
+         phone-camera resolutions, dHash, the quality gate, the traced
+         forward pass at batch 1 and 8, plant filtering, top-k
+         post-processing and response rendering (p50/p95/p99 ms, calls/s)
+  load   a closed-loop HTTP load test of POST /predict against serve.py with
+         caching disabled (p50/p95/p99 ms, images/s)
+
+Results are printed and can be saved as JSON. With --baseline, every result
+is compared against a stored run: a latency above, or a throughput below,
+the baseline by more than the tolerance is a regression, and the script
+exits with status 1. Baselines are only comparable on the machine (and
+CPU count) they were recorded on; --update-baseline rewrites the file.
+
+Usage:
+  python benchmarks/suite.py --baseline benchmarks/baseline.json
+  python benchmarks/suite.py --only micro --output results.json
+  python benchmarks/suite.py --baseline benchmarks/baseline.json --update-baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from bench_decode import RESOLUTIONS, synthetic_photo
+from bench_workers import load_test, multipart_body, prepare_model, start_server
+from stand_in import DEFAULT_INPUT_SIZE, DEFAULT_NUM_CLASSES, build_stand_in_model
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Latency fields compared against the baseline, and the throughput field
+LATENCY_FIELDS = ('p50_ms', 'p95_ms', 'p99_ms')
+TAIL_FIELDS = ('p95_ms', 'p99_ms')
+THROUGHPUT_FIELD = 'per_s'
+
+
+def summarize(samples_ms, count=None, seconds=None):
+    """
+    p50/p95/p99 of latency samples (ms) and the rate: count / seconds if
+    given, otherwise calls per second of a serial loop
+    """
+    samples_ms = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples_ms):
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, THROUGHPUT_FIELD: 0.0, 'samples': 0}
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    rate = count / seconds if seconds else 1000.0 / samples_ms.mean()
+    return {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), THROUGHPUT_FIELD: float(rate),
+            'samples': int(len(samples_ms))}
+
+
+def measure(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return summarize(samples)
+
+
+def run_micro(args, photos):
+    """
+    Stage microbenchmarks; returns {name: summary}
+    """
+    import app
+    from imaging import decode_image
+    from inference import KerasRunner
+    from phash import dhash
+    from postprocess import postprocess
+    from quality import QualityGate
+    from responses import ClassCatalog
+
+    results = {}
+    for megapixels, photo in photos.items():
+        results[f'decode_{megapixels}mp'] = measure(
+            lambda: decode_image(photo, (DEFAULT_INPUT_SIZE, DEFAULT_INPUT_SIZE), max_pixels=None),
+            max(5, args.iterations // 10)
+        )
+
+    rng = np.random.default_rng(args.seed)
+    image = rng.integers(0, 256, size=(DEFAULT_INPUT_SIZE, DEFAULT_INPUT_SIZE, 3), dtype=np.uint8)
+    results['dhash'] = measure(lambda: dhash(image), args.iterations)
+    quality_gate = QualityGate()
+    results['quality_gate'] = measure(lambda: quality_gate.check(image), args.iterations)
+
+    runner = KerasRunner(build_stand_in_model(seed=args.seed))
+    for batch_size in (1, 8):
+        batch = rng.integers(0, 256, size=(batch_size, DEFAULT_INPUT_SIZE, DEFAULT_INPUT_SIZE, 3), dtype=np.uint8)
+        results[f'inference_b{batch_size}'] = measure(lambda: runner(batch), args.iterations)
+
+    # Post-processing on the real class table, as in /predict/batch
+    app.catalog = ClassCatalog(app.CLASS_NAMES, app.DISEASE_INFO, app.DEFAULT_DISEASE_INFO,
+                               DEFAULT_NUM_CLASSES, app.DETECTION_METADATA)
+    app.plant_masks = app.build_plant_masks(DEFAULT_NUM_CLASSES)
+    predictions = rng.dirichlet(np.full(DEFAULT_NUM_CLASSES, 0.3), size=32).astype(np.float32)
+    plant_names = (['tomato', None, 'corn,potato', 'wheat'] * 8)[:len(predictions)]
+    results['plant_filter_b32'] = measure(lambda: app.filter_predictions_batch(predictions, plant_names), args.iterations)
+    results['postprocess_b32'] = measure(
+        lambda: postprocess(predictions, 5, len(app.CLASS_NAMES), app.DETECTION_METADATA['confidence_threshold']),
+        args.iterations
+    )
+    metadata = [{'cache_hit': False, 'near_duplicate': False}]
+    results['render_b1'] = measure(
+        lambda: app.render_predictions(predictions[:1], ['tomato'], [True], metadata, 5), args.iterations
+    )
+    return results
+
+
+def run_load(args, photos):
+    """
+    Closed-loop HTTP load test of /predict; returns {name: summary}
+    """
+    bodies = [multipart_body(photo) for photo in photos.values()]
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = prepare_model(directory, 'keras')
+        threads = max(1, len(os.sched_getaffinity(0)) // args.workers)
+        server = start_server(model_path, 'keras', args.workers, threads, args.port, None)
+        try:
+            latencies, errors = load_test(args.port, bodies, args.concurrency, args.duration, args.warmup)
+        finally:
+            server.terminate()
+            server.wait()
+    summary = summarize(latencies, len(latencies), args.duration)
+    summary['errors'] = errors
+    return {f'predict_c{args.concurrency}': summary}
+
+
+def environment():
+    import tensorflow as tf
+
+    return {
+        'cpus': len(os.sched_getaffinity(0)),
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__
+    }
+
+
+def compare(results, baseline, tolerance, tail_tolerance, min_delta_ms):
+    """
+    Rows of (section, name, field, baseline, current, change, regressed).
+    Tail latencies get the looser tail_tolerance, and latency changes below
+    min_delta_ms never count (sub-millisecond stages are noisy).
+    """
+    rows = []
+    for section, entries in results.items():
+        for name, current in entries.items():
+            previous = baseline.get(section, {}).get(name)
+            if previous is None:
+                continue
+            for field in LATENCY_FIELDS + (THROUGHPUT_FIELD,):
+                before, after = previous.get(field), current.get(field)
+                if not before or after is None:
+                    continue
+                change = after / before - 1.0
+                if field == THROUGHPUT_FIELD:
+                    regressed = change < -tolerance
+                else:
+                    allowed = tail_tolerance if field in TAIL_FIELDS else tolerance
+                    regressed = change > allowed and after - before > min_delta_ms
+                rows.append((section, name, field, before, after, change, regressed))
+            if current.get('errors'):
+                # Failed requests in the load test are a regression outright
+                rows.append((section, name, 'errors', previous.get('errors', 0), current['errors'], 0.0,
+                             current['errors'] > previous.get('errors', 0)))
+    return rows
+
+
+def print_results(results):
+    print(f"{'section':<6} {'benchmark':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>10}")
+    for section, entries in results.items():
+        for name, row in entries.items():
+            cells = [f"{row[field]:>9.3f}" if row[field] is not None else f"{'-':>9}" for field in LATENCY_FIELDS]
+            extra = f"  ({row['errors']} errors)" if row.get('errors') else ''
+            print(f"{section:<6} {name:<18} {' '.join(cells)} {row[THROUGHPUT_FIELD]:>10.1f}{extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', choices=('micro', 'load'), default=None, help='run one part only')
+    parser.add_argument('--resolutions', default='4,12', help=f"photo sizes in MP, from {sorted(RESOLUTIONS)}")
+    parser.add_argument('--iterations', type=int, default=200, help='calls per microbenchmark')
+    parser.add_argument('--workers', type=int, default=1, help='serve.py workers for the load test')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--port', type=int, default=5098)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the results as JSON')
+    parser.add_argument('--baseline', default=None, help=f'baseline JSON to compare against (e.g. {DEFAULT_BASELINE})')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative change of p50 and throughput')
+    parser.add_argument('--tail-tolerance', type=float, default=0.5, help='allowed relative change of p95 and p99')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help='ignore latency changes smaller than this')
+    args = parser.parse_args()
+
+    photos = {}
+    for megapixels in [int(size) for size in args.resolutions.split(',')]:
+        width, height = RESOLUTIONS[megapixels]
+        photos[megapixels] = synthetic_photo(width, height, seed=args.seed + megapixels)
+
+    report = {'environment': environment(), 'settings': {
+        key: getattr(args, key) for key in ('resolutions', 'iterations', 'workers', 'concurrency', 'duration', 'seed')
+    }}
+    results = {}
+    if args.only in (None, 'micro'):
+        results['micro'] = run_micro(args, photos)
+    if args.only in (None, 'load'):
+        results['load'] = run_load(args, photos)
+    report.update(results)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('environment', {}).get('cpus') != report['environment']['cpus']:
+        print(f"\nWARNING: baseline was recorded with {baseline.get('environment', {}).get('cpus')} CPUs, "
+              f"this run has {report['environment']['cpus']}; results are not comparable")
+
+    rows = compare(results, baseline, args.tolerance, args.tail_tolerance, args.min_delta_ms)
+    print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%}, p95/p99 {args.tail_tolerance:.0%})")
+    print(f"{'benchmark':<25} {'field':<7} {'baseline':>10} {'current':>10} {'change':>8}")
+    for section, name, field, before, after, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{section + '.' + name:<25} {field:<7} {before:>10.3f} {after:>10.3f} {change:>+7.1%}{flag}")
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f"\nFAILED: {len(regressions)} regression(s) against {args.baseline}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Content-addressed cache of raw model outputs.
+
+Entries are keyed on a hash of the uploaded image bytes and hold the
+unfiltered probability vector, so a resubmitted photo skips decode and
+inference and plant filtering can still be applied for any plant_name.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Rough per-entry bookkeeping cost (key, OrderedDict node, tuple, array header)
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def image_key(image_data):
+    """
+    Stable content hash of the uploaded bytes
+    """
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache with a memory cap and optional TTL.
+    All entries are dropped when the model version changes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=None):
+        self.max_bytes = int(max_bytes)
+        self.ttl_seconds = ttl_seconds or None
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def set_model_version(self, model_version):
+        """
+        Record the version of the model producing outputs; a different
+        version invalidates everything cached so far
+        """
+        with self._lock:
+            if model_version != self.model_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+                self.model_version = model_version
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            probabilities, stored_at, size = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return probabilities
+
+    def put(self, key, probabilities, model_version=None):
+        """
+        Store a raw probability vector. Outputs produced by a model version
+        other than the current one are ignored.
+        """
+        if not self.enabled:
+            return
+        probabilities = np.array(probabilities, dtype=np.float32)
+        probabilities.setflags(write=False)
+        size = probabilities.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (probabilities, time.monotonic(), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'model_version': self.model_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
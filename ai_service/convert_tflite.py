@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Export the plant disease Keras model to TFLite flatbuffers for CPU serving.
+
+Writes up to three variants next to each other:
+  <name>_fp32.tflite  plain float32 conversion
+  <name>_fp16.tflite  float16 weights
+  <name>_int8.tflite  INT8 weights; activations are also quantized when a
+                      calibration image folder is given, otherwise the
+                      dynamic-range scheme is used
+
+With --eval-dir, every variant is compared against the Keras model on a local
+image folder and an accuracy drift / latency / size report is printed and
+saved as tflite_report.json in the output directory.
+
+Usage:
+  python convert_tflite.py --calibration-dir samples/ --eval-dir validation/
+  python app.py  (with INFERENCE_BACKEND=tflite-int8)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from app import MODEL_PATH, preprocess_image
+from inference import TFLiteRunner, scale_pixels
+
+VARIANTS = ('fp32', 'fp16', 'int8')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def tflite_path(output_dir, model_path, variant):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(output_dir, f'{name}_{variant}.tflite')
+
+
+def list_images(folder, limit=None):
+    paths = []
+    for root, _, files in os.walk(folder):
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, filename))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def load_images(paths, target_size=None):
+    """
+    Preprocess images exactly as /predict does (uint8 at the model's input
+    size); unreadable files are skipped
+    """
+    images, kept = [], []
+    for path in paths:
+        with open(path, 'rb') as f:
+            processed = preprocess_image(f.read(), target_size)
+        if processed is not None:
+            images.append(processed)
+            kept.append(path)
+    return images, kept
+
+
+def convert(model, variant, calibration_images=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if variant == 'fp16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if calibration_images:
+            # Calibrate activation ranges; inputs/outputs stay float32 so the
+            # service can feed the same preprocessed batches to every backend
+            def representative_dataset():
+                for image in calibration_images:
+                    yield [scale_pixels(image)]
+            converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+def drift_report(model, model_path, variant_paths, images, num_threads=None):
+    # The Keras model takes [0, 1] floats; TFLiteRunner scales uint8 itself
+    batch = scale_pixels(np.concatenate(images))
+    keras_probs = model.predict(batch, verbose=0)
+    keras_top1 = np.argmax(keras_probs, axis=1)
+    keras_top5 = np.argsort(keras_probs, axis=1)[:, -5:]
+
+    started = time.perf_counter()
+    for image in images:
+        model(scale_pixels(image), training=False)
+    keras_latency = (time.perf_counter() - started) * 1000.0 / len(images)
+
+    report = {
+        'images': len(images),
+        'keras': {
+            'file_size_mb': os.path.getsize(model_path) / 1e6 if os.path.isfile(model_path) else None,
+            'latency_ms_per_image': keras_latency
+        }
+    }
+    for variant, path in variant_paths.items():
+        runner = TFLiteRunner(path, num_threads=num_threads)
+        started = time.perf_counter()
+        probs = np.concatenate([runner(image) for image in images])
+        latency = (time.perf_counter() - started) * 1000.0 / len(images)
+
+        top1 = np.argmax(probs, axis=1)
+        top5 = np.argsort(probs, axis=1)[:, -5:]
+        top5_overlap = np.mean([len(set(a) & set(b)) / 5.0 for a, b in zip(top5, keras_top5)])
+        abs_diff = np.abs(probs - keras_probs)
+        report[variant] = {
+            'file_size_mb': os.path.getsize(path) / 1e6,
+            'latency_ms_per_image': latency,
+            'top1_agreement': float(np.mean(top1 == keras_top1)),
+            'top5_overlap': float(top5_overlap),
+            'mean_abs_prob_diff': float(abs_diff.mean()),
+            'max_abs_prob_diff': float(abs_diff.max()),
+            'mean_top1_confidence_diff': float(np.mean(
+                probs[np.arange(len(probs)), keras_top1] - keras_probs[np.arange(len(probs)), keras_top1]
+            ))
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\nAccuracy drift vs Keras over {report['images']} images")
+    print(f"{'backend':<8} {'size MB':>8} {'ms/img':>8} {'top1 agree':>11} {'top5 overlap':>13} {'mean |dp|':>10} {'max |dp|':>9}")
+    keras = report['keras']
+    size = f"{keras['file_size_mb']:.2f}" if keras['file_size_mb'] is not None else '-'
+    print(f"{'keras':<8} {size:>8} {keras['latency_ms_per_image']:>8.2f} {'-':>11} {'-':>13} {'-':>10} {'-':>9}")
+    for variant in VARIANTS:
+        if variant not in report:
+            continue
+        row = report[variant]
+        print(f"{variant:<8} {row['file_size_mb']:>8.2f} {row['latency_ms_per_image']:>8.2f} "
+              f"{row['top1_agreement']:>11.2%} {row['top5_overlap']:>13.2%} "
+              f"{row['mean_abs_prob_diff']:>10.5f} {row['max_abs_prob_diff']:>9.5f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_PATH, help='Keras model to convert')
+    parser.add_argument('--output-dir', default=None, help='Where to write .tflite files (default: next to the model)')
+    parser.add_argument('--variants', default=','.join(VARIANTS), help='Comma-separated subset of fp32,fp16,int8')
+    parser.add_argument('--calibration-dir', default=None, help='Sample images used to calibrate INT8 activations')
+    parser.add_argument('--calibration-limit', type=int, default=200)
+    parser.add_argument('--eval-dir', default=None, help='Image folder for the accuracy drift report')
+    parser.add_argument('--eval-limit', type=int, default=None)
+    parser.add_argument('--num-threads', type=int, default=None)
+    args = parser.parse_args()
+
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        parser.error(f"Unknown variants: {', '.join(sorted(unknown))}")
+
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.model))
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Loading Keras model from {args.model}...")
+    model = tf.keras.models.load_model(args.model)
+
+    height, width = model.input_shape[1:3]
+    target_size = (width, height)
+
+    calibration_images = None
+    if args.calibration_dir:
+        calibration_images, _ = load_images(list_images(args.calibration_dir, args.calibration_limit), target_size)
+        print(f"Loaded {len(calibration_images)} calibration images from {args.calibration_dir}")
+        if not calibration_images:
+            print("No usable calibration images found; INT8 falls back to dynamic-range quantization")
+
+    variant_paths = {}
+    for variant in variants:
+        started = time.perf_counter()
+        flatbuffer = convert(model, variant, calibration_images)
+        path = tflite_path(output_dir, args.model, variant)
+        with open(path, 'wb') as f:
+            f.write(flatbuffer)
+        variant_paths[variant] = path
+        print(f"Wrote {path} ({len(flatbuffer) / 1e6:.2f} MB) in {time.perf_counter() - started:.1f}s")
+
+    if args.eval_dir:
+        images, _ = load_images(list_images(args.eval_dir, args.eval_limit), target_size)
+        if not images:
+            print(f"No usable images found in {args.eval_dir}; skipping drift report")
+            return 1
+        report = drift_report(model, args.model, variant_paths, images, args.num_threads)
+        print_report(report)
+        report_path = os.path.join(output_dir, 'tflite_report.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {report_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Request deadlines and priority classes.
+
+Callers send their remaining time budget in the X-Deadline-Ms header
+(milliseconds, relative so clock skew does not matter) and optionally
+X-Priority: interactive (the default) or bulk. Requests without a deadline
+get the service default. Queues serve work in (priority, deadline) order,
+so interactive uploads jump ahead of bulk re-scoring, and work that can no
+longer finish in time is dropped instead of run.
+"""
+
+import math
+import time
+from collections import namedtuple
+
+DEADLINE_HEADER = 'X-Deadline-Ms'
+PRIORITY_HEADER = 'X-Priority'
+PRIORITY_CLASSES = {'interactive': 0, 'bulk': 1}
+DEFAULT_PRIORITY = 'interactive'
+
+# WSGI environ key under which the parsed schedule is passed to the app
+ENVIRON_KEY = 'ai_service.schedule'
+
+Schedule = namedtuple('Schedule', ['deadline', 'priority'])  # monotonic seconds (inf = none), class rank
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Work was dropped because its deadline passed before it could finish
+    """
+
+
+def schedule_from_environ(environ, default_timeout_ms=None, max_timeout_ms=None):
+    """
+    Parse the deadline and priority headers of a WSGI request. Malformed
+    values (including nan and inf) fall back to the defaults.
+    """
+    timeout_ms = default_timeout_ms
+    header = environ.get('HTTP_' + DEADLINE_HEADER.upper().replace('-', '_'))
+    if header:
+        try:
+            value = float(header)
+        except ValueError:
+            value = math.nan
+        if math.isfinite(value):
+            timeout_ms = value
+    if timeout_ms is not None and max_timeout_ms:
+        timeout_ms = min(timeout_ms, max_timeout_ms)
+    deadline = math.inf if timeout_ms is None else time.monotonic() + max(0.0, timeout_ms) / 1000.0
+
+    priority_name = (environ.get('HTTP_' + PRIORITY_HEADER.upper().replace('-', '_')) or DEFAULT_PRIORITY).strip().lower()
+    priority = PRIORITY_CLASSES.get(priority_name, PRIORITY_CLASSES[DEFAULT_PRIORITY])
+    return Schedule(deadline, priority)
+
+
+def remaining(deadline):
+    """
+    Seconds left before a monotonic deadline (negative once passed)
+    """
+    return deadline - time.monotonic()
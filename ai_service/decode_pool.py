@@ -0,0 +1,239 @@
+"""
+Process pool for image decoding.
+
+PIL decode and resize hold the GIL for most of their run time, so decoding on
+request threads stalls every other thread in the process, including the one
+feeding the model. DecodePool runs decode_image() in worker processes that
+write the resized pixels straight into a block of shared memory: one uint8
+(height, width, 3) slot per image in flight. The request thread gets a view
+of its slot (no pixel copy across the process boundary), hands it to the
+batcher, and releases the slot once the forward pass has consumed it. The
+batcher still copies each image once, when it stacks the micro-batch.
+
+The pool is usually created after TensorFlow has started its threads, and
+fork() from a threaded process can leave a child holding a lock forever, so
+workers are started by a forkserver (spawn where there is none): a fresh,
+single-threaded process that loads this module and imaging (not the
+main script, so app.py's setup never runs there or in a worker) and forks
+the workers, also when a broken pool is restarted. Workers attach the shared memory by name and never
+touch TensorFlow. When every slot is taken, or the pool has broken, an image
+is decoded inline.
+"""
+
+import multiprocessing
+import multiprocessing.process
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from imaging import DEFAULT_MAX_PIXELS, decode_image
+
+# Path of the serving process's main script, handed to the forkserver
+_MAIN_PATH_ENV = 'DECODE_POOL_MAIN_PATH'
+
+
+def _main_path():
+    """
+    The main script path that multiprocessing asks workers to run, or None
+    """
+    main = sys.modules['__main__']
+    path = getattr(main, '__file__', None)
+    if path is None or getattr(main.__spec__, 'name', None) is not None:
+        return None
+    if not os.path.isabs(path) and multiprocessing.process.ORIGINAL_DIR is not None:
+        path = os.path.join(multiprocessing.process.ORIGINAL_DIR, path)
+    return os.path.normpath(path)
+
+
+# A forkserver child runs the parent's main script (app.py, rescore.py) as
+# __mp_main__ unless the server has loaded it. Decode workers need nothing
+# from it, so inside the server the script is marked as loaded without
+# running it. The server's own __main__ has no __file__; the parent's has.
+if _MAIN_PATH_ENV in os.environ and getattr(sys.modules['__main__'], '__file__', None) is None:
+    sys.modules['__main__'].__file__ = os.environ[_MAIN_PATH_ENV]
+
+# State of each worker: the shared slot array and settings
+_worker_memory = None
+_worker_buffers = None
+_worker_target_size = None
+_worker_max_pixels = None
+
+
+def _init_worker(memory_name, shape, target_size, max_pixels):
+    global _worker_memory, _worker_buffers, _worker_target_size, _worker_max_pixels
+    _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_buffers = np.ndarray(shape, dtype=np.uint8, buffer=_worker_memory.buf)
+    _worker_target_size = target_size
+    _worker_max_pixels = max_pixels
+
+
+def _ready():
+    return True
+
+
+def _decode_into(image_data, slot):
+    """
+    Decode one upload into its shared-memory slot; returns stage timings
+    """
+    timings = {}
+    image = decode_image(image_data, _worker_target_size, max_pixels=_worker_max_pixels, timings=timings)
+    _worker_buffers[slot] = np.asarray(image, dtype=np.uint8)
+    return timings
+
+
+def fork_available():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def worker_context():
+    """
+    Start method for decode workers that is safe in a threaded process:
+    forkserver, or spawn where there is none (Windows)
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # Workers fork from a server that has numpy, PIL and imaging loaded
+        # already. Not '__main__': importing app.py there (or in each worker)
+        # would repeat its module-level setup (metrics, log thread, registry)
+        context.set_forkserver_preload([__name__, 'imaging'])
+        main_path = _main_path()
+        if main_path is not None:
+            # Read by this module when the server imports it; the server
+            # starts with the first worker
+            os.environ[_MAIN_PATH_ENV] = main_path
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class DecodedImage:
+    """
+    A decoded (height, width, 3) uint8 image. Pool-decoded images are views
+    of a shared-memory slot, which release() hands back to the pool.
+    """
+
+    __slots__ = ('array', 'timings', '_pool', '_slot')
+
+    def __init__(self, array, timings=None, pool=None, slot=None):
+        self.array = array
+        self.timings = timings
+        self._pool = pool
+        self._slot = slot
+
+    def release(self):
+        if self._pool is not None:
+            self._pool._release(self._slot)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class DecodePool:
+    """
+    Decodes uploads in worker processes into shared uint8 buffers
+    """
+
+    def __init__(self, processes, slots, target_size=(224, 224), max_pixels=DEFAULT_MAX_PIXELS):
+        self.processes = max(1, int(processes))
+        self.num_slots = max(1, int(slots))
+        self.target_size = tuple(target_size)
+        self.max_pixels = max_pixels
+
+        # Named shared memory, which the workers attach to
+        width, height = self.target_size
+        self._shape = (self.num_slots, height, width, 3)
+        self._memory = shared_memory.SharedMemory(create=True, size=self.num_slots * height * width * 3)
+        self._buffers = np.ndarray(self._shape, dtype=np.uint8, buffer=self._memory.buf)
+
+        self._lock = threading.Lock()
+        self._free = list(range(self.num_slots))
+        self._executor = None
+        self.pooled = 0
+        self.inline = 0
+        self.restarts = 0
+        self._decode_time = 0.0
+        self._start()
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=worker_context(),
+            initializer=_init_worker,
+            initargs=(self._memory.name, self._shape, self.target_size, self.max_pixels)
+        )
+        # Start every worker now rather than on the first request
+        for future in [self._executor.submit(_ready) for _ in range(self.processes)]:
+            future.result()
+
+    def _acquire(self):
+        with self._lock:
+            return self._free.pop() if self._free else None
+
+    def _release(self, slot):
+        with self._lock:
+            self._free.append(slot)
+
+    def decode(self, image_data):
+        """
+        Decode image bytes into a DecodedImage of target_size. Raises the
+        same errors as imaging.decode_image().
+        """
+        slot = self._acquire()
+        if slot is not None:
+            executor = self._executor
+            started = time.perf_counter()
+            try:
+                timings = executor.submit(_decode_into, image_data, slot).result()
+            except BrokenProcessPool:
+                self._release(slot)
+                self._restart(executor)
+            except BaseException:
+                self._release(slot)
+                raise
+            else:
+                with self._lock:
+                    self.pooled += 1
+                    self._decode_time += time.perf_counter() - started
+                return DecodedImage(self._buffers[slot], timings, self, slot)
+
+        # No free slot (or the pool just broke): decode on this thread
+        timings = {}
+        image = decode_image(image_data, self.target_size, max_pixels=self.max_pixels, timings=timings)
+        with self._lock:
+            self.inline += 1
+        return DecodedImage(np.asarray(image, dtype=np.uint8), timings)
+
+    def _restart(self, broken_executor):
+        with self._lock:
+            if self._executor is not broken_executor:
+                return
+            self.restarts += 1
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self._start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'slots': self.num_slots,
+                'free_slots': len(self._free),
+                'pooled': self.pooled,
+                'inline': self.inline,
+                'restarts': self.restarts,
+                'avg_pooled_decode_ms': (self._decode_time / self.pooled * 1000.0) if self.pooled else 0.0
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._buffers = None
+        self._memory.close()
+        self._memory.unlink()
@@ -0,0 +1,302 @@
+"""
+Zero-downtime model switching and shadow comparison.
+
+A new version is loaded and warmed up next to the one serving traffic, then
+switched in through a DrainGate: requests hold the gate while they use the
+model, and a switch closes it to new requests, waits for the ones inside to
+finish on the old version, swaps and reopens it. Requests arriving during the
+drain wait (at most the drain timeout) instead of failing, and no request
+sees a half-switched model.
+
+An admin request reaches one serve.py worker. SwapSignal carries it to all of
+them through shared memory created before forking; every worker applies it
+from its own watcher thread and reports its progress back.
+
+In shadow mode a sample of the traffic is also run through a candidate
+version by ShadowComparator, on a background thread after the response's own
+forward pass, and the two outputs are compared.
+"""
+
+import contextlib
+import mmap
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Everything a request needs from one loaded model version
+# (cascade_runner is the cascade's small first-stage model, or None)
+LoadedModel = namedtuple('LoadedModel', [
+    'version', 'fingerprint', 'model', 'runner', 'class_names', 'catalog', 'plant_masks', 'cascade_runner'
+])
+
+# Per-worker progress on the latest swap request
+SWAP_STATES = ('idle', 'loading', 'draining', 'serving', 'shadowing', 'failed')
+
+# Longest version name SwapSignal can carry
+MAX_VERSION_BYTES = 256
+
+# Header slots of the shared state array
+_GENERATION, _SHADOW, _SHADOW_RATE = range(3)
+_HEADER = 4
+
+
+class DrainGate:
+    """
+    Requests enter the gate while they use the model; drained() closes it to
+    new requests and waits until the ones inside have left
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._inside = 0
+        self._closed = False
+
+    def __enter__(self):
+        with self._condition:
+            while self._closed:
+                self._condition.wait()
+            self._inside += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self._inside -= 1
+            if not self._inside:
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def drained(self, timeout):
+        """
+        Hold new requests back and wait for those in flight; raises
+        TimeoutError (and reopens) if they take longer than timeout seconds
+        """
+        with self._condition:
+            self._closed = True
+            if not self._condition.wait_for(lambda: not self._inside, timeout):
+                self._closed = False
+                self._condition.notify_all()
+                raise TimeoutError(f'{self._inside} requests still in flight after {timeout:g} s')
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._closed = False
+                self._condition.notify_all()
+
+
+class SwapSignal:
+    """
+    The latest swap request (version, shadow mode) and every worker's
+    progress on it, shared by all forked workers
+    """
+
+    def __init__(self, slots=1):
+        self.slots = max(1, int(slots))
+        state_bytes = (_HEADER + 2 * self.slots) * 8
+        # Anonymous MAP_SHARED memory and the lock are inherited by forked workers
+        self._memory = mmap.mmap(-1, state_bytes + MAX_VERSION_BYTES)
+        self._state = np.ndarray((_HEADER + 2 * self.slots,), dtype=np.float64, buffer=self._memory)
+        self._version = np.ndarray((MAX_VERSION_BYTES,), dtype=np.uint8, buffer=self._memory, offset=state_bytes)
+        self._lock = multiprocessing.Lock()
+
+    def request(self, version, shadow=False, shadow_rate=0.0):
+        """
+        Ask every worker to serve (or, with shadow, to shadow) version;
+        returns the request's generation number
+        """
+        encoded = version.encode('utf-8')
+        if len(encoded) > MAX_VERSION_BYTES:
+            raise ValueError(f'Version names are limited to {MAX_VERSION_BYTES} bytes')
+        with self._lock:
+            self._version[:] = 0
+            self._version[:len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+            self._state[_SHADOW] = 1.0 if shadow else 0.0
+            self._state[_SHADOW_RATE] = float(shadow_rate)
+            self._state[_GENERATION] += 1
+            return int(self._state[_GENERATION])
+
+    def current(self):
+        """
+        (generation, version, shadow, shadow_rate) of the latest request;
+        generation 0 means none was made
+        """
+        with self._lock:
+            version = self._version.tobytes().rstrip(b'\0').decode('utf-8')
+            return (int(self._state[_GENERATION]), version, bool(self._state[_SHADOW]),
+                    float(self._state[_SHADOW_RATE]))
+
+    def report(self, slot, generation, state):
+        row = _HEADER + 2 * (slot % self.slots)
+        with self._lock:
+            self._state[row] = generation
+            self._state[row + 1] = SWAP_STATES.index(state)
+
+    def workers(self):
+        with self._lock:
+            rows = self._state[_HEADER:].reshape(self.slots, 2).copy()
+        return [{'generation': int(generation), 'state': SWAP_STATES[int(state)]} for generation, state in rows]
+
+    def watch(self, apply, slot, interval=0.5):
+        """
+        Start this worker's watcher thread: apply(version, shadow,
+        shadow_rate, report) runs for every new request and returns whether
+        it succeeded; report(state) publishes intermediate states
+        """
+        def run():
+            seen = 0
+            while True:
+                generation, version, shadow, shadow_rate = self.current()
+                if generation != seen:
+                    seen = generation
+                    report = lambda state: self.report(slot, generation, state)
+                    ok = apply(version, shadow, shadow_rate, report)
+                    report(('shadowing' if shadow else 'serving') if ok else 'failed')
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name='model-swap-watcher', daemon=True)
+        thread.start()
+        return thread
+
+
+def _class_name(class_names, index):
+    return class_names[index] if index < len(class_names) else f'Class_{index}'
+
+
+class ShadowComparator:
+    """
+    Runs sampled inputs through a candidate LoadedModel on a background
+    thread and compares its outputs with those of the primary LoadedModel.
+    on_result(top1_agrees, max_abs_diff, details) is called per comparison;
+    max_abs_diff is None when the two versions have different class maps.
+    Each offer names the stage that produced the primary output (e.g. the
+    cascade's small or full model), and agreement is also kept per stage.
+    """
+
+    def __init__(self, candidate, sample_rate, on_result, max_queued=64, max_batch_size=8):
+        self.candidate = candidate
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.on_result = on_result
+        self.max_batch_size = max(1, int(max_batch_size))
+        self._queue = queue.Queue(max(1, int(max_queued)))
+        self._stats_lock = threading.Lock()
+        self._compared = 0
+        self._agreed = 0
+        # stage -> [compared, agreed]
+        self._by_stage = {}
+        self._dropped = 0
+        self._errors = 0
+        self._diff_total = 0.0
+        self._diff_count = 0
+        # Held around every forward pass of the candidate; close() waits on
+        # it, so a promoted candidate's runner is never used by both threads
+        self._runner_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='shadow-comparator', daemon=True)
+        self._worker.start()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def offer(self, pixels, primary_output, primary, stage='full'):
+        """
+        Queue one uint8 image (copied) and the output row the primary
+        LoadedModel's `stage` gave it; dropped if the comparator is behind
+        """
+        try:
+            self._queue.put_nowait((np.array(pixels, copy=True), primary_output, primary, stage))
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+
+    def close(self, timeout=5.0):
+        """
+        Stop comparing. Waits for a forward pass in progress, so once this
+        returns the candidate's runner is no longer used; queued items are
+        dropped.
+        """
+        self._closed = True
+        # Set first: the worker checks it under the lock before every pass
+        with self._runner_lock:
+            pass
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass  # the worker is not waiting on an empty queue; it sees _closed
+        self._worker.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            closing = False
+            while len(items) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                items.append(item)
+            try:
+                with self._runner_lock:
+                    if self._closed:
+                        return
+                    outputs = self.candidate.runner(np.stack([item[0] for item in items]))
+            except Exception:
+                with self._stats_lock:
+                    self._errors += len(items)
+            else:
+                for (_, output, primary, stage), shadow_output in zip(items, outputs):
+                    self._compare(primary, output, shadow_output, stage)
+            if closing:
+                return
+
+    def _compare(self, primary, output, shadow_output, stage):
+        primary_index, shadow_index = int(np.argmax(output)), int(np.argmax(shadow_output))
+        primary_class = _class_name(primary.class_names, primary_index)
+        shadow_class = _class_name(self.candidate.class_names, shadow_index)
+        agrees = primary_class == shadow_class
+        max_abs_diff = None
+        if output.shape == shadow_output.shape and list(primary.class_names) == list(self.candidate.class_names):
+            max_abs_diff = float(np.max(np.abs(output - shadow_output)))
+        with self._stats_lock:
+            self._compared += 1
+            self._agreed += agrees
+            counts = self._by_stage.setdefault(stage, [0, 0])
+            counts[0] += 1
+            counts[1] += agrees
+            if max_abs_diff is not None:
+                self._diff_total += max_abs_diff
+                self._diff_count += 1
+        self.on_result(agrees, max_abs_diff, {
+            'primary_version': primary.version, 'primary_stage': stage, 'primary_class': primary_class,
+            'primary_confidence': float(output[primary_index]),
+            'shadow_version': self.candidate.version, 'shadow_class': shadow_class,
+            'shadow_confidence': float(shadow_output[shadow_index])
+        })
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'version': self.candidate.version,
+                'sample_rate': self.sample_rate,
+                'compared': self._compared,
+                'top1_agreement': (self._agreed / self._compared) if self._compared else None,
+                'by_stage': {
+                    stage: {'compared': compared, 'top1_agreement': agreed / compared}
+                    for stage, (compared, agreed) in self._by_stage.items()
+                },
+                'mean_max_abs_diff': (self._diff_total / self._diff_count) if self._diff_count else None,
+                'queued': self._queue.qsize(),
+                'dropped': self._dropped,
+                'errors': self._errors
+            }
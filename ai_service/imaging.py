@@ -0,0 +1,90 @@
+"""
+Image decoding for the AI service.
+
+Phone uploads are often 12-48 MP while the model only needs 224x224, so
+JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8) chosen as the
+smallest one that still covers the target size, and only then resized.
+Pixel counts are checked from the header before any pixel data is decoded.
+"""
+
+import io
+import time
+
+from PIL import Image
+
+# Largest image (width * height) accepted for decoding
+DEFAULT_MAX_PIXELS = 64_000_000
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised when an upload's header reports more pixels than allowed
+    """
+
+    def __init__(self, width, height, max_pixels):
+        self.width = width
+        self.height = height
+        self.max_pixels = max_pixels
+        super().__init__(f'Image is {width}x{height} ({width * height / 1e6:.1f} MP); the limit is {max_pixels / 1e6:.1f} MP')
+
+    def __reduce__(self):
+        # Picklable, so decode worker processes can raise it
+        return type(self), (self.width, self.height, self.max_pixels)
+
+
+def image_size(image_data, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    (width, height) from the image header, without decoding pixel data
+    """
+    width, height = Image.open(io.BytesIO(image_data)).size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(width, height, max_pixels)
+    return width, height
+
+
+def decode_image(image_data, target_size=(224, 224), max_pixels=DEFAULT_MAX_PIXELS, timings=None,
+                 max_decoded_pixels=None):
+    """
+    Decode image bytes into an RGB PIL image of exactly target_size.
+    When a timings dict is given, per-stage durations (ms) are stored in it.
+    With max_decoded_pixels, images that would still be larger than that
+    after reduced-scale decoding raise ImageTooLargeError (bounding the
+    decode buffer, not just the upload).
+    """
+    started = time.perf_counter()
+
+    # Opening only parses the header; no pixel data is decoded yet
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(width, height, max_pixels)
+    opened = time.perf_counter()
+
+    # Ask the JPEG decoder for the smallest scale still >= target_size.
+    # draft() is a no-op for formats without reduced-scale decoding.
+    if image.format == 'JPEG':
+        image.draft('RGB', target_size)
+    if max_decoded_pixels and image.size[0] * image.size[1] > max_decoded_pixels:
+        raise ImageTooLargeError(image.size[0], image.size[1], max_decoded_pixels)
+    image.load()
+    decoded_size = image.size
+    decoded = time.perf_counter()
+
+    # Convert to RGB if needed
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    converted = time.perf_counter()
+
+    # Final resize to the model input size
+    if image.size != tuple(target_size):
+        image = image.resize(target_size)
+    resized = time.perf_counter()
+
+    if timings is not None:
+        timings['open_ms'] = (opened - started) * 1000.0
+        timings['decode_ms'] = (decoded - opened) * 1000.0
+        timings['convert_ms'] = (converted - decoded) * 1000.0
+        timings['resize_ms'] = (resized - converted) * 1000.0
+        timings['source_size'] = (width, height)
+        timings['decoded_size'] = decoded_size
+    return image
@@ -0,0 +1,249 @@
+"""
+Inference runners used by the AI service.
+
+A runner is called with a stacked uint8 (batch, height, width, 3) batch of
+decoded pixels and returns a NumPy (batch, classes) probability matrix.
+Scaling to [0, 1], and resizing when the pixels are not already at the
+model's input size, happen inside the runner. forward() returns the
+(batch, embedding_size) input of the final layer as well, from the same
+pass; runners that cannot expose it have an embedding_size of 0.
+
+TensorFlow is imported on first use: the TFLite runner on the standalone
+LiteRT runtime (ai-edge-litert) never imports it, which saves seconds of
+startup.
+"""
+
+import bisect
+import threading
+import time
+
+import numpy as np
+
+
+def scale_pixels(batch):
+    """
+    uint8 pixels to float32 in [0, 1], the range the model was trained on
+    """
+    return np.asarray(batch, dtype=np.float32) / 255.0
+
+
+def quantize(values, scale, zero_point, dtype):
+    """
+    Float values to an integer tensor with a TFLite input's quantization
+    parameters, saturating at the dtype's range instead of wrapping around
+    """
+    limits = np.iinfo(dtype)
+    return np.clip(np.round(values / scale + zero_point), limits.min, limits.max).astype(dtype)
+
+
+class KerasRunner:
+    """
+    Runs a Keras model through a tf.function traced once with a fixed input
+    signature, avoiding the per-call data adapter and callback setup that
+    model.predict does for every request.
+
+    The traced function takes uint8 pixels and does the cast, the /255
+    scaling and (if needed) the resize in the graph, so a batch crosses into
+    TensorFlow at a quarter of its float32 size and is preprocessed by TF's
+    multithreaded kernels. It also returns the input of the final layer (the
+    penultimate-layer embedding), which the forward pass computes anyway.
+    """
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.num_classes = model.output_shape[-1]
+        self._network = self._with_embeddings(model)
+        self.embedding_size = int(self._network.output_shape[1][-1]) if self._network is not model else 0
+        self._infer = tf.function(
+            self._forward,
+            input_signature=[tf.TensorSpec(shape=(None, None, None, self.input_shape[-1]), dtype=tf.uint8)]
+        )
+        # Trace the graph now so the first request doesn't pay for it
+        self._infer.get_concrete_function()
+
+    @staticmethod
+    def _with_embeddings(model):
+        import tensorflow as tf
+
+        # Functional and Sequential models: a view of the same layers with a
+        # second output. Subclassed models have no graph to tap, so only
+        # probabilities.
+        try:
+            embeddings = model.layers[-1].input
+            if len(embeddings.shape) != 2:
+                return model
+            return tf.keras.Model(model.inputs, [model.outputs[0], embeddings])
+        except (AttributeError, ValueError, IndexError):
+            return model
+
+    def _forward(self, pixels):
+        import tensorflow as tf
+
+        images = tf.cast(pixels, tf.float32) / 255.0
+        height, width = self.input_shape[:2]
+        shape = tf.shape(images)
+        images = tf.cond(
+            tf.logical_and(tf.equal(shape[1], height), tf.equal(shape[2], width)),
+            lambda: images,
+            lambda: tf.image.resize(images, (height, width))
+        )
+        images = tf.ensure_shape(images, (None,) + self.input_shape)
+        if self._network is self.model:
+            return self.model(images, training=False), tf.zeros((shape[0], 0))
+        probabilities, embeddings = self._network(images, training=False)
+        return probabilities, embeddings
+
+    def forward(self, batch):
+        """
+        (probabilities, embeddings) NumPy arrays of a uint8 batch
+        """
+        import tensorflow as tf
+
+        probabilities, embeddings = self._infer(tf.convert_to_tensor(batch, dtype=tf.uint8))
+        return probabilities.numpy(), embeddings.numpy()
+
+    def __call__(self, batch):
+        return self.forward(batch)[0]
+
+    def warm_up(self, batch_sizes):
+        """
+        Run a dummy batch of each size once so kernel selection and memory
+        allocation happen at startup instead of on real requests.
+        Returns the time spent per batch size in milliseconds.
+        """
+        timings = {}
+        for batch_size in sorted(set(batch_sizes)):
+            dummy = np.zeros((batch_size,) + self.input_shape, dtype=np.uint8)
+            started = time.perf_counter()
+            self(dummy)
+            timings[batch_size] = (time.perf_counter() - started) * 1000.0
+        return timings
+
+
+def _tflite_interpreter_class():
+    # Prefer the standalone LiteRT runtime; tf.lite.Interpreter is deprecated
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteRunner:
+    """
+    Runs a converted TFLite flatbuffer (fp32, fp16 or int8 variant). The
+    flatbuffers keep float32 inputs, so pixels are scaled in NumPy here.
+
+    TFLite interpreters have static tensor shapes, so one interpreter is kept
+    per batch size. A batch is padded up to the smallest prepared size that
+    fits it; a new interpreter is only built for batches larger than any
+    prepared so far.
+
+    The flatbuffers only expose the class probabilities, so there are no
+    embeddings (embedding_size is 0).
+    """
+
+    embedding_size = 0
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        with open(model_path, 'rb') as f:
+            self._model_content = f.read()
+        self._interpreter_class = _tflite_interpreter_class()
+        self.num_threads = num_threads
+        self._interpreters = {}
+        self._sizes = []
+        self._lock = threading.Lock()
+
+        probe = self._get_interpreter(1)
+        input_details = probe['input']
+        output_details = probe['output']
+        self.input_shape = tuple(int(dim) for dim in input_details['shape'][1:])
+        self.num_classes = int(output_details['shape'][-1])
+        self.input_dtype = input_details['dtype']
+
+    def _build(self, batch_size):
+        interpreter = self._interpreter_class(model_content=self._model_content, num_threads=self.num_threads)
+        input_details = interpreter.get_input_details()[0]
+        if int(input_details['shape'][0]) != batch_size:
+            interpreter.resize_tensor_input(input_details['index'], [batch_size] + list(input_details['shape'][1:]))
+        interpreter.allocate_tensors()
+        return {
+            'interpreter': interpreter,
+            'input': interpreter.get_input_details()[0],
+            'output': interpreter.get_output_details()[0]
+        }
+
+    def _get_interpreter(self, batch_size):
+        with self._lock:
+            if batch_size not in self._interpreters:
+                self._interpreters[batch_size] = self._build(batch_size)
+                bisect.insort(self._sizes, batch_size)
+            return self._interpreters[batch_size]
+
+    def __call__(self, batch):
+        batch = np.asarray(batch)
+        if batch.shape[1:3] != self.input_shape[:2]:
+            import tensorflow as tf
+            batch = tf.image.resize(batch, self.input_shape[:2]).numpy()
+        batch = scale_pixels(batch)
+        count = len(batch)
+        position = bisect.bisect_left(self._sizes, count)
+        size = self._sizes[position] if position < len(self._sizes) else count
+        if size > count:
+            padding = np.zeros((size - count,) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, padding])
+
+        entry = self._get_interpreter(size)
+        interpreter = entry['interpreter']
+        input_details = entry['input']
+        output_details = entry['output']
+
+        # Quantized-input models take integer tensors: apply the input scale
+        if input_details['dtype'] != np.float32:
+            scale, zero_point = input_details['quantization']
+            batch = quantize(batch, scale, zero_point, input_details['dtype'])
+
+        interpreter.set_tensor(input_details['index'], batch)
+        interpreter.invoke()
+        outputs = interpreter.get_tensor(output_details['index'])
+
+        if output_details['dtype'] != np.float32:
+            scale, zero_point = output_details['quantization']
+            outputs = (outputs.astype(np.float32) - zero_point) * scale
+        return outputs[:count].copy()
+
+    def use_threads(self, num_threads):
+        """
+        Rebuild every prepared interpreter with num_threads threads and warm
+        it up. Interpreters built before fork() must be single-threaded (their
+        thread pool does not survive the fork), so a forked worker calls this
+        to get its own pools. Returns the warm-up time per batch size.
+        """
+        with self._lock:
+            if num_threads == self.num_threads:
+                return {}
+            self.num_threads = num_threads
+            self._interpreters = {size: self._build(size) for size in self._sizes}
+        return self.warm_up(self._sizes)
+
+    def forward(self, batch):
+        probabilities = self(batch)
+        return probabilities, np.zeros((len(probabilities), 0), dtype=np.float32)
+
+    def warm_up(self, batch_sizes):
+        """
+        Build and run an interpreter for each batch size at startup.
+        Returns the time spent per batch size in milliseconds.
+        """
+        timings = {}
+        for batch_size in sorted(set(batch_sizes)):
+            started = time.perf_counter()
+            self._get_interpreter(batch_size)
+            self(np.zeros((batch_size,) + self.input_shape, dtype=np.uint8))
+            timings[batch_size] = (time.perf_counter() - started) * 1000.0
+        return timings
@@ -0,0 +1,253 @@
+"""
+Admission control and load shedding for the inference endpoints.
+
+Requests are admitted before their body is read, using the Content-Length
+header: at most max_in_flight requests are processed at once, at most
+max_queued wait for a slot, and the bodies of all admitted and waiting
+requests together stay under max_queued_bytes. Anything beyond that is
+answered at once with 503 and a Retry-After estimate instead of piling up
+threads and upload buffers. Paths that are not gated (/health) never wait.
+
+A chunked upload has no Content-Length. It is charged unknown_request_bytes,
+a typical upload rather than the largest allowed one, so a few chunked
+clients cannot fill the byte budget on their own; the app still caps what it
+reads of such a body at max_request_bytes.
+
+Waiting requests get free slots in (priority, deadline) order. A request
+whose deadline passes while it waits is answered with 504 and never read.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+from deadlines import ENVIRON_KEY, schedule_from_environ
+from responses import dumps
+
+# Smoothing factor of the service time average used for Retry-After
+_SERVICE_TIME_ALPHA = 0.1
+
+# Pipeline stages at which expired requests are counted
+EXPIRED_STAGES = ('queued', 'before_decode', 'before_inference')
+
+
+class _Waiter:
+    __slots__ = ('size', 'deadline', 'event', 'admitted', 'cancelled')
+
+    def __init__(self, size, deadline):
+        self.size = size
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.admitted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """
+    Bounded in-flight slots plus a bounded, byte-limited waiting room
+    """
+
+    def __init__(self, max_in_flight=16, max_queued=64, max_queued_bytes=256 * 1024 * 1024,
+                 max_request_bytes=64 * 1024 * 1024, unknown_request_bytes=8 * 1024 * 1024, queue_timeout=10.0):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queued = max(0, int(max_queued))
+        self.max_queued_bytes = int(max_queued_bytes)
+        self.max_request_bytes = int(max_request_bytes)
+        self.unknown_request_bytes = min(int(unknown_request_bytes), self.max_request_bytes)
+        self.queue_timeout = float(queue_timeout)
+        self._lock = threading.Lock()
+        self._waiters = []  # heap of (priority, deadline, sequence, waiter)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._queued = 0
+        self._bytes = 0
+        self._service_time = None
+        self.admitted = 0
+        self.rejected = {'too_large': 0, 'queue_full': 0, 'bytes': 0, 'timeout': 0}
+        self.expired = dict.fromkeys(EXPIRED_STAGES, 0)
+
+    def acquire(self, size, deadline=math.inf, priority=0):
+        """
+        Reserve a slot for a request body of `size` bytes (None if unknown,
+        charged as unknown_request_bytes). Returns None when admitted,
+        otherwise the rejection reason.
+        """
+        size = self.unknown_request_bytes if size is None else size
+        with self._lock:
+            if size > self.max_request_bytes:
+                self.rejected['too_large'] += 1
+                return 'too_large'
+            if self._bytes + size > self.max_queued_bytes and self._bytes:
+                self.rejected['bytes'] += 1
+                return 'bytes'
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._bytes += size
+                self._in_flight += 1
+                self.admitted += 1
+                return None
+            if self._queued >= self.max_queued:
+                self.rejected['queue_full'] += 1
+                return 'queue_full'
+            waiter = _Waiter(size, deadline)
+            heapq.heappush(self._waiters, (priority, deadline, next(self._sequence), waiter))
+            self._queued += 1
+            self._bytes += size
+
+        wait_until = min(time.monotonic() + self.queue_timeout, deadline)
+        waiter.event.wait(max(0.0, wait_until - time.monotonic()))
+        with self._lock:
+            if waiter.admitted:
+                return None
+            # Gave up waiting; the heap entry is skipped when it surfaces
+            waiter.cancelled = True
+            self._queued -= 1
+            self._bytes -= size
+            if deadline <= time.monotonic():
+                self.expired['queued'] += 1
+                return 'expired'
+            self.rejected['timeout'] += 1
+            return 'timeout'
+
+    def release(self, size, elapsed):
+        size = self.unknown_request_bytes if size is None else size
+        with self._lock:
+            self._in_flight -= 1
+            self._bytes -= size
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time += _SERVICE_TIME_ALPHA * (elapsed - self._service_time)
+            self._admit_waiters()
+
+    def _admit_waiters(self):
+        # Hand free slots to the most urgent waiters; drop those already expired
+        now = time.monotonic()
+        while self._waiters and self._in_flight < self.max_in_flight:
+            _, deadline, _, waiter = heapq.heappop(self._waiters)
+            if waiter.cancelled:
+                continue
+            if deadline <= now:
+                waiter.event.set()
+                continue
+            waiter.admitted = True
+            self._queued -= 1
+            self._in_flight += 1
+            self.admitted += 1
+            waiter.event.set()
+
+    def record_expired(self, stage):
+        """
+        Count a request dropped at a later stage because its deadline passed
+        """
+        with self._lock:
+            self.expired[stage] += 1
+
+    def expected_service_time(self):
+        """
+        Recent average time an admitted request takes, in seconds
+        """
+        return self._service_time or 0.0
+
+    def retry_after(self):
+        """
+        Seconds until the current backlog should have drained (at least 1)
+        """
+        with self._lock:
+            backlog = self._in_flight + self._queued
+            service_time = self._service_time or 1.0
+        return max(1, math.ceil(backlog * service_time / self.max_in_flight))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'queued_bytes': self._bytes,
+                'max_in_flight': self.max_in_flight,
+                'max_queued': self.max_queued,
+                'max_queued_bytes': self.max_queued_bytes,
+                'max_request_bytes': self.max_request_bytes,
+                'unknown_request_bytes': self.unknown_request_bytes,
+                'queue_timeout_s': self.queue_timeout,
+                'avg_service_time_ms': (self._service_time or 0.0) * 1000.0,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'expired': dict(self.expired)
+            }
+
+
+_BUSY = ('503 Service Unavailable', 'Service is busy, please retry later')
+_REJECTIONS = {
+    'too_large': ('413 Request Entity Too Large', 'Upload is larger than the service accepts'),
+    'queue_full': _BUSY,
+    'bytes': _BUSY,
+    'timeout': _BUSY,
+    'expired': ('504 Gateway Timeout', 'Request deadline passed while queued')
+}
+
+
+class AdmissionMiddleware:
+    """
+    WSGI middleware that gates the given paths through an AdmissionController.
+    The request's deadline and priority are parsed here and left in the WSGI
+    environ under deadlines.ENVIRON_KEY for the app. on_reject(reason), if
+    given, is called for every request turned away.
+    """
+
+    def __init__(self, wsgi_app, controller, paths=('/predict', '/predict/batch'),
+                 default_timeout_ms=None, max_timeout_ms=None, on_reject=None):
+        self.wsgi_app = wsgi_app
+        self.on_reject = on_reject
+        self.controller = controller
+        self.paths = frozenset(paths)
+        self.default_timeout_ms = default_timeout_ms
+        self.max_timeout_ms = max_timeout_ms
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') not in self.paths or environ.get('REQUEST_METHOD') != 'POST':
+            return self.wsgi_app(environ, start_response)
+
+        schedule = schedule_from_environ(environ, self.default_timeout_ms, self.max_timeout_ms)
+        environ[ENVIRON_KEY] = schedule
+        try:
+            size = int(environ['CONTENT_LENGTH']) if environ.get('CONTENT_LENGTH') else None
+        except ValueError:
+            size = None
+        reason = self.controller.acquire(size, schedule.deadline, schedule.priority)
+        if reason is not None:
+            return self._reject(reason, start_response)
+
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(size, time.monotonic() - started)
+
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), release)
+        except BaseException:
+            release()
+            raise
+
+    def _reject(self, reason, start_response):
+        if self.on_reject is not None:
+            self.on_reject(reason)
+        status, message = _REJECTIONS[reason]
+        body = dumps({'success': False, 'error': message, 'reason': reason})
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            # The unread upload is discarded with the connection
+            ('Connection', 'close')
+        ]
+        if status.startswith('503'):
+            headers.append(('Retry-After', str(self.controller.retry_after())))
+        start_response(status, headers)
+        return [body]
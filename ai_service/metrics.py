@@ -0,0 +1,205 @@
+"""
+Counters, gauges and latency histograms, exposed in the Prometheus text
+format.
+
+Every metric is declared up front with a fixed set of label values, and its
+values live in anonymous shared memory with one row per worker process.
+serve.py imports the app (which declares the metrics) in the master before
+forking, so each worker writes only its own row, and /metrics, whichever
+worker answers it, reports the sum over all workers (gauges are reported per
+worker). A single-process server uses one row.
+"""
+
+import bisect
+import itertools
+import mmap
+import threading
+import time
+
+import numpy as np
+from werkzeug.wsgi import ClosingIterator
+
+# Histogram buckets (seconds) for request and pipeline stage latencies
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Row of the shared arrays written by this process
+_worker_slot = 0
+
+
+def set_worker_slot(index):
+    """
+    Select the row this (forked) worker process writes to
+    """
+    global _worker_slot
+    _worker_slot = index
+
+
+def worker_slot():
+    return _worker_slot
+
+
+def _format_value(value):
+    if value == np.inf:
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, slots, width, labels):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.series = list(itertools.product(*labels.values()))
+        self._index = {values: i for i, values in enumerate(self.series)}
+        self._slots = slots
+        # Anonymous MAP_SHARED memory is inherited by forked workers
+        self._memory = mmap.mmap(-1, slots * len(self.series) * width * 8)
+        self._values = np.ndarray((slots, len(self.series), width), dtype=np.float64, buffer=self._memory)
+        self._lock = threading.Lock()
+
+    def _row(self, label_values):
+        return self._values[_worker_slot % self._slots, self._index[label_values]]
+
+    def totals(self):
+        """
+        (series, width) array of values summed over all worker rows
+        """
+        return self._values.sum(axis=0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for label_values, values in zip(self.series, self.totals()):
+            lines.extend(self._render_series(list(zip(self.label_names, label_values)), values))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, slots=1, **labels):
+        super().__init__(name, help_text, slots, 1, labels)
+
+    def inc(self, *label_values, amount=1):
+        row = self._row(label_values)
+        with self._lock:
+            row[0] += amount
+
+    def value(self, *label_values):
+        return float(self.totals()[self._index[label_values], 0])
+
+    def _render_series(self, pairs, values):
+        return [f'{self.name}{_format_labels(pairs)} {_format_value(values[0])}']
+
+
+class Gauge(_Metric):
+    """
+    A per-worker value, reported with a worker label instead of summed
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, slots=1, **labels):
+        super().__init__(name, help_text, slots, 1, labels)
+
+    def set(self, value, *label_values):
+        self._row(label_values)[0] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for slot in range(self._slots):
+            for label_values, values in zip(self.series, self._values[slot]):
+                pairs = list(zip(self.label_names, label_values)) + [('worker', slot)]
+                lines.append(f'{self.name}{_format_labels(pairs)} {_format_value(values[0])}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, slots=1, **labels):
+        self.buckets = tuple(sorted(buckets))
+        # Per series: one count per bucket plus +Inf, then sum, then count
+        super().__init__(name, help_text, slots, len(self.buckets) + 3, labels)
+
+    def observe(self, value, *label_values):
+        row = self._row(label_values)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row[bucket] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def _render_series(self, pairs, values):
+        lines = []
+        cumulative = np.cumsum(values[:-2])
+        for bound, count in zip(self.buckets + (np.inf,), cumulative):
+            lines.append(f'{self.name}_bucket{_format_labels(pairs + [("le", _format_value(bound))])} {_format_value(count)}')
+        lines.append(f'{self.name}_sum{_format_labels(pairs)} {_format_value(values[-2])}')
+        lines.append(f'{self.name}_count{_format_labels(pairs)} {_format_value(values[-1])}')
+        return lines
+
+
+class Registry:
+    """
+    The metrics of one service, rendered together for /metrics
+    """
+
+    def __init__(self, slots=1):
+        self.slots = max(1, int(slots))
+        self._metrics = []
+
+    def counter(self, name, help_text, **labels):
+        return self._add(Counter(name, help_text, self.slots, **labels))
+
+    def gauge(self, name, help_text, **labels):
+        return self._add(Gauge(name, help_text, self.slots, **labels))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        return self._add(Histogram(name, help_text, buckets, self.slots, **labels))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class InstrumentationMiddleware:
+    """
+    WSGI middleware that times every request from arrival until its response
+    has been sent, then calls on_response(environ, status_code, seconds)
+    """
+
+    def __init__(self, wsgi_app, on_response):
+        self.wsgi_app = wsgi_app
+        self.on_response = on_response
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = [500]
+
+        def capture_status(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        def done():
+            self.on_response(environ, status[0], time.perf_counter() - started)
+
+        try:
+            return ClosingIterator(self.wsgi_app(environ, capture_status), done)
+        except BaseException:
+            done()
+            raise
@@ -0,0 +1,225 @@
+"""
+Perceptual hashing and a near-duplicate index for recent predictions.
+
+Re-compressed, resized or lightly cropped copies of a photo have different
+bytes but almost the same 64-bit difference hash (dHash). The index finds
+stored hashes within a small Hamming distance of a query without scanning
+every entry, using multi-index hashing: the hash is split into
+(max_distance + 1) chunks, so any match within max_distance agrees exactly
+on at least one chunk (pigeonhole). Each chunk has a sorted lookup table;
+entries added since the last rebuild are scanned directly. The tables are
+rebuilt on a background thread and swapped in, so lookups never wait for a
+sort.
+
+Storage is a fixed-capacity ring buffer, so memory is allocated once and the
+oldest entries are overwritten first.
+"""
+
+import threading
+
+import numpy as np
+
+HASH_BITS = 64
+_GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+    def _popcount64(values):
+        return np.bitwise_count(values)
+else:
+    _BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount64(values):
+        return _BYTE_POPCOUNT[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def dhash(image_array):
+    """
+    64-bit difference hash of an (H, W, 3) or (1, H, W, 3) image array:
+    grayscale, area-average down to 8x9, then compare horizontal neighbours
+    """
+    image = np.asarray(image_array, dtype=np.float32)
+    if image.ndim == 4:
+        image = image[0]
+    gray = image @ _GRAY_WEIGHTS
+    height, width = gray.shape
+    row_edges = np.linspace(0, height, 9).astype(np.intp)[:-1]
+    col_edges = np.linspace(0, width, 10).astype(np.intp)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(gray, row_edges, axis=0), col_edges, axis=1)
+    counts = np.outer(np.diff(np.append(row_edges, height)), np.diff(np.append(col_edges, width)))
+    cells = sums / counts
+    bits = (cells[:, 1:] > cells[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class NearDuplicateIndex:
+    """
+    Bounded index of recent image hashes and their raw model outputs
+    """
+
+    def __init__(self, capacity=100_000, num_classes=None, max_distance=4, rebuild_every=None):
+        self.capacity = int(capacity)
+        self.max_distance = int(max_distance)
+        self.num_classes = num_classes
+        self.rebuild_every = min(rebuild_every or max(4096, self.capacity // 64), max(1, self.capacity))
+        self.model_version = None
+
+        # Split the hash into max_distance + 1 chunks of (almost) equal width
+        num_chunks = self.max_distance + 1
+        widths = [HASH_BITS // num_chunks + (1 if i < HASH_BITS % num_chunks else 0) for i in range(num_chunks)]
+        self._chunk_shifts = np.array(
+            [HASH_BITS - sum(widths[:i + 1]) for i in range(num_chunks)], dtype=np.uint64
+        )
+        self._chunk_masks = np.array([(1 << width) - 1 for width in widths], dtype=np.uint64)
+        # Narrowest dtypes that fit a chunk value and a slot number
+        self._chunk_dtype = np.uint16 if max(widths) <= 16 else np.uint32 if max(widths) <= 32 else np.uint64
+        self._slot_dtype = np.int32 if self.capacity < 2 ** 31 else np.int64
+
+        self._hashes = np.zeros(self.capacity, dtype=np.uint64)
+        self._probabilities = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._rebuild_thread = None
+        self._reset()
+        self.lookups = 0
+        self.hits = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _reset(self):
+        self._generation += 1    # a rebuild from before the reset is discarded
+        self._count = 0          # total entries ever added (ring position)
+        self._indexed_count = 0  # entries covered by the sorted chunk tables
+        self._sorted_chunks = [np.zeros(0, dtype=self._chunk_dtype) for _ in self._chunk_masks]
+        self._sorted_slots = [np.zeros(0, dtype=self._slot_dtype) for _ in self._chunk_masks]
+
+    def _chunks(self, values):
+        values = np.asarray(values, dtype=np.uint64)
+        return [
+            ((values >> shift) & mask).astype(self._chunk_dtype)
+            for shift, mask in zip(self._chunk_shifts, self._chunk_masks)
+        ]
+
+    def set_model_version(self, model_version, num_classes=None):
+        """
+        Drop every stored prediction when the serving model changes
+        """
+        with self._lock:
+            if model_version != self.model_version or (num_classes and num_classes != self.num_classes):
+                self.model_version = model_version
+                self.num_classes = num_classes or self.num_classes
+                self._probabilities = None
+                self._reset()
+
+    def _start_rebuild(self):
+        """
+        Sort the chunk tables of the current entries on a background thread
+        (called under the lock)
+        """
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild, args=(self._count, self._generation), name='near-duplicate-rebuild', daemon=True
+        )
+        self._rebuild_thread.start()
+
+    def _rebuild(self, count, generation):
+        # Reads the live ring without the lock: a slot overwritten meanwhile
+        # holds an entry added after `count`, which lookups scan directly, and
+        # every candidate is checked against the hash in its slot
+        while True:
+            size = min(count, self.capacity)
+            slots = np.arange(size, dtype=self._slot_dtype)
+            sorted_chunks, sorted_slots = [], []
+            for chunk in self._chunks(self._hashes[:size]):
+                order = np.argsort(chunk, kind='stable')
+                sorted_chunks.append(chunk[order])
+                sorted_slots.append(slots[order])
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self._sorted_chunks, self._sorted_slots = sorted_chunks, sorted_slots
+                self._indexed_count = count
+                # Adds that arrived during the sort may already call for another
+                if self._count - count < self.rebuild_every:
+                    return
+                count = self._count
+
+    def wait_for_rebuild(self, timeout=None):
+        """
+        Block until a running background rebuild has swapped its tables in
+        """
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def add(self, image_hash, probabilities, model_version=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            if self._probabilities is None:
+                num_classes = self.num_classes or len(probabilities)
+                self.num_classes = num_classes
+                self._probabilities = np.zeros((self.capacity, num_classes), dtype=np.float16)
+            slot = self._count % self.capacity
+            self._hashes[slot] = np.uint64(image_hash)
+            self._probabilities[slot] = probabilities
+            self._count += 1
+            if self._count - self._indexed_count >= self.rebuild_every:
+                self._start_rebuild()
+
+    def lookup(self, image_hash):
+        """
+        Return (probabilities, distance) of the closest stored hash within
+        max_distance, or (None, None)
+        """
+        if not self.enabled:
+            return None, None
+        query = np.uint64(image_hash)
+        with self._lock:
+            self.lookups += 1
+            if self._count == 0:
+                return None, None
+
+            # Candidates: exact chunk matches in the sorted tables ...
+            candidates = []
+            for i, chunk in enumerate(self._chunks(query)):
+                sorted_chunk = self._sorted_chunks[i]
+                start = np.searchsorted(sorted_chunk, chunk, side='left')
+                end = np.searchsorted(sorted_chunk, chunk, side='right')
+                if end > start:
+                    candidates.append(self._sorted_slots[i][start:end])
+            # ... plus everything written since the last rebuild (at most the
+            # whole ring, if adds outran a rebuild)
+            recent = min(self._count - self._indexed_count, self.capacity)
+            if recent:
+                candidates.append(np.arange(self._count - recent, self._count, dtype=np.int64) % self.capacity)
+            if not candidates:
+                return None, None
+
+            slots = np.concatenate(candidates).astype(np.int64, copy=False)
+            distances = _popcount64(self._hashes[slots] ^ query)
+            best = int(np.argmin(distances))
+            distance = int(distances[best])
+            if distance > self.max_distance:
+                return None, None
+            self.hits += 1
+            return self._probabilities[slots[best]].astype(np.float32), distance
+
+    def stats(self):
+        with self._lock:
+            probabilities_bytes = self._probabilities.nbytes if self._probabilities is not None else 0
+            index_bytes = sum(a.nbytes for a in self._sorted_chunks) + sum(a.nbytes for a in self._sorted_slots)
+            return {
+                'enabled': self.enabled,
+                'entries': min(self._count, self.capacity),
+                'capacity': self.capacity,
+                'max_distance': self.max_distance,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': (self.hits / self.lookups) if self.lookups else 0.0,
+                'memory_bytes': self._hashes.nbytes + probabilities_bytes + index_bytes
+            }
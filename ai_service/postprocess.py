@@ -0,0 +1,65 @@
+"""
+Vectorized post-processing of model outputs.
+
+Works on a whole (batch, classes) probability matrix at once: argmax, top-k
+and confidence thresholding, plus flags for output indices that fall outside
+the curated class list (reported as 'Class_<idx>').
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_TOP_K = 5
+
+Postprocessed = namedtuple('Postprocessed', [
+    'predicted_indices',   # (batch,) argmax class index
+    'confidences',         # (batch,) probability of the predicted class
+    'confident',           # (batch,) confidence >= threshold
+    'predicted_in_range',  # (batch,) predicted index has a curated class name
+    'top_indices',         # (batch, k) best classes, highest first
+    'top_confidences',     # (batch, k) their probabilities
+    'top_in_range'         # (batch, k) top index has a curated class name
+])
+
+
+def top_k(predictions, k=DEFAULT_TOP_K):
+    """
+    Indices and values of the k largest entries of every row, highest first
+    (equal values by class index). argpartition selects the k entries in
+    O(classes); only those k are sorted.
+    """
+    predictions = np.atleast_2d(predictions)
+    num_classes = predictions.shape[1]
+    k = max(1, min(int(k), num_classes))
+    if k < num_classes:
+        # In index order, so the stable sort below keeps ties in index order
+        candidates = np.sort(np.argpartition(predictions, num_classes - k, axis=1)[:, num_classes - k:], axis=1)
+    else:
+        candidates = np.broadcast_to(np.arange(num_classes), predictions.shape)
+    values = np.take_along_axis(predictions, candidates, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def postprocess(predictions, k=DEFAULT_TOP_K, num_known_classes=None, confidence_threshold=0.5):
+    """
+    Argmax, top-k and thresholding for a (batch, classes) matrix
+    """
+    predictions = np.atleast_2d(predictions)
+    if num_known_classes is None:
+        num_known_classes = predictions.shape[1]
+    rows = np.arange(len(predictions))
+
+    predicted_indices = np.argmax(predictions, axis=1)
+    confidences = predictions[rows, predicted_indices]
+    top_indices, top_confidences = top_k(predictions, k)
+    return Postprocessed(
+        predicted_indices=predicted_indices,
+        confidences=confidences,
+        confident=confidences >= confidence_threshold,
+        predicted_in_range=predicted_indices < num_known_classes,
+        top_indices=top_indices,
+        top_confidences=top_confidences,
+        top_in_range=top_indices < num_known_classes
+    )
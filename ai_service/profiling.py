@@ -0,0 +1,174 @@
+"""
+On-demand profiling of live /predict requests.
+
+An admin arms the profiler for the next N requests, or a random sample of
+them. Each profiled request runs under cProfile on its request thread
+(multipart parsing, PIL decode, NumPy, response building) and, optionally,
+inside a TensorFlow profiler trace, which also records the forward pass on
+the batcher thread down to the TF ops. Each request gets its own timestamped
+directory:
+
+  <output_dir>/<YYYYmmdd-HHMMSS>-<pid>-<n>-<endpoint>/
+      python.prof   cProfile stats (pstats, snakeviz)
+      python.txt    top functions by cumulative time
+      tf/           TensorFlow profile (tensorboard --logdir)
+
+The armed state lives in shared memory created before serve.py forks, so N
+counts requests across all workers. While disarmed, the per-request check is
+one read of that memory. Both profilers are process-wide tools, so each
+process profiles one request at a time and skips others meanwhile.
+"""
+
+import cProfile
+import importlib.util
+import io
+import mmap
+import multiprocessing
+import os
+import pstats
+import random
+import threading
+import time
+
+import numpy as np
+
+# Slots of the shared state array
+_REMAINING, _SAMPLE_RATE, _EXPIRES_AT, _TF_TRACE, _CAPTURED = range(5)
+
+# Functions listed in python.txt
+_REPORT_LINES = 40
+
+
+def tensorflow_available():
+    """
+    Whether TensorFlow can be imported (a LiteRT-only deployment has none),
+    without importing it
+    """
+    return importlib.util.find_spec('tensorflow') is not None
+
+
+class ProfileCapture:
+    """
+    Context manager profiling one request into its dump directory
+    """
+
+    def __init__(self, profiler, path, tf_trace):
+        self.path = path
+        self._profiler = profiler
+        self._tf_trace = tf_trace
+        self._tf_started = False
+        self._profile = cProfile.Profile()
+
+    def __enter__(self):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+        except BaseException:
+            self._profiler._finished()
+            raise
+        if self._tf_trace:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.start(os.path.join(self.path, 'tf'))
+                self._tf_started = True
+            except Exception as e:
+                # e.g. no TensorFlow, or a trace started by another tool; the
+                # Python profile still runs
+                self._write('tf_trace_error.txt', f'{type(e).__name__}: {e}')
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profile.disable()
+        try:
+            if self._tf_started:
+                import tensorflow as tf
+                tf.profiler.experimental.stop()
+            self._profile.dump_stats(os.path.join(self.path, 'python.prof'))
+            report = io.StringIO()
+            pstats.Stats(self._profile, stream=report).sort_stats('cumulative').print_stats(_REPORT_LINES)
+            self._write('python.txt', report.getvalue())
+        finally:
+            self._profiler._finished()
+
+    def _write(self, name, text):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(text)
+
+
+class Profiler:
+    """
+    Arms profiling of the next N requests, shared by all forked workers
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        # Anonymous MAP_SHARED memory and the lock are inherited by forked workers
+        self._memory = mmap.mmap(-1, 8 * 8)
+        self._state = np.ndarray((8,), dtype=np.float64, buffer=self._memory)
+        self._shared_lock = multiprocessing.Lock()
+        self._busy = threading.Lock()
+
+    def arm(self, requests, sample_rate=1.0, max_seconds=300.0, tf_trace=None):
+        """
+        Profile up to `requests` of the following requests, each with
+        probability sample_rate, for at most max_seconds. tf_trace defaults
+        to whether TensorFlow is installed.
+        """
+        if tf_trace is None:
+            tf_trace = tensorflow_available()
+        with self._shared_lock:
+            self._state[_SAMPLE_RATE] = min(1.0, max(0.0, float(sample_rate)))
+            self._state[_EXPIRES_AT] = time.time() + float(max_seconds)
+            self._state[_TF_TRACE] = 1.0 if tf_trace else 0.0
+            self._state[_CAPTURED] = 0
+            self._state[_REMAINING] = max(0, int(requests))
+        return self.status()
+
+    def disarm(self):
+        with self._shared_lock:
+            self._state[_REMAINING] = 0
+        return self.status()
+
+    def capture(self, endpoint):
+        """
+        A ProfileCapture if this request should be profiled, otherwise None
+        """
+        if self._state[_REMAINING] <= 0:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        with self._shared_lock:
+            if self._state[_REMAINING] <= 0 or time.time() > self._state[_EXPIRES_AT]:
+                self._state[_REMAINING] = 0
+                claimed = False
+            else:
+                claimed = random.random() < self._state[_SAMPLE_RATE]
+                if claimed:
+                    self._state[_REMAINING] -= 1
+                    self._state[_CAPTURED] += 1
+                    number = int(self._state[_CAPTURED])
+            tf_trace = bool(self._state[_TF_TRACE])
+        if not claimed:
+            self._busy.release()
+            return None
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{number}-{endpoint}"
+        return ProfileCapture(self, os.path.join(self.output_dir, name), tf_trace)
+
+    def _finished(self):
+        self._busy.release()
+
+    def status(self):
+        with self._shared_lock:
+            remaining = int(self._state[_REMAINING])
+            expires_at = float(self._state[_EXPIRES_AT])
+            if remaining and time.time() > expires_at:
+                remaining = 0
+            return {
+                'armed': remaining > 0,
+                'remaining': remaining,
+                'captured': int(self._state[_CAPTURED]),
+                'sample_rate': float(self._state[_SAMPLE_RATE]),
+                'tf_trace': bool(self._state[_TF_TRACE]),
+                'expires_in_s': max(0.0, expires_at - time.time()) if remaining else 0.0,
+                'output_dir': os.path.abspath(self.output_dir)
+            }
@@ -0,0 +1,105 @@
+"""
+Cheap rejection of unusable uploads before inference.
+
+The checks run on the decoded image at the model's input size (224x224 for
+the plant model), so each feature is a few vectorized passes over ~50k
+pixels, under a millisecond in all next to a forward pass:
+
+  brightness   mean luma and the share of near-black / near-white pixels,
+               from a 256-bin luma histogram
+  contrast     standard deviation of the luma (blank or single-colour images)
+  sharpness    variance of the Laplacian of the luma (blur)
+  green ratio  share of pixels whose green channel leads blue and is not far
+               behind red: green and yellowed foliage (screenshots, documents,
+               sky, skin, ...)
+
+The default thresholds only reject images that are clearly unusable; a
+doubtful image still goes to the model.
+"""
+
+import numpy as np
+
+# Reason codes, in the order the checks run
+REASONS = ('too_dark', 'overexposed', 'blank', 'blurry', 'not_plant')
+
+# ITU-R BT.601 luma weights
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Luma values counted as near-black / near-white
+_DARK_LEVEL = 16
+_BRIGHT_LEVEL = 240
+
+# A green-ratio pixel: green above blue by this much, and at least this share of red
+_GREEN_OVER_BLUE = 8
+_GREEN_OVER_RED = 0.8
+
+
+def green_mask(pixels):
+    """
+    Boolean (height, width) mask of the foliage-coloured pixels counted by
+    the green ratio
+    """
+    red, green, blue = (pixels[..., channel].astype(np.int16) for channel in range(3))
+    return (green > blue + _GREEN_OVER_BLUE) & (green >= _GREEN_OVER_RED * red)
+
+
+class QualityGate:
+    """
+    Checks a uint8 (height, width, 3) image against loose usability
+    thresholds; a threshold of None disables its check
+    """
+
+    def __init__(self, min_brightness=20.0, max_brightness=245.0, max_clipped=0.9, min_contrast=4.0,
+                 min_sharpness=3.0, min_green_ratio=0.02):
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.min_green_ratio = min_green_ratio
+
+    def features(self, pixels):
+        pixels = np.asarray(pixels)
+        luma = pixels.astype(np.float32) @ _LUMA
+        histogram = np.bincount(luma.astype(np.uint8).ravel(), minlength=256)
+        total = luma.size
+        levels = np.arange(256)
+        brightness = float(histogram @ levels) / total
+        contrast = float(np.sqrt(max(0.0, float(histogram @ (levels * levels)) / total - brightness * brightness)))
+
+        laplacian = (4.0 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1]
+                     - luma[1:-1, :-2] - luma[1:-1, 2:])
+
+        return {
+            'brightness': brightness,
+            'contrast': contrast,
+            'dark_ratio': float(histogram[:_DARK_LEVEL].sum()) / total,
+            'bright_ratio': float(histogram[_BRIGHT_LEVEL:].sum()) / total,
+            'sharpness': float(laplacian.var()),
+            'green_ratio': float(green_mask(pixels).mean())
+        }
+
+    def check(self, pixels):
+        """
+        (reason, features): reason is one of REASONS for an unusable image,
+        otherwise None
+        """
+        features = self.features(pixels)
+        return self._reason(features), features
+
+    def _reason(self, features):
+        if self.min_brightness is not None and features['brightness'] < self.min_brightness:
+            return 'too_dark'
+        if self.max_clipped is not None and features['dark_ratio'] > self.max_clipped:
+            return 'too_dark'
+        if self.max_brightness is not None and features['brightness'] > self.max_brightness:
+            return 'overexposed'
+        if self.max_clipped is not None and features['bright_ratio'] > self.max_clipped:
+            return 'overexposed'
+        if self.min_contrast is not None and features['contrast'] < self.min_contrast:
+            return 'blank'
+        if self.min_sharpness is not None and features['sharpness'] < self.min_sharpness:
+            return 'blurry'
+        if self.min_green_ratio is not None and features['green_ratio'] < self.min_green_ratio:
+            return 'not_plant'
+        return None
@@ -0,0 +1,128 @@
+"""
+Versioned model registry on local disk.
+
+Each version is a directory holding the model in the formats the service can
+serve and, optionally, its class map:
+
+  <root>/
+      ACTIVE                    version served at startup (rewritten by hot swaps)
+      <version>/
+          <name>.h5             Keras model (.h5 or .keras)
+          <name>_fp32.tflite    TFLite variants written by convert_tflite.py
+          <name>_fp16.tflite
+          <name>_int8.tflite
+          classes.json          class names in model output order (optional)
+          cascade/              small first-stage model of the cascade, in the
+                                same formats (optional)
+
+Versions are ordered by name, numeric parts compared as numbers (v2 < v10).
+Without an ACTIVE file the newest version is served.
+"""
+
+import json
+import os
+import re
+from collections import namedtuple
+
+ACTIVE_FILE = 'ACTIVE'
+CLASSES_FILE = 'classes.json'
+CASCADE_DIR = 'cascade'
+KERAS_EXTENSIONS = ('.h5', '.keras')
+
+# model_path is the file the backend loads; class_names is None without a
+# classes.json (the service's built-in class list applies), cascade_path
+# None without a cascade model
+ModelEntry = namedtuple('ModelEntry', ['version', 'directory', 'model_path', 'class_names', 'cascade_path'])
+
+
+class RegistryError(Exception):
+    pass
+
+
+def version_sort_key(version):
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', version) if part]
+
+
+def model_file(directory, backend):
+    """
+    The file `backend` loads from a version directory, or None
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return None
+    if backend == 'keras':
+        suffixes = KERAS_EXTENSIONS
+    else:
+        suffixes = (f"_{backend.split('-', 1)[1]}.tflite",)
+    for name in names:
+        if name.endswith(suffixes):
+            return os.path.join(directory, name)
+    return None
+
+
+def load_class_names(path):
+    with open(path) as f:
+        class_names = json.load(f)
+    if not isinstance(class_names, list) or not class_names or not all(isinstance(name, str) for name in class_names):
+        raise RegistryError(f'{path} must hold a non-empty JSON list of class names')
+    return class_names
+
+
+class ModelRegistry:
+    """
+    The model versions under `root` that `backend` can serve
+    """
+
+    def __init__(self, root, backend):
+        self.root = root
+        self.backend = backend
+
+    def versions(self):
+        """
+        Servable version names, oldest first
+        """
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        versions = [
+            name for name in names
+            if not name.startswith('.') and model_file(os.path.join(self.root, name), self.backend) is not None
+        ]
+        return sorted(versions, key=version_sort_key)
+
+    def entry(self, version):
+        if not version or os.path.basename(version) != version or version.startswith('.'):
+            raise RegistryError(f"Invalid model version '{version}'")
+        directory = os.path.join(self.root, version)
+        path = model_file(directory, self.backend)
+        if path is None:
+            raise RegistryError(f"No {self.backend} model for version '{version}' in {os.path.abspath(self.root)}")
+        classes_path = os.path.join(directory, CLASSES_FILE)
+        class_names = load_class_names(classes_path) if os.path.exists(classes_path) else None
+        cascade_path = model_file(os.path.join(directory, CASCADE_DIR), self.backend)
+        return ModelEntry(version, directory, path, class_names, cascade_path)
+
+    def active(self):
+        """
+        The version named in ACTIVE if it is servable, else the newest one
+        (None for an empty registry)
+        """
+        versions = self.versions()
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE)) as f:
+                version = f.read().strip()
+        except OSError:
+            version = None
+        if version in versions:
+            return version
+        return versions[-1] if versions else None
+
+    def set_active(self, version):
+        # Written to a temporary file and renamed, so readers never see a partial name
+        path = os.path.join(self.root, ACTIVE_FILE)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(version + '\n')
+        os.replace(temporary, path)
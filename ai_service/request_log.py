@@ -0,0 +1,80 @@
+"""
+Sampled, structured request logging.
+
+Each logged event is one JSON line. Errors are always logged; ordinary
+requests only at the configured sample rate. Lines are handed to a
+background thread through a queue, so request threads never wait on stdout.
+The thread is started on first use in each process, which keeps the log
+working in workers forked by serve.py.
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from responses import dumps
+
+
+class RequestLog:
+    """
+    JSON-lines event log with sampling and a background writer
+    """
+
+    def __init__(self, sample_rate=0.01, stream=None, name='ai_service.requests'):
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self._stream = stream
+        self._logger = logging.getLogger(name)
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._handler = None
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # A forked child inherits the handler but not the writer thread
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            records = queue.SimpleQueue()
+            stream_handler = logging.StreamHandler(self._stream or sys.stdout)
+            stream_handler.setFormatter(logging.Formatter('%(message)s'))
+            if self._handler is not None:
+                self._logger.removeHandler(self._handler)
+            self._handler = logging.handlers.QueueHandler(records)
+            self._logger.addHandler(self._handler)
+            self._listener = logging.handlers.QueueListener(records, stream_handler)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def log(self, event, fields=None, level=logging.INFO):
+        """
+        Write one event unconditionally
+        """
+        if self._pid != os.getpid():
+            self._start()
+        line = {'ts': round(time.time(), 3), 'event': event, 'level': logging.getLevelName(level), 'pid': self._pid}
+        line.update(fields or {})
+        self._logger.log(level, dumps(line).decode('utf-8'))
+
+    def request(self, fields, failed=False):
+        """
+        Write a request event if it failed or falls in the sample
+        """
+        if failed:
+            self.log('request', fields, logging.ERROR)
+        elif self.sampled():
+            self.log('request', fields)
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Re-score stored detection images offline with the current model.
+
+Reads images from a local folder or a tar archive (optionally compressed,
+read as a stream), decodes them in parallel worker processes with the same
+preprocess_image() as /predict, runs them through the model in large
+batches and applies the plant filter. Every image becomes one line of JSONL
+output: the /predict response for it, plus the image's name (and the fields
+of its manifest line, if any).
+
+The pipeline keeps a bounded number of decode tasks in flight, so decoding
+overlaps with inference and memory stays flat on archives of any size.
+
+Output is checkpointed: every --checkpoint-every images the output file is
+synced and <output>.checkpoint records how many images (and output bytes)
+are complete and the name of the last one. Running the same command again
+truncates anything written after the last checkpoint and continues after
+that image: in a folder, with the next name in listing order (so images
+added or removed since are handled), in a tar archive, with the next member
+(the archive must be unchanged). If the output file is missing or does not
+hold the checkpointed lines, the run starts over; --restart forces that.
+
+An optional --manifest (JSON lines, e.g. exported from the backend's
+DetectionHistory collection) gives per-image fields: "image" (path relative
+to the folder, or tar member name) and "plant_name" (the detection's
+plantFilter); its other fields are copied to the output line.
+
+Usage:
+  python rescore.py history/ --output rescored.jsonl
+  python rescore.py history.tar.gz --manifest detections.jsonl --output rescored.jsonl \\
+      --decode-processes 8 --batch-size 64
+  (MODEL_REGISTRY_DIR / MODEL_VERSION / INFERENCE_BACKEND select the model as for app.py)
+"""
+
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+from collections import deque
+
+import numpy as np
+
+import app
+from decode_pool import fork_available
+from imaging import ImageTooLargeError
+from responses import dumps, with_fields
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Images per decode task sent to a worker process
+DECODE_CHUNK = 16
+
+
+def image_order(name):
+    """
+    Sort key of an image path relative to the folder: by its directories,
+    then its file name
+    """
+    return name.split(os.sep)
+
+
+def list_images(folder):
+    """
+    Image paths under folder, relative to it, in image_order()
+    """
+    paths = []
+    for root, directories, files in os.walk(folder):
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, filename), folder))
+    return sorted(paths, key=image_order)
+
+
+class FolderSource:
+    """
+    Images of a folder; workers read the files themselves
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.names = list_images(folder)
+
+    def items(self, done=0, after=None):
+        """
+        (name, path, data) of the images listed after the name `after` (all
+        of them if None); data is read by the decode worker
+        """
+        start = 0
+        if after is not None:
+            start = bisect.bisect_right([image_order(name) for name in self.names], image_order(after))
+        for name in self.names[start:]:
+            yield name, os.path.join(self.folder, name), None
+
+    def progress(self, done):
+        return done / len(self.names) if self.names else 1.0
+
+
+class TarSource:
+    """
+    Image members of a tar archive, read as a stream in archive order
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = None
+        self._finished = False
+
+    def items(self, done=0, after=None):
+        """
+        (name, None, data) of the image members after the first `done`; the
+        last of those must be named `after` (if given)
+        """
+        self._file = open(self.path, 'rb')
+        with self._file, tarfile.open(fileobj=self._file, mode='r|*') as archive:
+            index = 0
+            for member in archive:
+                if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                index += 1
+                if index < done:
+                    continue
+                if index == done:
+                    if after is not None and member.name != after:
+                        raise SystemExit(f"Image {done} of {self.path} is {member.name}, the checkpoint expects "
+                                         f"{after}; the archive has changed, use --restart to start over")
+                    continue
+                yield member.name, None, archive.extractfile(member).read()
+            if index < done:
+                raise SystemExit(f"{self.path} has {index} images, the checkpoint expects at least {done}; "
+                                 f"use --restart to start over")
+        self._finished = True
+
+    def progress(self, done):
+        # Share of the (compressed) archive read so far; done is not needed
+        if self._finished:
+            return 1.0
+        if self._file is None or self._file.closed:
+            return 0.0
+        return min(1.0, self._file.tell() / self.size) if self.size else 1.0
+
+
+def decode_chunk(items, target_size):
+    """
+    Decode a chunk of (name, path, data) in a worker: a stacked uint8 array
+    of the decoded images and a list of (name, error) or (name, None) in
+    input order
+    """
+    images, results = [], []
+    for name, path, data in items:
+        try:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            processed = app.preprocess_image(data, target_size)
+            error = None if processed is not None else 'Failed to process image'
+        except ImageTooLargeError as e:
+            error = str(e)
+        except OSError as e:
+            error = f'Failed to read image: {e}'
+        if error is None:
+            images.append(processed[0])
+        results.append((name, error))
+    return (np.stack(images) if images else None), results
+
+
+def load_manifest(path):
+    manifest = {}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'image' not in record:
+                raise SystemExit(f"{path}:{number}: manifest lines need an 'image' field")
+            manifest[record['image']] = record
+    return manifest
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    # Written to a temporary file and renamed, so a crash never leaves a partial checkpoint
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, path)
+
+
+def count_lines(path, size):
+    """
+    Newlines in the first size bytes of a file, or None if it is shorter
+    """
+    count, left = 0, size
+    with open(path, 'rb') as f:
+        while left:
+            block = f.read(min(left, 1 << 20))
+            if not block:
+                return None
+            count += block.count(b'\n')
+            left -= len(block)
+    return count
+
+
+def resumable(checkpoint, output_path):
+    """
+    Why an output file cannot be resumed from its checkpoint, or None
+    """
+    if 'last_image' not in checkpoint:
+        return 'the checkpoint was written by an older version without image names'
+    if not os.path.exists(output_path):
+        return f'{output_path} is missing'
+    lines = count_lines(output_path, checkpoint['output_bytes'])
+    if lines is None:
+        return f'{output_path} is shorter than the {checkpoint["output_bytes"]} checkpointed bytes'
+    if lines != checkpoint['images']:
+        return f'{output_path} holds {lines} lines where the checkpoint records {checkpoint["images"]} images'
+    return None
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+class Scorer:
+    """
+    Runs decoded images through the model in batches and appends their
+    results to the output
+    """
+
+    def __init__(self, output, manifest, batch_size, top_k):
+        self.output = output
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.names = []
+        self.images = []
+        self.scored = 0
+        self.failed = 0
+        self.written = 0
+        self.last_name = None
+        self.inference_seconds = 0.0
+
+    def add(self, images, results):
+        """
+        Queue one decoded chunk; failed images are written in order once the
+        images queued before them are
+        """
+        rows = iter(images if images is not None else ())
+        for name, error in results:
+            self.names.append((name, error))
+            if error is None:
+                self.images.append(next(rows))
+        if len(self.images) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.names:
+            return
+        scored = [name for name, error in self.names if error is None]
+        bodies = iter(())
+        if scored:
+            started = time.perf_counter()
+            outputs = app.run_model(np.stack(self.images))
+            self.inference_seconds += time.perf_counter() - started
+            # Filter and render the batch in one vectorized pass, as /predict/batch does
+            plant_names = [self.record(name).get('plant_name') or None for name in scored]
+            predictions, plant_match = app.filter_predictions_batch(outputs, plant_names)
+            metadata = [{'cache_hit': False, 'near_duplicate': False, 'model_stage': 'full'}] * len(scored)
+            bodies = iter(app.render_predictions(predictions, plant_names, plant_match, metadata, self.top_k))
+        lines = []
+        for name, error in self.names:
+            fields = {key: value for key, value in self.record(name).items() if key != 'image'}
+            fields['image'] = name
+            if error is None:
+                lines.append(with_fields(next(bodies), fields))
+                self.scored += 1
+            else:
+                lines.append(dumps({'success': False, 'error': error, **fields}))
+                self.failed += 1
+        self.output.write(b'\n'.join(lines) + b'\n')
+        self.written += len(self.names)
+        self.last_name = self.names[-1][0]
+        self.names, self.images = [], []
+
+    def record(self, name):
+        return self.manifest.get(name, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Image folder or tar archive (.tar, .tar.gz, ...)')
+    parser.add_argument('--output', required=True, help='JSONL file the results are appended to')
+    parser.add_argument('--manifest', default=None, help='JSON lines with per-image image / plant_name fields')
+    parser.add_argument('--batch-size', type=int, default=64, help='Images per forward pass')
+    parser.add_argument('--decode-processes', type=int, default=os.cpu_count() or 1,
+                        help='Decode worker processes (0 decodes in this process)')
+    parser.add_argument('--checkpoint-every', type=int, default=1000, help='Images between checkpoints')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='Seconds between progress lines')
+    parser.add_argument('--k', type=int, default=5, help='Entries in top_predictions')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.checkpoint_every < 1 or args.k < 1:
+        parser.error('--batch-size, --checkpoint-every and --k must be positive')
+
+    if os.path.isdir(args.source):
+        source = FolderSource(args.source)
+        print(f"Found {len(source.names)} images in {args.source}")
+    elif tarfile.is_tarfile(args.source):
+        source = TarSource(args.source)
+    else:
+        parser.error(f'{args.source} is neither a folder nor a tar archive')
+    manifest = load_manifest(args.manifest) if args.manifest else {}
+
+    # Decode workers are forked before TensorFlow is loaded
+    pool = None
+    if args.decode_processes > 0 and fork_available():
+        pool = multiprocessing.get_context('fork').Pool(args.decode_processes)
+
+    if not app.load_model(start=False):
+        return 1
+    version = app.active_model.version
+    target_size = app.model_input_size()
+    # Startup only warms up the serving batch sizes
+    app.runner.warm_up([args.batch_size])
+
+    checkpoint_path = args.output + '.checkpoint'
+    checkpoint = None if args.restart else read_checkpoint(checkpoint_path)
+    if checkpoint is not None and (checkpoint['source'] != os.path.abspath(args.source) or checkpoint['model_version'] != version):
+        print(f"{checkpoint_path} belongs to a run over {checkpoint['source']} with model {checkpoint['model_version']}; "
+              f"use --restart to start over")
+        return 1
+    if checkpoint is not None:
+        problem = resumable(checkpoint, args.output)
+        if problem is not None:
+            print(f"Not resuming from {checkpoint_path}: {problem}; starting over")
+            checkpoint = None
+    done = checkpoint['images'] if checkpoint else 0
+    last_image = checkpoint['last_image'] if checkpoint else None
+    output = open(args.output, 'r+b' if checkpoint else 'wb')
+    # Lines written after the last checkpoint are scored again
+    output.truncate(checkpoint['output_bytes'] if checkpoint else 0)
+    output.seek(0, os.SEEK_END)
+    if done:
+        print(f"Resuming after {done} images (last {last_image}) from {checkpoint_path}")
+
+    scorer = Scorer(output, manifest, args.batch_size, min(args.k, app.catalog.num_classes))
+    started = last_progress = time.perf_counter()
+    last_checkpoint = 0
+    # (time, progress) when the first image of this run was scored, the
+    # reference for the ETA
+    first = None
+
+    def report(final=False):
+        now = time.perf_counter()
+        total_done = done + scorer.written
+        rate = scorer.written / (now - started) if now > started else 0.0
+        progress = source.progress(total_done)
+        line = f"{total_done} images"
+        if isinstance(source, FolderSource):
+            line += f"/{len(source.names)}"
+        line += f" ({progress:.1%}), {rate:.1f} images/s, {scorer.failed} failed"
+        if not final and first is not None and first[1] < progress < 1:
+            line += f", ETA {format_duration((now - first[0]) * (1.0 - progress) / (progress - first[1]))}"
+        print(line, flush=True)
+
+    def save_checkpoint():
+        nonlocal last_checkpoint
+        scorer.flush()
+        output.flush()
+        os.fsync(output.fileno())
+        write_checkpoint(checkpoint_path, {
+            'source': os.path.abspath(args.source), 'model_version': version,
+            'images': done + scorer.written, 'output_bytes': output.tell(),
+            'last_image': scorer.last_name or last_image
+        })
+        last_checkpoint = scorer.written
+
+    def consume(images, results):
+        nonlocal last_progress, first
+        if first is None:
+            first = (time.perf_counter(), source.progress(done))
+        scorer.add(images, results)
+        if scorer.written - last_checkpoint >= args.checkpoint_every:
+            save_checkpoint()
+        if time.perf_counter() - last_progress >= args.progress_interval:
+            report()
+            last_progress = time.perf_counter()
+
+    # Bounded number of chunks in flight: decoding runs ahead of inference
+    # without reading the whole source into memory
+    max_pending = 4 * max(1, args.decode_processes)
+    pending = deque()
+    chunk = []
+    try:
+        for item in source.items(done, last_image):
+            chunk.append(item)
+            if len(chunk) < DECODE_CHUNK:
+                continue
+            if pool is None:
+                consume(*decode_chunk(chunk, target_size))
+            else:
+                pending.append(pool.apply_async(decode_chunk, (chunk, target_size)))
+                while len(pending) >= max_pending:
+                    consume(*pending.popleft().get())
+            chunk = []
+        if chunk:
+            if pool is None:
+                consume(*decode_chunk(chunk, target_size))
+            else:
+                pending.append(pool.apply_async(decode_chunk, (chunk, target_size)))
+        while pending:
+            consume(*pending.popleft().get())
+        save_checkpoint()
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; {checkpoint_path} resumes after {done + last_checkpoint} images")
+        return 130
+    finally:
+        output.close()
+        if pool is not None:
+            pool.terminate()
+
+    report(final=True)
+    elapsed = time.perf_counter() - started
+    print(f"Scored {scorer.scored} images ({scorer.failed} failed) with model {version} in {format_duration(elapsed)}; "
+          f"inference {scorer.inference_seconds:.1f} s. Results in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Precompiled class catalog and JSON response rendering.
+
+Everything in a prediction response that depends only on the predicted class
+(parsed plant/disease names, healthy flag, disease_info, recommendation) is
+built and serialized once per class when the model loads. A response is then
+assembled from those cached byte fragments plus the few dynamic fields.
+"""
+
+import json
+from collections import namedtuple
+from types import MappingProxyType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def dumps(obj):
+        """
+        Serialize to compact UTF-8 JSON bytes
+        """
+        return orjson.dumps(obj)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        """
+        Serialize to compact UTF-8 JSON bytes
+        """
+        return _encoder.encode(obj).encode('utf-8')
+
+
+def _float(value):
+    # repr() of a finite Python float is valid JSON and round-trips exactly
+    return repr(float(value)).encode('ascii')
+
+
+_BOOL = {True: b'true', False: b'false'}
+
+
+ClassEntry = namedtuple('ClassEntry', [
+    'index', 'full_class', 'plant', 'disease', 'is_healthy', 'in_class_names',
+    'disease_info', 'recommendation',
+    'prediction_fragment', 'details_fragment', 'top_prefix'
+])
+
+
+def build_recommendation(plant, disease, is_healthy, disease_info):
+    if is_healthy:
+        return f'Your {plant.replace("_", " ")} appears to be healthy! Continue with regular care: {disease_info.get("best_practices", "proper watering, fertilization, and monitoring")}'
+    severity = disease_info.get('severity', 'Unknown')
+    treatment = disease_info.get('treatment', 'Consult agricultural expert')
+    return f'Disease detected: {disease.replace("_", " ")} (Severity: {severity}). Immediate action needed: {treatment}'
+
+
+class ClassCatalog:
+    """
+    Immutable table of per-class response data, aligned with model output
+    indices. Indices past the curated class names get 'Class_<idx>' entries.
+    """
+
+    def __init__(self, class_names, disease_info, default_disease_info, num_classes=None, static_metadata=None):
+        num_classes = max(num_classes or len(class_names), len(class_names))
+        entries = []
+        for index in range(num_classes):
+            in_class_names = index < len(class_names)
+            full_class = class_names[index] if in_class_names else f'Class_{index}'
+
+            # Parse disease information
+            parts = full_class.split('___')
+            plant = parts[0] if len(parts) > 0 else 'Unknown'
+            disease = parts[1] if len(parts) > 1 else 'Unknown'
+            is_healthy = 'healthy' in disease.lower()
+            info = MappingProxyType(dict(disease_info.get(full_class, default_disease_info)))
+            recommendation = build_recommendation(plant, disease, is_healthy, info)
+
+            prediction_fragment = dumps({
+                'plant': plant,
+                'disease': disease,
+                'full_class': full_class,
+                'is_healthy': is_healthy
+            })[1:-1]
+            details_fragment = (
+                b'"disease_info":' + dumps(dict(info)) +
+                b',"recommendation":' + dumps(recommendation)
+            )
+            top_prefix = b'{"class":' + dumps(full_class) + b',"confidence":'
+            entries.append(ClassEntry(
+                index, full_class, plant, disease, is_healthy, in_class_names,
+                info, recommendation, prediction_fragment, details_fragment, top_prefix
+            ))
+        self.entries = tuple(entries)
+        self.num_classes = num_classes
+        self._static_metadata = dumps(dict(static_metadata or {}))[1:-1]
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def render_prediction(self, predicted_class_index, confidence, top_indices, top_confidences,
+                          plant_name=None, plant_match_confidence=True, metadata=None, confident=None):
+        """
+        JSON bytes of one /predict result. top_indices/top_confidences are
+        the already-selected top predictions (curated classes only).
+        """
+        entry = self.entries[int(predicted_class_index)]
+        plant_filter_applied = _BOOL[bool(plant_name)]
+
+        top_predictions = b','.join(
+            self.entries[i].top_prefix + _float(value) + b'}'
+            for i, value in zip(top_indices, top_confidences)
+        )
+
+        dynamic_metadata = {'plant_specific_filtering': bool(plant_name)}
+        if metadata:
+            dynamic_metadata.update(metadata)
+        metadata_fragment = self._static_metadata
+        if metadata_fragment:
+            metadata_fragment += b','
+        metadata_fragment += dumps(dynamic_metadata)[1:-1]
+
+        parts = [
+            b'{"success":true,"prediction":{', entry.prediction_fragment,
+            b',"confidence":', _float(confidence),
+            b',"plant_filter_applied":', plant_filter_applied,
+            b',"plant_match_confidence":', _BOOL[bool(plant_match_confidence)]
+        ]
+        if confident is not None:
+            parts.append(b',"above_confidence_threshold":')
+            parts.append(_BOOL[bool(confident)])
+        parts += [
+            b'},', entry.details_fragment,
+            b',"top_predictions":[', top_predictions,
+            b'],"detection_metadata":{', metadata_fragment, b'}'
+        ]
+        # Add warning if plant type seems wrong
+        if plant_name and not plant_match_confidence:
+            parts.append(b',"warning":')
+            parts.append(dumps(f"Low confidence for {plant_name}. The image might be a different plant type. Consider using auto-detect or selecting the correct plant."))
+        parts.append(b'}')
+        return b''.join(parts)
+
+
+def render_batch(results):
+    """
+    JSON bytes of a /predict/batch response from per-image JSON fragments
+    """
+    return (
+        b'{"success":true,"count":' + str(len(results)).encode('ascii') +
+        b',"results":[' + b','.join(results) + b']}'
+    )
+
+
+def with_fields(body, fields):
+    """
+    JSON bytes of a rendered object with fields appended at its top level
+    """
+    return body[:-1] + b',' + dumps(fields)[1:]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Production entrypoint for the AI service: a pre-forking master and N worker
+processes serving the Flask app from one shared listening socket.
+
+The master binds the socket and, for TFLite backends, loads and warms the
+model before forking, so every worker shares the flatbuffer, class catalog
+and plant masks copy-on-write. The master's interpreters are single-threaded:
+a thread pool does not survive fork(), so each worker rebuilds and warms its
+interpreters with its own threads after the fork. TensorFlow's own runtime is not
+usable across fork() once initialised, so with the keras backend the master
+only imports the code (TensorFlow included, which is fork-safe) and each
+worker loads the model in the background after the fork, answering /live
+meanwhile and /ready once the model is loaded and warmed up. Nothing is
+shared then, so memory grows by a full model per worker; the master logs a
+model_not_shared warning when the keras backend runs more than one worker.
+
+Each worker is pinned to its own slice of the available CPUs and runs
+inference with that many threads (TensorFlow intra-op threads, or TFLite
+interpreter threads), so workers x threads never oversubscribes the cores.
+Workers that die are restarted; SIGTERM/SIGINT stop the whole group. GET /metrics, whichever worker
+answers it, reports the metrics of all workers together. Lifecycle messages
+(worker_started, worker_exited, oversubscribed, shutdown, ...) are JSON
+events in the same log as the requests.
+
+Usage: python serve.py [--workers 4] [--threads-per-worker 2] [--bind 0.0.0.0:5001]
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+def log(event, fields=None, level=logging.INFO):
+    """
+    Write a lifecycle event to the service's JSON log (app is imported
+    by the master before any worker is forked)
+    """
+    import app
+
+    app.request_log.log(event, fields, level)
+
+
+# Exit status of a worker that could not load the model; the master stops
+# instead of restarting it in a loop
+WORKER_BOOT_ERROR = 3
+
+
+class _Shutdown(Exception):
+    pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=os.environ.get('SERVE_BIND', '0.0.0.0:5001'),
+                        help='host:port to listen on (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', 0)),
+                        help='worker processes (default: available CPUs / threads per worker)')
+    parser.add_argument('--threads-per-worker', type=int, default=int(os.environ.get('SERVE_THREADS_PER_WORKER', 0)),
+                        help='inference threads and pinned CPUs per worker (default: available CPUs / workers)')
+    parser.add_argument('--inter-op-threads', type=int, default=int(os.environ.get('SERVE_INTER_OP_THREADS', 1)),
+                        help='TensorFlow inter-op threads per worker (default: %(default)s)')
+    parser.add_argument('--no-pin', action='store_true', help='do not set CPU affinity for workers')
+    parser.add_argument('--backlog', type=int, default=1024, help='listen backlog (default: %(default)s)')
+    parser.add_argument('--model', default=None, help='model file to serve instead of app.MODEL_PATH')
+    return parser.parse_args(argv)
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(cpus, workers=0, threads_per_worker=0):
+    """
+    Split the CPUs into one contiguous slice per worker.
+    Returns (workers, threads_per_worker, [cpu list per worker]).
+    """
+    if workers <= 0 and threads_per_worker <= 0:
+        threads_per_worker = 1
+    if workers <= 0:
+        workers = max(1, len(cpus) // threads_per_worker)
+    if threads_per_worker <= 0:
+        threads_per_worker = max(1, len(cpus) // workers)
+    slices = [
+        [cpus[(worker * threads_per_worker + i) % len(cpus)] for i in range(threads_per_worker)]
+        for worker in range(workers)
+    ]
+    return workers, threads_per_worker, slices
+
+
+def bind_socket(bind, backlog):
+    host, _, port = bind.rpartition(':')
+    host = host.strip('[]') or '0.0.0.0'
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock, host, int(port)
+
+
+def configure_threads(threads, inter_op_threads):
+    """
+    Set TensorFlow's thread pools before this process initialises the
+    runtime (TFLite interpreters take TFLITE_NUM_THREADS instead)
+    """
+    import tensorflow as tf
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        log('thread_config_failed', {'error': str(e)}, logging.WARNING)
+
+
+def run_worker(index, sock, host, port, cpus, args, preloaded):
+    # The master handles Ctrl+C and tells workers to stop with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    import app
+    import metrics
+    from werkzeug.serving import make_server
+
+    # A restarted worker keeps adding to its predecessor's metrics row
+    metrics.set_worker_slot(index)
+
+    # Werkzeug's per-request access log is replaced by the sampled request log
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server(host, port, app.app, threaded=True, fd=sock.fileno())
+    if preloaded:
+        app.set_inference_threads(args.tflite_threads)
+        app.start_pipeline()
+    else:
+        # Answer /live (and /ready with 503) while the model loads and warms up
+        configure_threads(args.threads_per_worker, args.inter_op_threads)
+
+        def load():
+            if not app.load_model():
+                # Flush model_load_failed before the process goes
+                app.request_log.close()
+                os._exit(WORKER_BOOT_ERROR)
+        threading.Thread(target=load, name='model-loader', daemon=True).start()
+    log('worker_started', {'worker': index, 'cpus': cpus, 'preloaded': preloaded})
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def spawn(index, sock, host, port, cpus, args, preloaded):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(index, sock, host, port, cpus, args, preloaded)
+        except BaseException as e:
+            import app
+
+            log('worker_failed', {'worker': index, 'error': str(e)}, logging.ERROR)
+            app.request_log.close()
+        os._exit(1)
+    return pid
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cpus = available_cpus()
+    args.workers, args.threads_per_worker, cpu_slices = plan_workers(cpus, args.workers, args.threads_per_worker)
+
+    # Threads of each worker's TFLite interpreters
+    args.tflite_threads = int(os.environ.get('TFLITE_NUM_THREADS') or args.threads_per_worker)
+    os.environ['TFLITE_NUM_THREADS'] = str(args.tflite_threads)
+    # One row of the shared metrics per worker, allocated when app is imported
+    os.environ['METRICS_WORKER_SLOTS'] = str(args.workers)
+    import app
+
+    try:
+        return run_master(args, cpus, cpu_slices)
+    finally:
+        # The log writer is a daemon thread; flush the master's last events
+        app.request_log.close()
+
+
+def run_master(args, cpus, cpu_slices):
+    import app
+
+    if args.workers * args.threads_per_worker > len(cpus):
+        log('oversubscribed', {'workers': args.workers, 'threads_per_worker': args.threads_per_worker,
+                               'cpus': len(cpus)}, logging.WARNING)
+
+    if args.model:
+        app.MODEL_PATH = args.model
+        if 'TFLITE_MODEL_DIR' not in os.environ:
+            app.TFLITE_MODEL_DIR = os.path.dirname(os.path.abspath(args.model))
+
+    sock, host, port = bind_socket(args.bind, args.backlog)
+
+    preloaded = app.INFERENCE_BACKEND != 'keras'
+    if preloaded:
+        log('master_loading', {'backend': app.INFERENCE_BACKEND})
+        # No interpreter thread pools before fork(); workers add their own
+        app.TFLITE_NUM_THREADS = 1
+        if not app.load_model(start=False):
+            log('shutdown', {'reason': 'model_load_failed'}, logging.ERROR)
+            return 1
+    else:
+        if args.workers > 1:
+            # TensorFlow's runtime does not survive fork(), so nothing is
+            # shared: memory grows with every worker
+            log('model_not_shared', {
+                'backend': app.INFERENCE_BACKEND, 'workers': args.workers,
+                'hint': 'each worker loads its own copy of the model; use a tflite-* backend to share one copy'
+            }, logging.WARNING)
+        # Importing TensorFlow (without starting its runtime) is fork-safe;
+        # doing it once here saves every worker the import
+        started = time.perf_counter()
+        import tensorflow  # noqa: F401
+        app.startup_timings['tensorflow_import'] = time.perf_counter() - started
+
+    log('serving', {'workers': args.workers, 'threads_per_worker': args.threads_per_worker, 'host': host,
+                    'port': port, 'cpus': len(cpus), 'backend': app.INFERENCE_BACKEND})
+
+    def stop(signum, frame):
+        raise _Shutdown()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    workers = {}
+    status = 0
+    try:
+        for index in range(args.workers):
+            cpu_slice = None if args.no_pin else cpu_slices[index]
+            workers[spawn(index, sock, host, port, cpu_slice, args, preloaded)] = index
+
+        while workers:
+            pid, wait_status = os.waitpid(-1, 0)
+            index = workers.pop(pid, None)
+            if index is None:
+                continue
+            code = os.waitstatus_to_exitcode(wait_status)
+            if code == WORKER_BOOT_ERROR:
+                log('shutdown', {'reason': 'worker_boot_failed', 'worker': index, 'worker_pid': pid},
+                    logging.ERROR)
+                status = 1
+                break
+            log('worker_exited', {'worker': index, 'worker_pid': pid, 'status': code, 'restarting': True},
+                logging.WARNING)
+            time.sleep(0.5)
+            cpu_slice = None if args.no_pin else cpu_slices[index]
+            workers[spawn(index, sock, host, port, cpu_slice, args, preloaded)] = index
+    except _Shutdown:
+        log('shutdown', {'reason': 'signal', 'workers': len(workers)})
+
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,455 @@
+"""
+Approximate nearest-neighbour index of image embeddings, for "similar past
+cases" lookups.
+
+Embeddings are L2-normalized (similarity is cosine) and stored as int8 with
+one float32 scale per vector, a quarter of their float32 size. An index is a
+directory of append-only files plus an inverted-file (IVF) segment:
+
+  index.json            embedding size
+  vectors.i8            int8 vectors, one row per entry
+  scales.f4             float32 scale of each row
+  entries.jsonl         {"id": ..., "metadata": {...}} line of each row
+  entries.ends          int64 end offset of each line, written last: the
+                        number of complete rows
+  CURRENT               name of the current segment directory
+  ivf-<rows>-<gen>/     IVF over the first <rows> rows, from build <gen>:
+      centroids.npy     (lists, dim) unit centroids from spherical k-means
+      offsets.npy       start of each list in the arrays below, plus the end
+      rows.npy          row numbers grouped by list
+      vectors.npy       the int8 vectors grouped by list
+      scales.npy        their scales
+
+Everything is memory-mapped, so several serve.py workers share one copy in
+the page cache. A search scores the centroids, reads the vectors of the
+nprobe closest lists (contiguous slices) and scans the rows added since the
+segment was built; only the top-k entries' lines are read.
+
+Adds append under an exclusive file lock, so any worker can add and the
+others see the new rows on their next search. Once the rows outside the
+segment exceed a share of those inside it, a background thread builds a new
+segment and switches CURRENT to it; searches keep using the old segment
+until then.
+"""
+
+import json
+import math
+import os
+import shutil
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: adds from one process only
+    fcntl = None
+
+_INFO_FILE = 'index.json'
+_VECTORS_FILE = 'vectors.i8'
+_SCALES_FILE = 'scales.f4'
+_ENTRIES_FILE = 'entries.jsonl'
+_ENDS_FILE = 'entries.ends'
+_CURRENT_FILE = 'CURRENT'
+_LOCK_FILE = 'write.lock'
+_REBUILD_LOCK_FILE = 'rebuild.lock'
+_SEGMENT_PREFIX = 'ivf-'
+
+# Rows dequantized at once when scanning or building
+_CHUNK_ROWS = 65536
+
+
+class _FileLock:
+    """
+    Exclusive flock() on a file, across processes
+    """
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                self._file.close()
+                self._file = None
+                return False
+        return True
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def normalize(vectors):
+    """
+    Row-wise L2-normalized float32 copy; zero vectors raise ValueError
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    if not np.all(np.isfinite(vectors)) or np.any(norms == 0):
+        raise ValueError('Embeddings must be finite and non-zero')
+    return vectors / norms
+
+
+def quantize(unit_vectors):
+    """
+    int8 rows and float32 per-row scales of unit vectors
+    """
+    scales = np.abs(unit_vectors).max(axis=1) / 127.0
+    return np.round(unit_vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _dot(vectors, scales, query):
+    return (vectors.astype(np.float32) @ query) * scales
+
+
+def _top(scores, k):
+    """
+    Indices of the k highest scores, best first
+    """
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def spherical_kmeans(sample, lists, iterations=8, seed=0):
+    """
+    (lists, dim) unit centroids of a float32 sample of unit vectors
+    """
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(sample, centroids)
+        counts = np.bincount(labels, minlength=lists)
+        # Per-list sums over the sample sorted by list
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # Empty lists restart from random sample vectors
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign(vectors, centroids, scales=None):
+    """
+    Closest centroid of every row (dequantized with scales for int8 rows),
+    computed in chunks
+    """
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + _CHUNK_ROWS], dtype=np.float32)
+        if scales is not None:
+            chunk *= scales[start:start + _CHUNK_ROWS, None]
+        labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return labels
+
+
+class _Segment:
+    """
+    A built IVF segment, memory-mapped
+    """
+
+    def __init__(self, directory):
+        self.name = os.path.basename(directory)
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.rows = np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r')
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        self.scales = np.load(os.path.join(directory, 'scales.npy'), mmap_mode='r')
+        self.size = len(self.rows)
+
+
+# Everything a search reads, swapped in as one object so a search never
+# mixes rows, mappings and segment from different refreshes
+_State = namedtuple('_State', 'rows vectors scales ends segment entries_fd stamp')
+_EMPTY = _State(0, None, None, None, None, None, None)
+
+
+class SimilarityIndex:
+    """
+    Append-only IVF index of embeddings under `directory`, created on the
+    first add
+    """
+
+    def __init__(self, directory, nprobe=16, rebuild_fraction=0.1, min_segment_rows=4096):
+        self.directory = directory
+        self.nprobe = max(1, int(nprobe))
+        self.rebuild_fraction = float(rebuild_fraction)
+        self.min_segment_rows = int(min_segment_rows)
+        self.dim = None
+        self._lock = threading.Lock()
+        self._rebuild_thread = None
+        self._rebuild_error = None
+        self._state = _EMPTY
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_info(self):
+        if self.dim is None:
+            try:
+                with open(self._path(_INFO_FILE)) as f:
+                    self.dim = int(json.load(f)['dim'])
+            except FileNotFoundError:
+                return False
+        return True
+
+    def _committed_rows(self):
+        try:
+            return os.path.getsize(self._path(_ENDS_FILE)) // 8
+        except OSError:
+            return 0
+
+    def _refresh(self):
+        """
+        Map rows and a segment written since the last look (by this or
+        another process); returns the current state
+        """
+        state = self._state
+        if (self._committed_rows(), _mtime(self._path(_CURRENT_FILE))) == state.stamp:
+            return state
+        with self._lock:
+            state = self._state
+            if not self._read_info():
+                return state
+            # CURRENT before the row count: a segment never covers rows this
+            # state doesn't map
+            current_mtime = _mtime(self._path(_CURRENT_FILE))
+            segment = None
+            try:
+                with open(self._path(_CURRENT_FILE)) as f:
+                    name = f.read().strip()
+                segment = state.segment if state.segment is not None and state.segment.name == name else \
+                    _Segment(self._path(name))
+            except OSError:
+                pass
+            rows = self._committed_rows()
+            stamp = (rows, current_mtime)
+            if stamp == state.stamp:
+                return state
+            vectors, scales, ends = state.vectors, state.scales, state.ends
+            if rows != state.rows:
+                vectors = np.memmap(self._path(_VECTORS_FILE), np.int8, 'r', shape=(rows, self.dim)) if rows else None
+                scales = np.memmap(self._path(_SCALES_FILE), np.float32, 'r', shape=(rows,)) if rows else None
+                ends = np.memmap(self._path(_ENDS_FILE), np.int64, 'r', shape=(rows,)) if rows else None
+            entries_fd = state.entries_fd
+            if rows and entries_fd is None:
+                entries_fd = os.open(self._path(_ENTRIES_FILE), os.O_RDONLY)
+            self._state = state = _State(rows, vectors, scales, ends, segment, entries_fd, stamp)
+            return state
+
+    def __len__(self):
+        return self._refresh().rows
+
+    def add(self, ids, vectors, metadata=None):
+        """
+        Append entries (ids, their embeddings and optional metadata dicts);
+        returns the number of entries in the index
+        """
+        unit = normalize(vectors)
+        if len(ids) != len(unit) or (metadata is not None and len(metadata) != len(unit)):
+            raise ValueError('ids, embeddings and metadata must have the same length')
+        metadata = metadata or [None] * len(unit)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, _FileLock(self._path(_LOCK_FILE)):
+            if not self._read_info():
+                self.dim = unit.shape[1]
+                with open(self._path(_INFO_FILE), 'w') as f:
+                    json.dump({'dim': self.dim}, f)
+            if unit.shape[1] != self.dim:
+                raise ValueError(f'Embeddings have {unit.shape[1]} dimensions, the index {self.dim}')
+            quantized, scales = quantize(unit)
+            rows = self._truncate_to_committed()
+            lines = [json.dumps({'id': entry_id, 'metadata': meta or {}}, ensure_ascii=False).encode('utf-8') + b'\n'
+                     for entry_id, meta in zip(ids, metadata)]
+            with open(self._path(_ENTRIES_FILE), 'ab') as f:
+                start = f.tell()
+                f.write(b''.join(lines))
+            with open(self._path(_VECTORS_FILE), 'ab') as f:
+                f.write(quantized.tobytes())
+            with open(self._path(_SCALES_FILE), 'ab') as f:
+                f.write(scales.tobytes())
+            # Line ends go last: they make the rows visible
+            with open(self._path(_ENDS_FILE), 'ab') as f:
+                f.write((start + np.cumsum([len(line) for line in lines])).astype(np.int64).tobytes())
+            rows += len(lines)
+        self._maybe_rebuild(rows)
+        return rows
+
+    def _truncate_to_committed(self):
+        """
+        Drop partial rows a crashed writer left after the last line end
+        """
+        rows = self._committed_rows()
+        entries_end = 0
+        if rows:
+            with open(self._path(_ENDS_FILE), 'rb') as f:
+                f.seek((rows - 1) * 8)
+                entries_end = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+        for name, size in ((_VECTORS_FILE, rows * self.dim), (_SCALES_FILE, rows * 4), (_ENTRIES_FILE, entries_end),
+                           (_ENDS_FILE, rows * 8)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+        return rows
+
+    def search(self, vector, k=10, nprobe=None):
+        """
+        Up to k (similarity, id, metadata) of the entries closest to vector,
+        most similar first
+        """
+        state = self._refresh()
+        if not state.rows:
+            return []
+        query = normalize(vector)[0]
+        if len(query) != self.dim:
+            raise ValueError(f'Embedding has {len(query)} dimensions, the index {self.dim}')
+        vectors, scales, segment, rows = state.vectors, state.scales, state.segment, state.rows
+        candidate_rows, candidate_scores = [], []
+        indexed = 0
+        if segment is not None:
+            indexed = segment.size
+            nprobe = min(len(segment.centroids), nprobe or self.nprobe)
+            probe = _top(segment.centroids @ query, nprobe)
+            slices = [slice(segment.offsets[i], segment.offsets[i + 1]) for i in probe]
+            candidate_rows.append(np.concatenate([segment.rows[s] for s in slices]))
+            candidate_scores.append(_dot(np.concatenate([segment.vectors[s] for s in slices]),
+                                         np.concatenate([segment.scales[s] for s in slices]), query))
+        # Rows added since the segment was built are scanned exactly
+        for start in range(indexed, rows, _CHUNK_ROWS):
+            stop = min(rows, start + _CHUNK_ROWS)
+            candidate_rows.append(np.arange(start, stop))
+            candidate_scores.append(_dot(vectors[start:stop], scales[start:stop], query))
+        candidate_rows = np.concatenate(candidate_rows)
+        scores = np.concatenate(candidate_scores)
+        best = _top(scores, k)
+        # int8 rounding can put an exact match a hair above 1
+        return [(min(1.0, float(scores[i])),) + self._entry(state, int(candidate_rows[i])) for i in best]
+
+    @staticmethod
+    def _entry(state, row):
+        start = int(state.ends[row - 1]) if row else 0
+        line = json.loads(os.pread(state.entries_fd, int(state.ends[row]) - start, start))
+        return line['id'], line['metadata']
+
+    def _maybe_rebuild(self, rows):
+        segment = self._state.segment
+        indexed = segment.size if segment is not None else 0
+        if rows < self.min_segment_rows or rows - indexed <= self.rebuild_fraction * indexed:
+            return
+        self.rebuild_in_background()
+
+    def rebuild_in_background(self):
+        """
+        Start building a new segment over all rows, unless a build is running;
+        returns whether one was started
+        """
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return False
+            self._rebuild_thread = threading.Thread(target=self._rebuild_quietly, name='similarity-rebuild', daemon=True)
+            self._rebuild_thread.start()
+            return True
+
+    def _rebuild_quietly(self):
+        try:
+            self.rebuild()
+            self._rebuild_error = None
+        except Exception as e:
+            self._rebuild_error = str(e)
+
+    def rebuild(self, lists=None, iterations=8, seed=0):
+        """
+        Build a segment over every row and make it current; returns its row
+        count, or None if another process is already building one
+        """
+        state = self._refresh()
+        rows = state.rows
+        if not rows:
+            return 0
+        with _FileLock(self._path(_REBUILD_LOCK_FILE), blocking=False) as locked:
+            if not locked:
+                return None
+            vectors, scales = state.vectors, state.scales
+            lists = max(1, min(rows, lists or round(math.sqrt(rows))))
+            rng = np.random.default_rng(seed)
+            # Centroids are trained on a sample of about 40 vectors per list
+            sample_rows = np.sort(rng.choice(rows, min(rows, 40 * lists), replace=False))
+            sample = normalize(vectors[sample_rows].astype(np.float32) * scales[sample_rows, None])
+            centroids = spherical_kmeans(sample, lists, iterations, seed)
+            labels = assign(vectors, centroids, scales)
+            order = np.argsort(labels, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=lists))]).astype(np.int64)
+
+            # A new name for every build: CURRENT may still name a segment of
+            # the same row count, which workers are about to map
+            name = f'{_SEGMENT_PREFIX}{rows}-{self._next_generation()}'
+            temporary = self._path(f'{name}.{os.getpid()}.tmp')
+            shutil.rmtree(temporary, ignore_errors=True)
+            os.makedirs(temporary)
+            np.save(os.path.join(temporary, 'centroids.npy'), centroids)
+            np.save(os.path.join(temporary, 'offsets.npy'), offsets)
+            np.save(os.path.join(temporary, 'rows.npy'), order.astype(np.int64))
+            grouped = np.lib.format.open_memmap(os.path.join(temporary, 'vectors.npy'), 'w+', np.int8, (rows, self.dim))
+            for start in range(0, rows, _CHUNK_ROWS):
+                grouped[start:start + _CHUNK_ROWS] = vectors[order[start:start + _CHUNK_ROWS]]
+            grouped.flush()
+            del grouped
+            np.save(os.path.join(temporary, 'scales.npy'), np.asarray(scales)[order])
+            os.replace(temporary, self._path(name))
+            current = self._path(f'{_CURRENT_FILE}.{os.getpid()}.tmp')
+            with open(current, 'w') as f:
+                f.write(name + '\n')
+            os.replace(current, self._path(_CURRENT_FILE))
+            # Workers still searching an old segment keep their mapping
+            for entry in os.listdir(self.directory):
+                if entry.startswith(_SEGMENT_PREFIX) and entry != name and not entry.endswith('.tmp'):
+                    shutil.rmtree(self._path(entry), ignore_errors=True)
+        self._refresh()
+        return rows
+
+    def _next_generation(self):
+        """
+        One more than the highest build number among the segment directories
+        """
+        generation = 0
+        for entry in os.listdir(self.directory):
+            if entry.startswith(_SEGMENT_PREFIX) and not entry.endswith('.tmp'):
+                _, _, suffix = entry[len(_SEGMENT_PREFIX):].partition('-')
+                if suffix.isdigit():
+                    generation = max(generation, int(suffix))
+        return generation + 1
+
+    def stats(self):
+        state = self._refresh()
+        segment = state.segment
+        building = self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+        return {
+            'entries': state.rows,
+            'dim': self.dim,
+            'indexed': segment.size if segment is not None else 0,
+            'lists': len(segment.centroids) if segment is not None else 0,
+            'nprobe': self.nprobe,
+            'rebuilding': building,
+            'rebuild_error': self._rebuild_error
+        }
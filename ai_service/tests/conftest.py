@@ -0,0 +1,11 @@
+"""
+Unit tests of the AI service modules; none of them loads a model.
+
+Run from ai_service/: python -m pytest -q tests
+"""
+
+import os
+import sys
+
+# The service modules are imported as top-level modules, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,133 @@
+"""
+Stand-in model versions for tests that drive app.py without a real model.
+
+A stub runner's output for an image is picked by the red value of its
+top-left pixel, so a test controls the answer through the upload.
+"""
+
+import io
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app
+from registry import ModelEntry
+
+INPUT_SIZE = 32
+
+# Module globals that activate() and the swap code replace
+_SWAPPED_GLOBALS = ('active_model', 'model', 'runner', 'catalog', 'plant_masks', 'class_names',
+                    'loaded_model_version', 'cascade_runner', 'cascade_images_baseline', 'shadow')
+
+
+def one_hot(num_classes, index, confidence):
+    row = np.full(num_classes, (1.0 - confidence) / (num_classes - 1), dtype=np.float32)
+    row[index] = confidence
+    return row
+
+
+class StubRunner:
+    """
+    Runner returning classify(image) for every image of a batch
+    """
+
+    embedding_size = 0
+
+    def __init__(self, classify, num_classes):
+        self.classify = classify
+        self.num_classes = num_classes
+        self.input_shape = (INPUT_SIZE, INPUT_SIZE, 3)
+        self.calls = 0
+
+    def __call__(self, batch):
+        self.calls += 1
+        return np.stack([self.classify(image) for image in batch])
+
+    def forward(self, batch):
+        probabilities = self(batch)
+        return probabilities, np.zeros((len(probabilities), 0), dtype=np.float32)
+
+    def warm_up(self, batch_sizes):
+        return {}
+
+
+def answering(index, confidence=0.9):
+    """
+    classify() of a model that answers class `index` for every image
+    """
+    return lambda image: one_hot(len(app.CLASS_NAMES), index, confidence)
+
+
+_seeds = itertools.count()
+
+
+def upload(code=0):
+    """
+    PNG of random pixels (new ones on every call, so no cache or
+    near-duplicate hits) whose top-left red value is `code`
+    """
+    pixels = np.random.default_rng(next(_seeds)).integers(0, 256, (INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    pixels[0, 0, 0] = code
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class StubVersions:
+    """
+    Registry of stub versions: define() them, then load() or serve() one
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.runners = {}
+        self.loads = {}
+
+    def define(self, version, classify, cascade=None):
+        self.runners[version] = StubRunner(classify, len(app.CLASS_NAMES))
+        (self.directory / f'{version}.h5').write_bytes(version.encode())
+        if cascade is not None:
+            self.runners[f'{version}-small'] = StubRunner(cascade, len(app.CLASS_NAMES))
+            (self.directory / f'{version}-small.h5').write_bytes(version.encode())
+        return self.runners[version]
+
+    def entry(self, version=None):
+        version = version or app.MODEL_VERSION
+        cascade = self.directory / f'{version}-small.h5'
+        return ModelEntry(version, str(self.directory), str(self.directory / f'{version}.h5'), None,
+                          str(cascade) if cascade.exists() else None)
+
+    def build_runner(self, path):
+        name = path.rsplit('/', 1)[-1][:-len('.h5')]
+        self.loads[name] = self.loads.get(name, 0) + 1
+        return None, self.runners[name]
+
+    def serve(self, version):
+        app.activate(app.load_version(self.entry(version)))
+        if app.batcher is None:
+            app.start_pipeline()
+
+
+@pytest.fixture
+def versions(monkeypatch, tmp_path):
+    """
+    StubVersions wired into app (restored afterwards), without the quality
+    gate or the registry directory
+    """
+    for name in _SWAPPED_GLOBALS:
+        monkeypatch.setattr(app, name, getattr(app, name))
+    stubs = StubVersions(tmp_path)
+    monkeypatch.setattr(app, 'build_runner', stubs.build_runner)
+    monkeypatch.setattr(app, 'model_entry', stubs.entry)
+    monkeypatch.setattr(app.registry, 'versions', lambda: [])
+    monkeypatch.setattr(app, 'quality_gate', None)
+    yield stubs
+    app.stop_shadow()
+
+
+def predict(image, **form):
+    response = app.app.test_client().post('/predict', data={'image': (io.BytesIO(image), 'leaf.png'), **form},
+                                          buffered=True)
+    return response.status_code, response.get_json()
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+from deadlines import DeadlineExceeded
+
+
+class GatedModel:
+    """
+    predict_fn that records each batch and holds it until the gate opens
+    """
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+    def __call__(self, batch):
+        self.batches.append(batch[:, 0].tolist())
+        self.started.set()
+        self.gate.wait(5.0)
+        return batch * 2
+
+
+def submit_in_background(batcher, value, results, **kwargs):
+    def run():
+        try:
+            results[value] = batcher.submit(np.array([value]), timeout=5.0, **kwargs)
+        except Exception as e:
+            results[value] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(batcher, depth):
+    stop = time.monotonic() + 5.0
+    while batcher.stats()['queue_depth'] < depth:
+        assert time.monotonic() < stop
+        time.sleep(0.005)
+
+
+def test_each_caller_gets_its_own_row():
+    batcher = MicroBatcher(lambda batch: batch * 2, max_batch_size=4, max_wait_ms=50)
+    results = {}
+    threads = [submit_in_background(batcher, value, results) for value in range(8)]
+    for thread in threads:
+        thread.join(5.0)
+    assert {value: int(row[0]) for value, row in results.items()} == {value: value * 2 for value in range(8)}
+    assert batcher.stats()['images'] == 8
+
+
+def test_callers_queued_during_a_pass_share_the_next_batch():
+    model = GatedModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=1)
+    results = {}
+    running = submit_in_background(batcher, 0, results)
+    assert model.started.wait(5.0)
+
+    threads = [submit_in_background(batcher, value, results) for value in (1, 2, 3)]
+    wait_for_queue(batcher, 3)
+    model.gate.set()
+    for thread in [running] + threads:
+        thread.join(5.0)
+    assert model.batches[0] == [0]
+    assert sorted(model.batches[1]) == [1, 2, 3]
+    assert batcher.stats()['batch_size_distribution'] == {'1': 1, '3': 1}
+
+
+def test_a_failed_pass_raises_in_every_caller():
+    def fail(batch):
+        raise RuntimeError('out of memory')
+
+    batcher = MicroBatcher(fail, max_batch_size=4, max_wait_ms=20)
+    results = {}
+    threads = [submit_in_background(batcher, value, results) for value in range(3)]
+    for thread in threads:
+        thread.join(5.0)
+    assert all(isinstance(error, RuntimeError) for error in results.values())
+    assert len(results) == 3
+
+
+def test_tuple_outputs_are_split_per_caller():
+    batcher = MicroBatcher(lambda batch: (batch * 2, batch + 1), max_batch_size=4, max_wait_ms=1)
+    doubled, incremented = batcher.submit(np.array([3]), timeout=5.0)
+    assert (int(doubled[0]), int(incremented[0])) == (6, 4)
+
+
+def test_expired_item_is_shed_without_running():
+    model = GatedModel()
+    model.gate.set()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=1)
+    with pytest.raises(DeadlineExceeded):
+        batcher.submit(np.array([1]), timeout=5.0, deadline=time.monotonic() - 1.0)
+    assert batcher.stats()['expired'] == 1
+    assert model.batches == []
+
+
+def test_deadline_passing_while_queued_is_shed():
+    model = GatedModel()
+    batcher = MicroBatcher(model, max_batch_size=1, max_wait_ms=1)
+    results = {}
+    running = submit_in_background(batcher, 1, results)
+    assert model.started.wait(5.0)
+
+    # Queued behind the running batch; one deadline passes before it ends
+    threads = [
+        submit_in_background(batcher, 2, results, deadline=time.monotonic() + 0.05),
+        submit_in_background(batcher, 3, results, deadline=time.monotonic() + 60.0)
+    ]
+    wait_for_queue(batcher, 2)
+    time.sleep(0.1)
+    model.gate.set()
+    for thread in [running] + threads:
+        thread.join(5.0)
+
+    assert isinstance(results[2], DeadlineExceeded)
+    assert int(results[3][0]) == 6
+    assert model.batches == [[1], [3]]
+    assert batcher.stats()['expired'] == 1
+
+
+def test_deadline_shorter_than_a_forward_pass_is_shed():
+    batcher = MicroBatcher(lambda batch: (time.sleep(0.05), batch)[1], max_batch_size=1, max_wait_ms=1)
+    for value in range(5):
+        batcher.submit(np.array([value]), timeout=5.0)
+    # The running estimate of a forward pass is now well above 5 ms
+    with pytest.raises(DeadlineExceeded):
+        batcher.submit(np.array([9]), timeout=5.0, deadline=time.monotonic() + 0.005)
+
+
+def test_interactive_work_runs_before_bulk():
+    model = GatedModel()
+    batcher = MicroBatcher(model, max_batch_size=1, max_wait_ms=1)
+    results = {}
+    running = submit_in_background(batcher, 0, results)
+    assert model.started.wait(5.0)
+
+    threads = []
+    for value, priority in ((1, 1), (2, 1), (3, 0)):
+        threads.append(submit_in_background(batcher, value, results, priority=priority))
+        wait_for_queue(batcher, len(threads))
+    model.gate.set()
+    for thread in [running] + threads:
+        thread.join(5.0)
+    assert model.batches == [[0], [3], [1], [2]]
+
+
+def test_timed_out_callers_are_not_run():
+    model = GatedModel()
+    batcher = MicroBatcher(model, max_batch_size=1, max_wait_ms=0)
+    results = {}
+    blocker = submit_in_background(batcher, 1, results)
+    model.started.wait(5.0)
+    with pytest.raises(TimeoutError):
+        batcher.submit(np.array([2]), timeout=0.05)
+    waiting = submit_in_background(batcher, 3, results)
+    wait_for_queue(batcher, 2)
+    model.gate.set()
+    for thread in (blocker, waiting):
+        thread.join(5.0)
+    assert model.batches == [[1], [3]]
+    assert int(results[3][0]) == 6
+    assert batcher.stats()['cancelled'] == 1
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# The benchmark scripts import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import suite  # noqa: E402
+
+
+def entry(p50, p95=None, p99=None, per_s=100.0, **fields):
+    return dict(p50_ms=p50, p95_ms=p95 or p50, p99_ms=p99 or p50, per_s=per_s, **fields)
+
+
+def regressions(results, baseline, tolerance=0.1, tail_tolerance=0.25, min_delta_ms=0.5):
+    rows = suite.compare(results, baseline, tolerance, tail_tolerance, min_delta_ms)
+    return sorted((section, name, field) for section, name, field, _, _, _, regressed in rows if regressed)
+
+
+def test_summarize_reports_percentiles_and_rate():
+    summary = suite.summarize([float(ms) for ms in range(1, 101)])
+    assert summary['p50_ms'] == pytest.approx(50.5)
+    assert summary['p99_ms'] == pytest.approx(99.01)
+    assert summary['per_s'] == pytest.approx(1000.0 / 50.5)
+    assert suite.summarize([5.0, 5.0], count=40, seconds=2.0)['per_s'] == 20.0
+    assert suite.summarize([])['samples'] == 0
+
+
+def test_latency_and_throughput_regressions():
+    baseline = {'micro': {'decode': entry(10.0), 'topk': entry(0.2)}}
+    assert regressions({'micro': {'decode': entry(10.9), 'topk': entry(0.2)}}, baseline) == []
+    # 15% slower: past the tolerance, but not the tail tolerance
+    assert regressions({'micro': {'decode': entry(11.5)}}, baseline) == [('micro', 'decode', 'p50_ms')]
+    assert regressions({'micro': {'decode': entry(10.0, per_s=85.0)}}, baseline) == [('micro', 'decode', 'per_s')]
+
+
+def test_tails_get_their_own_tolerance_and_tiny_changes_are_ignored():
+    baseline = {'micro': {'decode': entry(10.0), 'topk': entry(0.2)}}
+    assert regressions({'micro': {'decode': entry(10.0, p95=12.0)}}, baseline) == []
+    assert regressions({'micro': {'decode': entry(10.0, p99=13.0)}}, baseline) == [('micro', 'decode', 'p99_ms')]
+    # Doubled, but by less than min_delta_ms
+    assert regressions({'micro': {'topk': entry(0.4)}}, baseline) == []
+
+
+def test_failed_requests_and_new_entries():
+    baseline = {'load': {'predict': entry(20.0, errors=0)}}
+    assert regressions({'load': {'predict': entry(20.0, errors=3)}}, baseline) == [('load', 'predict', 'errors')]
+    # Nothing to compare a new benchmark with
+    assert regressions({'load': {'predict_batch': entry(900.0)}, 'micro': {'x': entry(1.0)}}, baseline) == []
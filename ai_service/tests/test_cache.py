@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import cache
+from cache import ENTRY_OVERHEAD_BYTES, PredictionCache, image_key
+
+ROW_BYTES = 38 * 4 + ENTRY_OVERHEAD_BYTES
+
+
+def row(value):
+    return np.full(38, value, dtype=np.float32)
+
+
+def test_keys_hash_the_upload_bytes():
+    assert image_key(b'photo') == image_key(b'photo')
+    assert image_key(b'photo') != image_key(b'photo!')
+    assert len(image_key(b'')) == 32
+
+
+def test_least_recently_used_entries_go_past_the_byte_cap():
+    predictions = PredictionCache(max_bytes=3 * ROW_BYTES)
+    predictions.set_model_version('v1')
+    for key in 'abc':
+        predictions.put(key, row(0.1))
+    predictions.get('a')
+    predictions.put('d', row(0.2))
+    assert predictions.get('b') is None
+    assert all(predictions.get(key) is not None for key in 'acd')
+    stats = predictions.stats()
+    assert stats['entries'] == 3 and stats['bytes'] == 3 * ROW_BYTES and stats['evictions'] == 1
+
+    # Replacing an entry does not count it twice
+    predictions.put('d', row(0.3))
+    assert predictions.stats()['bytes'] == 3 * ROW_BYTES
+    assert predictions.get('d')[0] == pytest.approx(0.3)
+
+
+def test_entries_larger_than_the_cap_and_a_disabled_cache():
+    predictions = PredictionCache(max_bytes=ROW_BYTES - 1)
+    predictions.put('a', row(0.1))
+    assert predictions.stats()['entries'] == 0
+    disabled = PredictionCache(max_bytes=0)
+    disabled.put('a', row(0.1))
+    assert not disabled.enabled and disabled.get('a') is None
+
+
+def test_cached_rows_are_read_only_copies():
+    predictions = PredictionCache()
+    original = row(0.1)
+    predictions.put('a', original)
+    original[0] = 0.9
+    cached = predictions.get('a')
+    assert cached[0] == pytest.approx(0.1)
+    with pytest.raises(ValueError):
+        cached[0] = 0.5
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    predictions = PredictionCache(ttl_seconds=60)
+    predictions.put('a', row(0.1))
+    now[0] += 59
+    assert predictions.get('a') is not None
+    now[0] += 2
+    assert predictions.get('a') is None
+    stats = predictions.stats()
+    assert stats['expirations'] == 1 and stats['entries'] == 0 and stats['bytes'] == 0
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+
+def test_a_new_model_fingerprint_invalidates_the_cache():
+    predictions = PredictionCache()
+    predictions.set_model_version('keras:v1:model.h5:1000:1')
+    predictions.put('a', row(0.1), 'keras:v1:model.h5:1000:1')
+    # Same fingerprint again (a reload of an unchanged file) keeps the entries
+    predictions.set_model_version('keras:v1:model.h5:1000:1')
+    assert predictions.get('a') is not None
+
+    predictions.set_model_version('keras:v1:model.h5:1000:2')
+    assert predictions.get('a') is None
+    assert predictions.stats()['invalidations'] == 1
+    # Outputs computed by the previous model, stored after the switch, are ignored
+    predictions.put('a', row(0.1), 'keras:v1:model.h5:1000:1')
+    assert predictions.get('a') is None
+    predictions.put('a', row(0.2), 'keras:v1:model.h5:1000:2')
+    assert predictions.get('a')[0] == pytest.approx(0.2)
@@ -0,0 +1,86 @@
+import io
+
+import app
+from stubs import answering, one_hot, predict, upload, versions  # noqa: F401 (fixture)
+
+SURE, UNSURE = 0, 1
+TOMATO_HEALTHY = app.CLASS_NAMES.index('Tomato___healthy')
+
+
+def small_model(image):
+    """
+    Sure of Apple___Black_rot for SURE uploads; torn between two apple
+    classes for UNSURE ones
+    """
+    if image[0, 0, 0] == SURE:
+        return one_hot(len(app.CLASS_NAMES), 1, 0.95)
+    row = one_hot(len(app.CLASS_NAMES), 1, 0.5)
+    row[2] = 0.45
+    return row
+
+
+def answer(status_and_body):
+    status, body = status_and_body
+    assert status == 200
+    return body['prediction']['full_class'], body['detection_metadata']['model_stage']
+
+
+def predict_batch(images, **form):
+    files = [(io.BytesIO(image), f'leaf{i}.png') for i, image in enumerate(images)]
+    response = app.app.test_client().post('/predict/batch', data={'images': files, **form}, buffered=True)
+    assert response.status_code == 200
+    return [(result['prediction']['full_class'], result['detection_metadata']['model_stage'])
+            for result in response.get_json()['results']]
+
+
+def test_confident_small_answers_skip_the_full_model(versions):
+    full = versions.define('v1', answering(TOMATO_HEALTHY), cascade=small_model)
+    versions.serve('v1')
+    calls = full.calls
+    assert answer(predict(upload(SURE))) == ('Apple___Black_rot', 'small')
+    assert full.calls == calls
+
+
+def test_unsure_small_answers_escalate(versions):
+    full = versions.define('v1', answering(TOMATO_HEALTHY), cascade=small_model)
+    versions.serve('v1')
+    calls = full.calls
+    escalations = app.cascade_escalations_total.value('margin')
+    assert answer(predict(upload(UNSURE))) == ('Tomato___healthy', 'full')
+    assert full.calls == calls + 1
+    assert app.cascade_escalations_total.value('margin') == escalations + 1
+
+
+def test_a_small_answer_for_another_plant_escalates(versions):
+    versions.define('v1', answering(TOMATO_HEALTHY), cascade=small_model)
+    versions.serve('v1')
+    assert answer(predict(upload(SURE), plant_name='Tomato')) == ('Tomato___healthy', 'full')
+
+
+def test_batch_sends_only_escalated_images_to_the_full_model(versions):
+    full = versions.define('v1', answering(TOMATO_HEALTHY), cascade=small_model)
+    versions.serve('v1')
+    calls = full.calls
+    results = predict_batch([upload(SURE), upload(UNSURE), upload(SURE)])
+    assert results == [('Apple___Black_rot', 'small'), ('Tomato___healthy', 'full'), ('Apple___Black_rot', 'small')]
+    assert full.calls == calls + 1
+
+
+def test_hot_swap_to_a_version_without_a_cascade_and_back(versions):
+    versions.define('v1', answering(TOMATO_HEALTHY), cascade=small_model)
+    versions.define('v2', answering(TOMATO_HEALTHY))
+    versions.serve('v1')
+    assert answer(predict(upload(SURE))) == ('Apple___Black_rot', 'small')
+    assert app.cascade_stats()['images']['small'] >= 1
+
+    assert app.apply_model_request('v2', False, 0.0, lambda state: None)
+    assert answer(predict(upload(SURE))) == ('Tomato___healthy', 'full')
+    assert app.cascade_stats()['enabled'] is False
+
+    # The swap back starts counting from zero again
+    assert app.apply_model_request('v1', False, 0.0, lambda state: None)
+    assert app.cascade_stats()['images'] == {'small': 0, 'full': 0}
+    assert answer(predict(upload(UNSURE))) == ('Tomato___healthy', 'full')
+    assert answer(predict(upload(SURE))) == ('Apple___Black_rot', 'small')
+    assert app.cascade_stats()['images'] == {'small': 1, 'full': 1}
+    assert app.cascade_stats()['escalation_rate'] == 0.5
@@ -0,0 +1,44 @@
+import math
+import time
+
+import pytest
+
+from deadlines import PRIORITY_CLASSES, remaining, schedule_from_environ
+
+
+def environ(deadline_ms=None, priority=None):
+    headers = {}
+    if deadline_ms is not None:
+        headers['HTTP_X_DEADLINE_MS'] = deadline_ms
+    if priority is not None:
+        headers['HTTP_X_PRIORITY'] = priority
+    return headers
+
+
+def test_header_sets_the_deadline():
+    schedule = schedule_from_environ(environ('250'), default_timeout_ms=30000)
+    assert remaining(schedule.deadline) == pytest.approx(0.25, abs=0.05)
+    assert schedule.priority == PRIORITY_CLASSES['interactive']
+
+
+def test_defaults_and_cap():
+    assert schedule_from_environ(environ()).deadline == math.inf
+    assert remaining(schedule_from_environ(environ(), default_timeout_ms=1000).deadline) == pytest.approx(1.0, abs=0.05)
+    capped = schedule_from_environ(environ('600000'), default_timeout_ms=1000, max_timeout_ms=2000)
+    assert remaining(capped.deadline) == pytest.approx(2.0, abs=0.05)
+
+
+def test_negative_budgets_are_already_expired():
+    assert schedule_from_environ(environ('-50')).deadline <= time.monotonic()
+
+
+@pytest.mark.parametrize('header', ['soon', '', 'nan', 'NaN', 'inf', '-inf', 'Infinity', '1e999'])
+def test_malformed_and_non_finite_values_fall_back_to_the_default(header):
+    schedule = schedule_from_environ(environ(header), default_timeout_ms=1000, max_timeout_ms=60000)
+    assert remaining(schedule.deadline) == pytest.approx(1.0, abs=0.05)
+
+
+@pytest.mark.parametrize('header, expected', [('bulk', 'bulk'), (' Bulk ', 'bulk'), ('interactive', 'interactive'),
+                                              ('urgent', 'interactive'), (None, 'interactive')])
+def test_priority_classes(header, expected):
+    assert schedule_from_environ(environ(priority=header)).priority == PRIORITY_CLASSES[expected]
@@ -0,0 +1,79 @@
+import io
+import multiprocessing
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, UnidentifiedImageError
+
+from decode_pool import DecodePool
+
+AI_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from imaging import ImageTooLargeError, decode_image
+
+
+def encode(value, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((size[1], size[0], 3), value, dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = DecodePool(processes=1, slots=2, target_size=(16, 16), max_pixels=10_000)
+    yield pool
+    pool.close()
+
+
+def test_pooled_decode_matches_inline_decode(pool):
+    pixels = np.random.default_rng(0).integers(0, 256, size=(30, 40, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    with pool.decode(buffer.getvalue()) as image:
+        assert image.array.shape == (16, 16, 3)
+        np.testing.assert_array_equal(image.array, np.asarray(decode_image(buffer.getvalue(), (16, 16))))
+        assert image.timings['source_size'] == (40, 30)
+    assert pool.stats()['free_slots'] == 2
+
+
+def test_images_beyond_the_free_slots_are_decoded_inline(pool):
+    before = pool.stats()
+    held = [pool.decode(encode(value)) for value in (10, 20)]
+    with pool.decode(encode(30)) as extra:
+        assert int(extra.array[0, 0, 0]) == 30
+    # The held images are untouched by the inline one
+    assert [int(image.array[0, 0, 0]) for image in held] == [10, 20]
+    for image in held:
+        image.release()
+    after = pool.stats()
+    assert (after['pooled'] - before['pooled'], after['inline'] - before['inline']) == (2, 1)
+    assert after['free_slots'] == 2
+
+
+def test_worker_errors_reach_the_caller(pool):
+    with pytest.raises(ImageTooLargeError) as error:
+        pool.decode(encode(0, size=(200, 100)))
+    assert (error.value.width, error.value.height) == (200, 100)
+    with pytest.raises(UnidentifiedImageError):
+        pool.decode(b'not an image')
+    assert pool.stats()['free_slots'] == 2
+
+
+@pytest.mark.skipif('forkserver' not in multiprocessing.get_all_start_methods(), reason='no forkserver')
+def test_workers_do_not_run_the_main_script(tmp_path):
+    # A stand-in for app.py: module-level setup that must run once only
+    script = tmp_path / 'main_script.py'
+    script.write_text(
+        'import sys\n'
+        f'sys.path.insert(0, {AI_SERVICE_DIR!r})\n'
+        'print("main script ran", flush=True)\n'
+        'if __name__ == "__main__":\n'
+        '    from decode_pool import DecodePool\n'
+        '    pool = DecodePool(processes=2, slots=2, target_size=(16, 16))\n'
+        f'    print(pool.decode({encode(7)!r}).array[0, 0, 0], flush=True)\n'
+        '    pool.close()\n'
+    )
+    output = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=60, check=True).stdout
+    assert output.split() == ['main', 'script', 'ran', '7']
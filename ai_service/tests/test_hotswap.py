@@ -0,0 +1,237 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app
+from decode_pool import DecodePool
+from hotswap import DrainGate, LoadedModel, ShadowComparator, SwapSignal
+from stubs import answering, predict, upload, versions  # noqa: F401 (fixture)
+
+
+def served_by(status_and_body):
+    status, body = status_and_body
+    assert status == 200
+    return body['detection_metadata']['model_version']
+
+
+def eventually(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_drain_waits_for_requests_inside_and_holds_new_ones():
+    gate = DrainGate()
+    events = []
+    inside, leave = threading.Event(), threading.Event()
+
+    def request_in_flight():
+        with gate:
+            inside.set()
+            leave.wait()
+            events.append('old request done')
+
+    def swap():
+        with gate.drained(5.0):
+            events.append('swapped')
+
+    def late_request():
+        with gate:
+            events.append('late request')
+
+    threads = [threading.Thread(target=request_in_flight)]
+    threads[0].start()
+    inside.wait()
+    threads.append(threading.Thread(target=swap))
+    threads[1].start()
+    eventually(lambda: gate._closed)
+    threads.append(threading.Thread(target=late_request))
+    threads[2].start()
+    time.sleep(0.05)
+    assert events == []
+
+    leave.set()
+    for thread in threads:
+        thread.join(5.0)
+    assert events == ['old request done', 'swapped', 'late request']
+
+
+def test_drain_timeout_reopens_the_gate():
+    gate = DrainGate()
+    with gate:
+        with pytest.raises(TimeoutError):
+            with gate.drained(0.05):
+                pass
+    # New requests get in again
+    with gate:
+        pass
+    with gate.drained(0.05):
+        pass
+
+
+def test_swap_signal_reaches_forked_workers():
+    signal = SwapSignal(2)
+    assert signal.current() == (0, '', False, 0.0)
+    assert signal.workers() == [{'generation': 0, 'state': 'idle'}] * 2
+
+    pid = os.fork()
+    if pid == 0:
+        # Worker: apply the first request it sees, then exit
+        applied = threading.Event()
+
+        def apply(version, shadow, shadow_rate, report):
+            report('loading')
+            applied.set()
+            return version == 'v2' and shadow and shadow_rate == 0.25
+        signal.watch(apply, slot=1, interval=0.01)
+        applied.wait(5.0)
+        time.sleep(0.1)
+        os._exit(0)
+
+    assert signal.request('v2', shadow=True, shadow_rate=0.25) == 1
+    os.waitpid(pid, 0)
+    assert signal.current() == (1, 'v2', True, 0.25)
+    assert signal.workers() == [{'generation': 0, 'state': 'idle'}, {'generation': 1, 'state': 'shadowing'}]
+
+    with pytest.raises(ValueError):
+        signal.request('v' * 300)
+
+
+def stub_loaded(version, rows, runner=None):
+    names = [f'Class_{i}' for i in range(rows.shape[1])]
+    runner = runner or (lambda batch: rows[:len(batch)])
+    return LoadedModel(version, version, None, runner, names, None, {}, None)
+
+
+def test_shadow_comparison_statistics():
+    primary_rows = np.array([[0.9, 0.1], [0.2, 0.8], [0.7, 0.3]], dtype=np.float32)
+    shadow_rows = np.array([[0.6, 0.4], [0.6, 0.4], [0.6, 0.4]], dtype=np.float32)
+    results = []
+    primary = stub_loaded('v1', primary_rows)
+    comparator = ShadowComparator(stub_loaded('v2', shadow_rows), 1.0, lambda *result: results.append(result),
+                                  max_batch_size=1)
+    for row, stage in zip(primary_rows, ('full', 'full', 'small')):
+        assert comparator.offer(np.zeros((2, 2, 3), np.uint8), row, primary, stage)
+    eventually(lambda: len(results) == 3)
+    comparator.close()
+
+    stats = comparator.stats()
+    assert stats['compared'] == 3
+    assert stats['top1_agreement'] == pytest.approx(2 / 3)
+    assert stats['by_stage'] == {'full': {'compared': 2, 'top1_agreement': 0.5},
+                                 'small': {'compared': 1, 'top1_agreement': 1.0}}
+    assert stats['mean_max_abs_diff'] == pytest.approx(np.mean([0.3, 0.4, 0.1]))
+    assert [agrees for agrees, _, _ in results] == [True, False, True]
+    assert results[1][2]['primary_class'] == 'Class_1' and results[1][2]['shadow_class'] == 'Class_0'
+
+
+def test_close_waits_for_the_candidates_forward_pass():
+    started, finish = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_runner(batch):
+        calls.append(len(batch))
+        started.set()
+        finish.wait(5.0)
+        return np.tile([0.5, 0.5], (len(batch), 1))
+
+    primary = stub_loaded('v1', np.array([[1.0, 0.0]]))
+    comparator = ShadowComparator(stub_loaded('v2', np.array([[0.5, 0.5]]), slow_runner), 1.0, lambda *result: None,
+                                  max_batch_size=1)
+    comparator.offer(np.zeros((2, 2, 3), np.uint8), np.array([1.0, 0.0]), primary)
+    started.wait(5.0)
+    # Queued behind the pass in progress, never run
+    comparator.offer(np.zeros((2, 2, 3), np.uint8), np.array([1.0, 0.0]), primary)
+
+    closer = threading.Thread(target=comparator.close)
+    closer.start()
+    time.sleep(0.05)
+    assert closer.is_alive()
+    finish.set()
+    closer.join(5.0)
+    assert not closer.is_alive()
+    assert calls == [1]
+
+
+def test_promote_reuses_the_shadowed_version_and_rollback_reloads(versions):
+    versions.define('v1', answering(1))
+    versions.define('v2', answering(2))
+    versions.serve('v1')
+    reports = []
+
+    assert app.apply_model_request('v2', True, 1.0, reports.append)
+    assert served_by(predict(upload())) == 'v1'
+    eventually(lambda: app.shadow.stats()['compared'] == 1)
+    assert app.shadow.stats()['top1_agreement'] == 0.0
+    candidate = app.shadow.candidate
+
+    # Promotion stops the comparator and switches to the warmed-up candidate
+    assert app.apply_model_request('v2', False, 0.0, reports.append)
+    assert app.shadow is None
+    assert app.active_model is candidate
+    assert versions.loads == {'v1': 1, 'v2': 1}
+    assert served_by(predict(upload())) == 'v2'
+
+    # Rolling back loads the previous version again
+    assert app.apply_model_request('v1', False, 0.0, reports.append)
+    assert versions.loads == {'v1': 2, 'v2': 1}
+    assert served_by(predict(upload())) == 'v1'
+    assert reports == ['loading', 'draining', 'loading', 'draining']
+
+
+def test_swap_waits_for_a_request_in_flight(versions):
+    versions.define('v1', answering(1))
+    versions.define('v2', answering(2))
+    versions.serve('v1')
+    swapped = threading.Event()
+
+    def swap():
+        app.apply_model_request('v2', False, 0.0, lambda state: None)
+        swapped.set()
+
+    with app.model_gate:
+        swapper = threading.Thread(target=swap)
+        swapper.start()
+        eventually(lambda: app.model_gate._closed)
+        assert app.active_model.version == 'v1'
+    swapper.join(5.0)
+    assert swapped.is_set()
+    assert served_by(predict(upload())) == 'v2'
+
+
+def test_failed_load_keeps_the_serving_version(versions):
+    versions.define('v1', answering(1))
+    versions.serve('v1')
+    assert not app.apply_model_request('missing', False, 0.0, lambda state: None)
+    assert app.active_model.version == 'v1'
+    assert served_by(predict(upload())) == 'v1'
+
+
+def test_swap_to_another_input_size_resizes_the_decode_pool(versions, monkeypatch):
+    shapes = []
+
+    def recording(index):
+        def classify(image):
+            shapes.append(image.shape)
+            return answering(index)(image)
+        return classify
+
+    versions.define('v1', recording(1))
+    versions.define('v2', recording(2)).input_shape = (48, 48, 3)
+    versions.serve('v1')
+    monkeypatch.setattr(app, 'decode_pool', DecodePool(1, 2, app.model_input_size()))
+    try:
+        assert served_by(predict(upload())) == 'v1'
+        assert app.apply_model_request('v2', False, 0.0, lambda state: None)
+        assert app.decode_pool.target_size == (48, 48)
+        pooled = app.decode_pool.stats()['pooled']
+        assert served_by(predict(upload())) == 'v2'
+        # Decoded in the pool at the new version's size
+        assert app.decode_pool.stats()['pooled'] == pooled + 1
+        assert shapes[0] == (32, 32, 3) and shapes[-1] == (48, 48, 3)
+    finally:
+        app.decode_pool.close()
@@ -0,0 +1,58 @@
+import io
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from imaging import ImageTooLargeError, decode_image, image_size
+
+
+def encode(width, height, format='JPEG', mode='RGB'):
+    rng = np.random.default_rng(width)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).convert(mode).save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_jpeg_is_decoded_at_the_smallest_scale_covering_the_target():
+    timings = {}
+    image = decode_image(encode(2000, 1500), (224, 224), timings=timings)
+    assert image.size == (224, 224) and image.mode == 'RGB'
+    assert timings['source_size'] == (2000, 1500)
+    # 1/8 would be 187 rows, short of 224; 1/4 covers it
+    assert timings['decoded_size'] == (500, 375)
+
+
+def test_other_formats_are_decoded_in_full_and_converted():
+    timings = {}
+    image = decode_image(encode(300, 200, 'PNG', mode='L'), (224, 224), timings=timings)
+    assert image.size == (224, 224) and image.mode == 'RGB'
+    assert timings['decoded_size'] == (300, 200)
+
+
+def test_pixel_limit_is_checked_from_the_header():
+    with pytest.raises(ImageTooLargeError) as error:
+        decode_image(encode(400, 300), max_pixels=100_000)
+    assert (error.value.width, error.value.height) == (400, 300)
+
+
+def test_image_size_reads_only_the_header():
+    assert image_size(encode(400, 300)) == (400, 300)
+    with pytest.raises(ImageTooLargeError):
+        image_size(encode(400, 300), max_pixels=100_000)
+
+
+def test_decoded_pixel_limit_applies_after_the_reduced_scale():
+    data = encode(2000, 1500)
+    assert decode_image(data, (224, 224), max_decoded_pixels=500 * 375).size == (224, 224)
+    with pytest.raises(ImageTooLargeError) as error:
+        decode_image(data, (224, 224), max_decoded_pixels=500 * 375 - 1)
+    assert (error.value.width, error.value.height) == (500, 375)
+
+
+def test_too_large_error_survives_pickling():
+    error = pickle.loads(pickle.dumps(ImageTooLargeError(9000, 8000, 64_000_000)))
+    assert (error.width, error.height, error.max_pixels) == (9000, 8000, 64_000_000)
+    assert '72.0 MP' in str(error)
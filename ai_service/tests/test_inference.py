@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import inference
+from inference import KerasRunner, TFLiteRunner, quantize
+
+# int8 input quantization under which pixel 255 (1.0) lands one step past 127
+INPUT_QUANTIZATION = (1 / 256, -128)
+
+
+@pytest.fixture(scope='module')
+def keras_model():
+    tf = pytest.importorskip('tensorflow')
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input((4, 4, 3))
+    features = tf.keras.layers.Dense(6, activation='relu')(tf.keras.layers.Flatten()(inputs))
+    return tf.keras.Model(inputs, tf.keras.layers.Dense(3, activation='softmax')(features))
+
+
+def pixels(count, size=4):
+    return np.random.default_rng(count).integers(0, 256, size=(count, size, size, 3), dtype=np.uint8)
+
+
+def test_keras_runner_matches_the_model(keras_model):
+    runner = KerasRunner(keras_model)
+    assert runner.input_shape == (4, 4, 3) and runner.num_classes == 3
+    batch = pixels(5)
+    np.testing.assert_allclose(runner(batch), keras_model(batch / np.float32(255)).numpy(), rtol=1e-5, atol=1e-6)
+    assert sorted(runner.warm_up([4, 1, 4])) == [1, 4]
+
+
+def test_keras_runner_resizes_other_sizes_in_the_graph(keras_model):
+    import tensorflow as tf
+
+    runner = KerasRunner(keras_model)
+    batch = pixels(2, size=8)
+    expected = keras_model(tf.image.resize(batch / np.float32(255), (4, 4))).numpy()
+    np.testing.assert_allclose(runner(batch), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_keras_runner_returns_the_penultimate_layer(keras_model):
+    runner = KerasRunner(keras_model)
+    assert runner.embedding_size == 6
+    probabilities, embeddings = runner.forward(pixels(3))
+    assert embeddings.shape == (3, 6) and (embeddings >= 0).all()
+    np.testing.assert_allclose(probabilities, runner(pixels(3)), rtol=1e-6)
+
+
+class Int8Interpreter:
+    """
+    Stand-in TFLite interpreter with an int8 (batch, 4, 4, 3) input; its
+    output rows are the largest and smallest input value of each image
+    """
+
+    def __init__(self, model_content=None, num_threads=None):
+        self.shape = [1, 4, 4, 3]
+        self.inputs = None
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': np.array(self.shape), 'dtype': np.int8, 'quantization': INPUT_QUANTIZATION}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.shape[0], 2]), 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = list(shape)
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        assert value.dtype == np.int8 and list(value.shape) == self.shape
+        self.inputs = value
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        flat = self.inputs.reshape(len(self.inputs), -1)
+        return np.stack([flat.max(axis=1), flat.min(axis=1)], axis=1).astype(np.float32)
+
+
+def int8_runner(monkeypatch, tmp_path):
+    monkeypatch.setattr(inference, '_tflite_interpreter_class', lambda: Int8Interpreter)
+    model = tmp_path / 'model_int8.tflite'
+    model.write_bytes(b'')
+    return TFLiteRunner(str(model))
+
+
+def test_batches_are_padded_to_the_smallest_prepared_size(monkeypatch, tmp_path):
+    runner = int8_runner(monkeypatch, tmp_path)
+    assert runner.input_shape == (4, 4, 3) and runner.num_classes == 2
+    assert sorted(runner.warm_up([8, 4])) == [4, 8]
+
+    batch = np.full((3, 4, 4, 3), 64, dtype=np.uint8)
+    np.testing.assert_array_equal(runner(batch), [[-64, -64]] * 3)
+    assert len(runner._interpreters[4]['interpreter'].inputs) == 4
+    # Larger than any prepared size: an interpreter of exactly that size
+    assert len(runner(np.zeros((10, 4, 4, 3), dtype=np.uint8))) == 10
+    assert sorted(runner._interpreters) == [1, 4, 8, 10]
+
+
+def test_quantize_saturates_at_the_dtype_range():
+    values = np.array([-1.0, 0.0, 0.25, 1.0, 2.0], dtype=np.float32)
+    assert quantize(values, 1 / 256, -128, np.int8).tolist() == [-128, -128, -64, 127, 127]
+    assert quantize(values, 1 / 255, 0, np.uint8).tolist() == [0, 0, 64, 255, 255]
+    assert quantize(values, 1 / 32768, 0, np.int16).tolist() == [-32768, 0, 8192, 32767, 32767]
+
+
+def test_int8_inputs_are_clipped_before_the_cast(monkeypatch, tmp_path):
+    runner = int8_runner(monkeypatch, tmp_path)
+    batch = np.zeros((2, 4, 4, 3), dtype=np.uint8)
+    batch[0] = 255
+    batch[1, 0, 0] = (64, 32, 1)
+    # White saturates at 127 instead of wrapping around to -128
+    np.testing.assert_array_equal(runner(batch), [[127, 127], [-64, -128]])
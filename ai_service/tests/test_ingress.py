@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from ingress import AdmissionController, AdmissionMiddleware
+
+MB = 1024 * 1024
+
+
+def wait_until(condition, timeout=5.0):
+    stop = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < stop, 'condition not reached'
+        time.sleep(0.005)
+
+
+def test_admits_up_to_max_in_flight_then_queues():
+    controller = AdmissionController(max_in_flight=2, max_queued=1, queue_timeout=5.0)
+    assert controller.acquire(10) is None
+    assert controller.acquire(10) is None
+
+    waiter = threading.Thread(target=controller.acquire, args=(10,))
+    waiter.start()
+    wait_until(lambda: controller.stats()['queued'] == 1)
+    # The waiting room holds one request
+    assert controller.acquire(10) == 'queue_full'
+
+    controller.release(10, 0.01)
+    waiter.join(5.0)
+    stats = controller.stats()
+    assert (stats['in_flight'], stats['queued'], stats['admitted']) == (2, 0, 3)
+
+
+def test_waiters_are_admitted_in_priority_then_deadline_order():
+    controller = AdmissionController(max_in_flight=1, max_queued=8, queue_timeout=5.0)
+    assert controller.acquire(10) is None
+    now = time.monotonic()
+    waiters = [('bulk', 1, now + 5), ('interactive-late', 0, now + 9), ('interactive-early', 0, now + 6)]
+    admitted = []
+
+    def request(name, priority, deadline):
+        assert controller.acquire(10, deadline, priority) is None
+        admitted.append(name)
+        controller.release(10, 0.01)
+
+    threads = []
+    for waiter in waiters:
+        threads.append(threading.Thread(target=request, args=waiter))
+        threads[-1].start()
+        wait_until(lambda: controller.stats()['queued'] == len(threads))
+    controller.release(10, 0.01)
+    for thread in threads:
+        thread.join(5.0)
+
+    assert admitted == ['interactive-early', 'interactive-late', 'bulk']
+    assert controller.stats()['queued_bytes'] == 0
+
+
+def test_queued_request_expires_at_its_deadline():
+    controller = AdmissionController(max_in_flight=1, max_queued=4, queue_timeout=5.0)
+    assert controller.acquire(10) is None
+
+    started = time.monotonic()
+    assert controller.acquire(20, deadline=started + 0.05) == 'expired'
+    assert time.monotonic() - started < 1.0
+    stats = controller.stats()
+    assert stats['expired']['queued'] == 1
+    assert (stats['queued'], stats['queued_bytes']) == (0, 10)
+
+    # The expired waiter's heap entry does not take the freed slot
+    controller.release(10, 0.01)
+    assert controller.stats()['in_flight'] == 0
+    assert controller.acquire(10) is None
+
+
+def test_queue_timeout_rejects_as_busy():
+    controller = AdmissionController(max_in_flight=1, max_queued=4, queue_timeout=0.05)
+    assert controller.acquire(10) is None
+    assert controller.acquire(10) == 'timeout'
+    assert controller.stats()['rejected']['timeout'] == 1
+
+
+def test_byte_budget_and_size_limits():
+    controller = AdmissionController(max_in_flight=8, max_queued_bytes=10 * MB, max_request_bytes=8 * MB)
+    assert controller.acquire(9 * MB) == 'too_large'
+    assert controller.acquire(6 * MB) is None
+    assert controller.acquire(6 * MB) == 'bytes'
+    assert controller.acquire(4 * MB) is None
+
+
+def test_unknown_size_is_charged_the_estimate():
+    controller = AdmissionController(max_in_flight=8, max_queued_bytes=32 * MB, max_request_bytes=64 * MB,
+                                     unknown_request_bytes=8 * MB)
+    for _ in range(4):
+        assert controller.acquire(None) is None
+    assert controller.stats()['queued_bytes'] == 32 * MB
+    assert controller.acquire(None) == 'bytes'
+    controller.release(None, 0.01)
+    assert controller.stats()['queued_bytes'] == 24 * MB
+
+
+def test_middleware_rejects_with_retry_after():
+    controller = AdmissionController(max_in_flight=1, max_queued=0)
+    app = AdmissionMiddleware(Response('ok'), controller, paths=('/predict',))
+    client = Client(app)
+    assert controller.acquire(10) is None
+
+    response = client.post('/predict', data=b'x' * 10)
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    assert json.loads(response.get_data())['reason'] == 'queue_full'
+    # Ungated paths never wait
+    assert client.get('/health').status_code == 200
+
+    controller.release(10, 0.01)
+    response = client.post('/predict', data=b'x' * 10)
+    assert response.status_code == 200
+    response.close()
+    assert controller.stats()['in_flight'] == 0
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+import metrics
+from metrics import InstrumentationMiddleware, Registry
+
+
+@pytest.fixture(autouse=True)
+def slot():
+    yield
+    metrics.set_worker_slot(0)
+
+
+def fork_workers(count, work):
+    """
+    Run work(index) in `count` forked processes, each writing its own slot
+    """
+    pids = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                metrics.set_worker_slot(index)
+                work(index)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_counters_and_histograms_are_summed_over_worker_slots():
+    registry = Registry(slots=3)
+    requests = registry.counter('requests_total', 'Requests', endpoint=('predict', 'batch'))
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0), endpoint=('predict',))
+
+    def work(index):
+        for _ in range(100 * (index + 1)):
+            requests.inc('predict')
+        requests.inc('batch', amount=index)
+        latency.observe(0.05 * (index + 1), 'predict')
+    fork_workers(3, work)
+
+    assert requests.value('predict') == 600
+    assert requests.value('batch') == 3
+    text = registry.render().decode('utf-8')
+    assert 'requests_total{endpoint="predict"} 600\n' in text
+    assert 'latency_seconds_bucket{endpoint="predict",le="0.1"} 2\n' in text
+    assert 'latency_seconds_bucket{endpoint="predict",le="1"} 3\n' in text
+    assert 'latency_seconds_bucket{endpoint="predict",le="+Inf"} 3\n' in text
+    assert 'latency_seconds_count{endpoint="predict"} 3\n' in text
+    assert 'latency_seconds_sum{endpoint="predict"} 0.30000000000000004\n' in text
+
+
+def test_gauges_are_reported_per_worker():
+    registry = Registry(slots=2)
+    ready = registry.gauge('startup_seconds', 'Startup', phase=('load',))
+    fork_workers(2, lambda index: ready.set(1.5 + index, 'load'))
+    text = registry.render().decode('utf-8')
+    assert 'startup_seconds{phase="load",worker="0"} 1.5\n' in text
+    assert 'startup_seconds{phase="load",worker="1"} 2.5\n' in text
+
+
+def test_slots_past_the_registry_size_wrap_around():
+    registry = Registry(slots=2)
+    errors = registry.counter('errors_total', 'Errors')
+    fork_workers(3, lambda index: errors.inc())
+    assert errors.value() == 3
+
+
+def test_middleware_reports_after_the_response_is_sent():
+    calls = []
+
+    def wsgi_app(environ, start_response):
+        start_response('404 NOT FOUND', [])
+        return [b'missing']
+
+    wrapped = InstrumentationMiddleware(wsgi_app, lambda environ, status, seconds: calls.append((status, seconds)))
+    body = wrapped({}, lambda status, headers, exc_info=None: None)
+    assert list(body) == [b'missing'] and calls == []
+    body.close()
+    assert calls[0][0] == 404 and calls[0][1] >= 0
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import app
+from cache import image_key
+from phash import NearDuplicateIndex, _popcount64, dhash
+from stubs import answering, predict, upload, versions  # noqa: F401 (fixture)
+
+
+def random_hashes(count, seed=0):
+    return [int(value) for value in np.random.default_rng(seed).integers(0, 2 ** 63, count, dtype=np.uint64)]
+
+
+def probabilities(i):
+    return np.array([i, 1.0], dtype=np.float32)
+
+
+def test_dhash_is_close_for_a_resized_copy():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (40, 60, 3), dtype=np.uint8).repeat(8, axis=0).repeat(8, axis=1)
+    resized = np.asarray(Image.fromarray(image).resize((240, 160)))
+    distance = _popcount64(np.array([dhash(image) ^ dhash(resized)], dtype=np.uint64))[0]
+    assert distance <= 4
+
+
+def test_finds_exact_and_near_matches():
+    index = NearDuplicateIndex(capacity=64, rebuild_every=8)
+    hashes = random_hashes(32)
+    for i, value in enumerate(hashes):
+        index.add(value, probabilities(i))
+    index.wait_for_rebuild()
+
+    found, distance = index.lookup(hashes[5])
+    assert (found[0], distance) == (5, 0)
+    found, distance = index.lookup(hashes[20] ^ 0b1001)
+    assert (found[0], distance) == (20, 2)
+    assert index.lookup(hashes[20] ^ 0b11111) == (None, None)
+
+
+def test_ring_buffer_wraps_around():
+    index = NearDuplicateIndex(capacity=8, rebuild_every=4)
+    hashes = random_hashes(21)
+    for i, value in enumerate(hashes):
+        index.add(value, probabilities(i))
+        # Correct whether or not the background rebuild has caught up
+        assert index.lookup(value)[0][0] == i
+    index.wait_for_rebuild()
+
+    # Only the last `capacity` entries survive; older slots were overwritten
+    for i, value in enumerate(hashes):
+        found, distance = index.lookup(value)
+        if i < len(hashes) - 8:
+            assert found is None
+        else:
+            assert (found[0], distance) == (i, 0)
+    assert index.stats()['entries'] == 8
+
+
+def test_model_change_drops_entries():
+    index = NearDuplicateIndex(capacity=8)
+    index.set_model_version('v1', num_classes=2)
+    value = random_hashes(1)[0]
+    index.add(value, probabilities(1), model_version='v1')
+    assert index.lookup(value)[1] == 0
+
+    index.set_model_version('v2', num_classes=2)
+    assert index.lookup(value) == (None, None)
+    # Late adds from the previous version are ignored
+    index.add(value, probabilities(1), model_version='v1')
+    assert index.lookup(value) == (None, None)
+
+
+def reencoded(image, compress_level):
+    """
+    The same pixels in other PNG bytes
+    """
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(image)).save(buffer, 'PNG', compress_level=compress_level)
+    assert buffer.getvalue() != image
+    return buffer.getvalue()
+
+
+def test_near_duplicate_answers_are_not_cached_under_the_new_key(versions):
+    versions.define('v1', answering(1))
+    versions.serve('v1')
+    original = upload()
+    status, body = predict(original)
+    assert status == 200 and not body['detection_metadata']['near_duplicate']
+
+    single, batched = reencoded(original, 1), reencoded(original, 9)
+    status, body = predict(single)
+    assert status == 200 and body['detection_metadata']['near_duplicate_distance'] == 0
+    response = app.app.test_client().post('/predict/batch', data={'images': [(io.BytesIO(batched), 'leaf.png')]},
+                                          buffered=True)
+    assert response.get_json()['results'][0]['detection_metadata']['near_duplicate_distance'] == 0
+
+    # Only the photo the model actually saw is cached
+    assert app.prediction_cache.get(image_key(original)) is not None
+    assert app.prediction_cache.get(image_key(single)) is None
+    assert app.prediction_cache.get(image_key(batched)) is None
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import app
+
+NAMES = app.CLASS_NAMES
+
+
+@pytest.fixture(autouse=True)
+def masks(monkeypatch):
+    monkeypatch.setattr(app, 'plant_masks', app.build_plant_masks(len(NAMES)))
+
+
+def classes_of(*prefixes):
+    return np.array([name.startswith(prefixes) for name in NAMES])
+
+
+def reference(row, plant_name):
+    """
+    The per-row filter on class names
+    """
+    plants = [part.strip().lower() for part in (plant_name or '').split(',')]
+    prefixes = tuple(prefix for plant in plants for prefix in app.PLANT_FILTERS.get(plant, ()))
+    mask = classes_of(*prefixes) if prefixes else None
+    if mask is None or not mask.any():
+        return row, True
+    share = row[mask].sum()
+    if share < app.PLANT_CONFIDENCE_THRESHOLD:
+        return row, False
+    return np.where(mask, row, 0) / share, True
+
+
+@pytest.mark.parametrize('plant_name', ['tomato', 'Tomato', ' TOMATO ', 'Corn', 'MAIZE', 'Potato, tomato'])
+def test_plant_names_are_case_insensitive(plant_name):
+    expected = classes_of(*(prefix for plant in plant_name.lower().split(',')
+                            for prefix in app.PLANT_FILTERS[plant.strip()]))
+    assert expected.any()
+    np.testing.assert_array_equal(app.plant_filter_mask(plant_name), expected)
+
+
+def test_unknown_plants_are_ignored():
+    assert app.plant_filter_mask('banana') is None
+    assert app.plant_filter_mask('') is None
+    np.testing.assert_array_equal(app.plant_filter_mask('banana, Apple'), classes_of('Apple___'))
+
+
+def test_masks_are_read_only():
+    with pytest.raises(ValueError):
+        app.plant_masks['tomato'][0] = True
+
+
+def test_batch_filter_matches_the_per_row_filter():
+    rng = np.random.default_rng(0)
+    predictions = rng.dirichlet(np.full(len(NAMES), 0.3), size=12).astype(np.float32)
+    # A row with nothing on tomato, so its filter fails
+    predictions[3] = np.where(classes_of('Tomato___'), 0.0, predictions[3])
+    predictions[3] /= predictions[3].sum()
+    plant_names = ['tomato', 'Tomato', None, 'TOMATO', '', 'apple,Grape', 'banana', 'Maize', 'rice', 'tomato',
+                   'Potato', 'cotton']
+    filtered, plant_match = app.filter_predictions_batch(predictions, plant_names)
+    for row, name, got, matched in zip(predictions, plant_names, filtered, plant_match):
+        expected, expected_match = reference(row, name)
+        np.testing.assert_allclose(got, expected, rtol=1e-5)
+        assert matched == expected_match
+    assert not plant_match[3]
+
+
+def test_masks_follow_a_models_class_names():
+    names = ['tomato___early_blight', 'Tomato___healthy', 'Potato___healthy']
+    masks = app.build_plant_masks(4, names)
+    assert set(masks) == {'tomato', 'potato'}
+    # Class names keep their case; outputs beyond the names match no plant
+    assert masks['tomato'].tolist() == [False, True, False, False]
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from postprocess import postprocess, top_k
+
+
+def reference(predictions, k):
+    """
+    Full stable sort, highest first, equal values by class index
+    """
+    order = np.argsort(-predictions, axis=1, kind='stable')[:, :k]
+    return order, np.take_along_axis(predictions, order, axis=1)
+
+
+@pytest.mark.parametrize('k', [1, 3, 5, 37, 38, 100])
+def test_top_k_matches_a_full_sort(k):
+    predictions = np.random.default_rng(k).dirichlet(np.ones(38), size=16).astype(np.float32)
+    indices, values = top_k(predictions, k)
+    expected_indices, expected_values = reference(predictions, min(k, 38))
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_array_equal(values, expected_values)
+
+
+@pytest.mark.parametrize('k', [2, 4, 6, 8])
+def test_top_k_with_ties(k):
+    # Few distinct values, so most rows have ties inside and at the edge of the top k
+    predictions = np.random.default_rng(k).integers(0, 4, (32, 8)).astype(np.float32) / 10
+    indices, values = top_k(predictions, k)
+    expected_indices, expected_values = reference(predictions, k)
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(np.take_along_axis(predictions, indices, axis=1), values)
+    for row_indices, row_values, expected in zip(indices, values, expected_indices):
+        assert len(set(row_indices)) == k
+        # Ties in index order; only the classes tied with the k-th one may differ
+        assert all(a < b for a, b, x, y in zip(row_indices, row_indices[1:], row_values, row_values[1:]) if x == y)
+        inside = row_values > row_values[-1]
+        np.testing.assert_array_equal(row_indices[inside], expected[inside])
+
+
+def test_top_k_of_a_single_row_and_invalid_k():
+    indices, values = top_k(np.array([0.1, 0.6, 0.3]), 0)
+    assert indices.tolist() == [[1]] and values.tolist() == [[0.6]]
+    indices, _ = top_k(np.array([0.2, 0.2, 0.6]), 10)
+    assert indices.tolist() == [[2, 0, 1]]
+
+
+def test_postprocess_flags_unknown_classes_and_thresholds():
+    predictions = np.array([[0.1, 0.2, 0.7], [0.45, 0.35, 0.2]], dtype=np.float32)
+    result = postprocess(predictions, k=2, num_known_classes=2, confidence_threshold=0.5)
+    assert result.predicted_indices.tolist() == [2, 0]
+    assert result.confident.tolist() == [True, False]
+    assert result.predicted_in_range.tolist() == [False, True]
+    assert result.top_indices.tolist() == [[2, 1], [0, 1]]
+    assert result.top_in_range.tolist() == [[False, True], [True, True]]
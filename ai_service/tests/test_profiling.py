@@ -0,0 +1,65 @@
+import os
+import sys
+
+import profiling
+from profiling import Profiler
+
+
+def profile_request(capture):
+    with capture:
+        sum(i * i for i in range(1000))
+
+
+def test_captures_the_next_armed_requests(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    assert profiler.capture('predict') is None
+
+    profiler.arm(2, tf_trace=False)
+    for _ in range(2):
+        capture = profiler.capture('predict')
+        profile_request(capture)
+        assert {'python.prof', 'python.txt'} <= set(os.listdir(capture.path))
+    assert profiler.capture('predict') is None
+    status = profiler.status()
+    assert (status['armed'], status['captured']) == (False, 2)
+
+
+def test_one_request_at_a_time_per_process(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.arm(5, tf_trace=False)
+    capture = profiler.capture('predict')
+    assert profiler.capture('predict') is None
+    profile_request(capture)
+    assert profiler.capture('predict') is not None
+
+
+def test_zero_sample_rate_and_expiry_capture_nothing(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.arm(5, sample_rate=0.0, tf_trace=False)
+    assert profiler.capture('predict') is None
+    profiler.arm(5, max_seconds=-1.0, tf_trace=False)
+    assert profiler.capture('predict') is None
+    assert profiler.status()['armed'] is False
+
+
+def test_missing_tensorflow_keeps_the_python_profile(tmp_path, monkeypatch):
+    # An entry of None makes `import tensorflow` raise ImportError
+    monkeypatch.setitem(sys.modules, 'tensorflow', None)
+    profiler = Profiler(str(tmp_path))
+    profiler.arm(2, tf_trace=True)
+
+    capture = profiler.capture('predict')
+    profile_request(capture)
+    files = set(os.listdir(capture.path))
+    assert {'python.prof', 'python.txt', 'tf_trace_error.txt'} <= files
+    # The worker can still profile its next request
+    assert profiler.capture('predict') is not None
+
+
+def test_trace_defaults_to_whether_tensorflow_is_installed(tmp_path, monkeypatch):
+    profiler = Profiler(str(tmp_path))
+    monkeypatch.setattr(profiling, 'tensorflow_available', lambda: False)
+    assert profiler.arm(1)['tf_trace'] is False
+    monkeypatch.setattr(profiling, 'tensorflow_available', lambda: True)
+    assert profiler.arm(1)['tf_trace'] is True
+    assert profiler.arm(1, tf_trace=False)['tf_trace'] is False
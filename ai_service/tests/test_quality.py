@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import app
+from quality import QualityGate
+from stubs import answering, predict, upload, versions  # noqa: F401 (fixture)
+
+SIZE = 224
+
+
+def leaf(seed=0):
+    """
+    Mid-green foliage with lighter veins and some texture
+    """
+    rng = np.random.default_rng(seed)
+    pixels = np.empty((SIZE, SIZE, 3), dtype=np.float32)
+    pixels[...] = (60, 130, 40)
+    pixels[:, ::12] = (110, 180, 80)
+    pixels[::20] = (110, 180, 80)
+    pixels += rng.normal(0, 12, pixels.shape)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def blurred(pixels, passes=20):
+    """
+    Repeated 3x3 box blur of a leaf shaded from dark to light
+    """
+    image = pixels * np.linspace(0.3, 1.5, SIZE, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    for _ in range(passes):
+        padded = np.pad(image, ((1, 1), (1, 1), (0, 0)), mode='edge')
+        image = sum(padded[dy:dy + SIZE, dx:dx + SIZE] for dy in range(3) for dx in range(3)) / 9.0
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def noise(low, high, seed=0):
+    """
+    Grey texture
+    """
+    grey = np.random.default_rng(seed).integers(low, high, (SIZE, SIZE, 1), dtype=np.uint8)
+    return np.repeat(grey, 3, axis=-1)
+
+
+def test_a_leaf_passes():
+    reason, features = QualityGate().check(leaf())
+    assert reason is None
+    assert features['green_ratio'] > 0.5
+
+
+@pytest.mark.parametrize('pixels, expected', [
+    (leaf() // 12, 'too_dark'),
+    (np.where(noise(0, 100) < 92, 0, leaf()).astype(np.uint8), 'too_dark'),
+    (np.full((SIZE, SIZE, 3), 252, np.uint8), 'overexposed'),
+    (np.full((SIZE, SIZE, 3), (70, 140, 50), np.uint8), 'blank'),
+    (blurred(leaf()), 'blurry'),
+    # Grey and blue texture: a document, a wall, the sky
+    (noise(60, 200), 'not_plant'),
+    (np.stack([noise(40, 90)[..., 0], noise(90, 140)[..., 0], noise(180, 240)[..., 0]], axis=-1), 'not_plant'),
+])
+def test_unusable_images_are_rejected(pixels, expected):
+    assert QualityGate().check(pixels)[0] == expected
+
+
+def test_disabled_checks_let_the_image_through():
+    gate = QualityGate(min_sharpness=None, min_green_ratio=None)
+    assert gate.check(blurred(leaf()))[0] is None
+    assert gate.check(noise(60, 200))[0] is None
+
+
+def test_rejected_uploads_get_a_422(versions, monkeypatch):
+    versions.define('v1', answering(1))
+    versions.serve('v1')
+    monkeypatch.setattr(app, 'quality_gate', QualityGate(min_brightness=250))
+    rejected = app.rejected_images_total.value('too_dark')
+    calls = versions.runners['v1'].calls
+
+    status, body = predict(upload())
+    assert status == 422 and body['reason'] == 'too_dark'
+    assert app.rejected_images_total.value('too_dark') == rejected + 1
+    # Rejected before inference
+    assert versions.runners['v1'].calls == calls
+
+
+def test_log_mode_serves_flagged_images(versions, monkeypatch):
+    versions.define('v1', answering(1))
+    versions.serve('v1')
+    monkeypatch.setattr(app, 'quality_gate', QualityGate(min_brightness=250))
+    monkeypatch.setattr(app, 'QUALITY_GATE_MODE', 'log')
+    flagged = app.rejected_images_total.value('too_dark')
+
+    status, body = predict(upload())
+    assert status == 200 and body['success']
+    assert app.rejected_images_total.value('too_dark') == flagged + 1
@@ -0,0 +1,194 @@
+import io
+import json
+import sys
+import tarfile
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import app
+import rescore
+from responses import dumps
+
+IMAGES = 60
+
+
+def png(value):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((8, 8, 3), value, dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def images(tmp_path):
+    folder = tmp_path / 'history'
+    folder.mkdir()
+    for i in range(IMAGES):
+        # One unreadable upload, written out as a failure line
+        (folder / f'img{i:03d}.png').write_bytes(b'not an image' if i == 13 else png(i))
+    return folder
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """
+    Stand-in for the served model: an image's "prediction" is its pixel value
+    """
+    state = SimpleNamespace(version='v1')
+    monkeypatch.setattr(app, 'load_model', lambda start=True: True)
+    monkeypatch.setattr(app, 'active_model', state)
+    monkeypatch.setattr(app, 'runner', SimpleNamespace(input_shape=(8, 8, 3), warm_up=lambda sizes: {}))
+    monkeypatch.setattr(app, 'catalog', SimpleNamespace(num_classes=3))
+    monkeypatch.setattr(app, 'run_model', lambda batch: batch.reshape(len(batch), -1).mean(axis=1))
+    monkeypatch.setattr(app, 'filter_predictions_batch', lambda outputs, plant_names: (outputs, [True] * len(outputs)))
+    monkeypatch.setattr(app, 'render_predictions', lambda predictions, *args: [
+        dumps({'success': True, 'value': int(round(value))}) for value in predictions
+    ])
+    return state
+
+
+def run(monkeypatch, source, output, *options):
+    monkeypatch.setattr(sys, 'argv', ['rescore.py', str(source), '--output', str(output), '--decode-processes', '0',
+                                      '--batch-size', '8', '--checkpoint-every', '32', '--progress-interval', '1000',
+                                      *options])
+    return rescore.main()
+
+
+def interrupt_at_chunk(monkeypatch, number):
+    decode_chunk = rescore.decode_chunk
+    calls = []
+
+    def interrupted(*args):
+        calls.append(None)
+        if len(calls) == number:
+            raise KeyboardInterrupt
+        return decode_chunk(*args)
+
+    monkeypatch.setattr(rescore, 'decode_chunk', interrupted)
+
+
+def test_interrupted_run_resumes_after_the_checkpoint(monkeypatch, tmp_path, images, model):
+    expected = tmp_path / 'expected.jsonl'
+    assert run(monkeypatch, images, expected) == 0
+    lines = expected.read_bytes().splitlines()
+    assert [json.loads(line)['image'] for line in lines] == [f'img{i:03d}.png' for i in range(IMAGES)]
+    assert [json.loads(line).get('value') for line in lines][12:15] == [12, None, 14]
+
+    # Chunks of 16 images: the third is interrupted after 32 images were
+    # checkpointed; nothing was written past the checkpoint yet
+    output = tmp_path / 'output.jsonl'
+    with monkeypatch.context() as patch:
+        interrupt_at_chunk(patch, 3)
+        assert run(patch, images, output) == 130
+    checkpoint = json.loads((tmp_path / 'output.jsonl.checkpoint').read_text())
+    assert checkpoint['images'] == 32
+    assert checkpoint['model_version'] == 'v1'
+
+    assert run(monkeypatch, images, output) == 0
+    assert output.read_bytes() == expected.read_bytes()
+
+
+def test_lines_written_after_the_checkpoint_are_scored_again(monkeypatch, tmp_path, images, model):
+    expected = tmp_path / 'expected.jsonl'
+    assert run(monkeypatch, images, expected) == 0
+
+    output = tmp_path / 'output.jsonl'
+    with monkeypatch.context() as patch:
+        interrupt_at_chunk(patch, 4)
+        assert run(patch, images, output) == 130
+    # 48 images written, the checkpoint covers the first 32
+    assert len(output.read_bytes().splitlines()) == 48
+    assert json.loads((tmp_path / 'output.jsonl.checkpoint').read_text())['images'] == 32
+
+    assert run(monkeypatch, images, output) == 0
+    assert output.read_bytes() == expected.read_bytes()
+
+
+def test_checkpoint_of_another_model_is_not_resumed(monkeypatch, tmp_path, images, model):
+    output = tmp_path / 'output.jsonl'
+    with monkeypatch.context() as patch:
+        interrupt_at_chunk(patch, 3)
+        run(patch, images, output)
+
+    model.version = 'v2'
+    assert run(monkeypatch, images, output) == 1
+    assert run(monkeypatch, images, output, '--restart') == 0
+    assert len(output.read_bytes().splitlines()) == IMAGES
+    assert json.loads((tmp_path / 'output.jsonl.checkpoint').read_text())['model_version'] == 'v2'
+
+
+def test_folder_resumes_by_name_after_files_change(monkeypatch, tmp_path, images, model):
+    output = tmp_path / 'output.jsonl'
+    with monkeypatch.context() as patch:
+        interrupt_at_chunk(patch, 3)
+        assert run(patch, images, output) == 130
+    assert json.loads((tmp_path / 'output.jsonl.checkpoint').read_text())['last_image'] == 'img031.png'
+
+    # Removing a scored image and adding images on either side of the
+    # checkpoint neither skips nor repeats the remaining ones
+    (images / 'img005.png').unlink()
+    for name in ('img000a.png', 'img031a.png', 'img100.png'):
+        (images / name).write_bytes(png(7))
+    assert run(monkeypatch, images, output) == 0
+    names = [json.loads(line)['image'] for line in output.read_bytes().splitlines()]
+    assert names == ([f'img{i:03d}.png' for i in range(32)] + ['img031a.png'] +
+                     [f'img{i:03d}.png' for i in range(32, IMAGES)] + ['img100.png'])
+
+
+def test_images_in_subfolders_are_listed_by_path(tmp_path):
+    for name in ('b.png', 'a/z.png', 'a/b/c.png', 'a.png', 'notes.txt'):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b'')
+    source = rescore.FolderSource(str(tmp_path))
+    assert source.names == ['a/b/c.png', 'a/z.png', 'a.png', 'b.png']
+    assert [name for name, _, _ in source.items(2, 'a/y.png')] == ['a/z.png', 'a.png', 'b.png']
+
+
+@pytest.mark.parametrize('damage', ['delete', 'truncate', 'rewrite'])
+def test_output_that_does_not_match_the_checkpoint_starts_over(monkeypatch, tmp_path, images, model, damage, capsys):
+    expected = tmp_path / 'expected.jsonl'
+    assert run(monkeypatch, images, expected) == 0
+
+    output = tmp_path / 'output.jsonl'
+    with monkeypatch.context() as patch:
+        interrupt_at_chunk(patch, 3)
+        assert run(patch, images, output) == 130
+    data = output.read_bytes()
+    if damage == 'delete':
+        output.unlink()
+    elif damage == 'truncate':
+        output.write_bytes(data[:len(data) // 2])
+    else:
+        # Replaced by a file whose checkpointed bytes hold other lines
+        output.write_bytes(b'{}\n' * len(data))
+    capsys.readouterr()
+
+    assert run(monkeypatch, images, output) == 0
+    assert 'starting over' in capsys.readouterr().out
+    assert output.read_bytes() == expected.read_bytes()
+
+
+def tar_archive(path, names):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name in names:
+            data = png(1)
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+    return rescore.TarSource(str(path))
+
+
+def test_tar_source_skips_completed_members(tmp_path):
+    source = tar_archive(tmp_path / 'history.tar.gz', ('a.png', 'notes.txt', 'b.png', 'c.jpg', 'd.png'))
+    assert [name for name, _, _ in source.items(2, 'b.png')] == ['c.jpg', 'd.png']
+    assert source.progress(4) == 1.0
+
+
+def test_changed_tar_archive_is_not_resumed(tmp_path):
+    source = tar_archive(tmp_path / 'changed.tar.gz', ('a.png', 'x.png', 'c.png'))
+    with pytest.raises(SystemExit, match='archive has changed'):
+        list(source.items(2, 'b.png'))
+    with pytest.raises(SystemExit, match='has 3 images'):
+        list(source.items(5, 'e.png'))
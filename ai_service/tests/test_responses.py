@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+import pytest
+
+import app
+from responses import ClassCatalog, render_batch, with_fields
+
+
+def compact(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def old_response(predictions, plant_name, plant_match_confidence, metadata):
+    """
+    The dict /predict used to build per request (keys in the order the
+    catalog writes them)
+    """
+    index = int(np.argmax(predictions))
+    full_class = app.CLASS_NAMES[index] if index < len(app.CLASS_NAMES) else f'Class_{index}'
+    parts = full_class.split('___')
+    plant, disease = parts[0], parts[1] if len(parts) > 1 else 'Unknown'
+    is_healthy = 'healthy' in disease.lower()
+    disease_info = dict(app.DISEASE_INFO.get(full_class, app.DEFAULT_DISEASE_INFO))
+    if is_healthy:
+        recommendation = f'Your {plant.replace("_", " ")} appears to be healthy! Continue with regular care: {disease_info.get("best_practices", "proper watering, fertilization, and monitoring")}'
+    else:
+        recommendation = f'Disease detected: {disease.replace("_", " ")} (Severity: {disease_info.get("severity", "Unknown")}). Immediate action needed: {disease_info.get("treatment", "Consult agricultural expert")}'
+    top = np.argsort(-predictions, kind='stable')[:5]
+    result = {
+        'success': True,
+        'prediction': {
+            'plant': plant, 'disease': disease, 'full_class': full_class, 'is_healthy': is_healthy,
+            'confidence': float(predictions[index]),
+            'plant_filter_applied': bool(plant_name),
+            'plant_match_confidence': plant_match_confidence
+        },
+        'disease_info': disease_info,
+        'recommendation': recommendation,
+        'top_predictions': [{'class': app.CLASS_NAMES[i], 'confidence': float(predictions[i])}
+                            for i in top if i < len(app.CLASS_NAMES)],
+        'detection_metadata': dict(app.DETECTION_METADATA, plant_specific_filtering=bool(plant_name), **metadata)
+    }
+    if plant_name and not plant_match_confidence:
+        result['warning'] = (f'Low confidence for {plant_name}. The image might be a different plant type. '
+                             'Consider using auto-detect or selecting the correct plant.')
+    return result
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    # Two outputs past the curated class names
+    return ClassCatalog(app.CLASS_NAMES, app.DISEASE_INFO, app.DEFAULT_DISEASE_INFO, len(app.CLASS_NAMES) + 2,
+                        app.DETECTION_METADATA)
+
+
+def render(catalog, predictions, plant_name=None, plant_match_confidence=True, metadata=None):
+    top = [int(i) for i in np.argsort(-predictions, kind='stable')[:5] if i < len(app.CLASS_NAMES)]
+    index = int(np.argmax(predictions))
+    return catalog.render_prediction(index, float(predictions[index]), top, [float(predictions[i]) for i in top],
+                                     plant_name, plant_match_confidence, metadata or {})
+
+
+def test_fragments_match_the_old_dicts(catalog):
+    for entry in catalog.entries:
+        old = old_response(np.eye(catalog.num_classes)[entry.index], None, True, {})
+        prediction = old['prediction']
+        assert entry.prediction_fragment == compact(
+            {key: prediction[key] for key in ('plant', 'disease', 'full_class', 'is_healthy')})[1:-1]
+        assert entry.details_fragment == compact(
+            {'disease_info': old['disease_info'], 'recommendation': old['recommendation']})[1:-1]
+        assert entry.top_prefix == b'{"class":' + compact(entry.full_class) + b',"confidence":'
+    assert catalog[len(app.CLASS_NAMES) + 1].full_class == f'Class_{len(app.CLASS_NAMES) + 1}'
+
+
+@pytest.mark.parametrize('plant_name, plant_match_confidence', [(None, True), ('tomato', True), ('Tomato', False)])
+def test_responses_are_byte_identical(catalog, plant_name, plant_match_confidence):
+    rows = np.random.default_rng(0).dirichlet(np.ones(catalog.num_classes), size=64)
+    # Past the curated names, and a healthy class
+    rows[0, -1] = 5.0
+    rows[1, app.CLASS_NAMES.index('Tomato___healthy')] = 5.0
+    metadata = {'cache_hit': False, 'near_duplicate': True, 'near_duplicate_distance': 3, 'model_stage': 'full'}
+    for row in rows:
+        expected = compact(old_response(row, plant_name, plant_match_confidence, metadata))
+        assert render(catalog, row, plant_name, plant_match_confidence, metadata) == expected
+
+
+def test_responses_decode_like_the_jsonify_output(catalog):
+    row = np.random.default_rng(1).dirichlet(np.ones(catalog.num_classes))
+    with app.app.app_context():
+        old = app.jsonify(old_response(row, 'potato', False, {})).get_data()
+    assert json.loads(render(catalog, row, 'potato', False)) == json.loads(old)
+
+
+def test_batch_body():
+    body = render_batch([b'{"a":1}', b'{"b":2}'])
+    assert json.loads(body) == {'success': True, 'count': 2, 'results': [{'a': 1}, {'b': 2}]}
+
+
+def test_extra_fields_are_appended():
+    assert with_fields(b'{"a":1}', {'embedding': [0.5]}) == b'{"a":1,"embedding":[0.5]}'
+
+
+def test_catalog_entries_are_read_only(catalog):
+    with pytest.raises(TypeError):
+        catalog[0].disease_info['severity'] = 'None'
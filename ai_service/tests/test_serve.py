@@ -0,0 +1,108 @@
+import http.client
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import serve
+
+SERVE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serve.py')
+
+
+def test_plan_workers_splits_the_cpus():
+    assert serve.plan_workers(list(range(8)), workers=2) == (2, 4, [[0, 1, 2, 3], [4, 5, 6, 7]])
+    assert serve.plan_workers(list(range(8)), threads_per_worker=2)[:2] == (4, 2)
+    assert serve.plan_workers(list(range(4)))[:2] == (4, 1)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def stand_in_tflite(path, num_classes):
+    tf = pytest.importorskip('tensorflow')
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input(shape=(32, 32, 3))
+    x = tf.keras.layers.Conv2D(8, 3, strides=2, padding='same', activation='relu')(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax')(x)
+    with open(path, 'wb') as f:
+        f.write(tf.lite.TFLiteConverter.from_keras_model(tf.keras.Model(inputs, outputs)).convert())
+
+
+def jpeg(seed):
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def predict(port, image):
+    boundary = 'stand-in-boundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="leaf.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    # A deadlocked interpreter shows up as a timeout instead of a hung test
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=20.0)
+    try:
+        connection.request('POST', '/predict', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def answering_pids(log_path):
+    pids = set()
+    with open(log_path) as f:
+        for text in f:
+            if text.startswith('{'):
+                line = json.loads(text)
+                if line.get('event') == 'request' and line.get('endpoint') == 'predict':
+                    pids.add(line['pid'])
+    return pids
+
+
+def test_preloaded_tflite_workers_serve_with_several_threads(tmp_path):
+    import app
+    stand_in_tflite(tmp_path / 'stand_in_fp32.tflite', len(app.CLASS_NAMES))
+    port = free_port()
+    env = dict(os.environ, INFERENCE_BACKEND='tflite-fp32', MODEL_REGISTRY_DIR=str(tmp_path / 'registry'),
+               QUALITY_GATE='0', LOG_SAMPLE_RATE='1', DECODE_PROCESSES='0', TF_CPP_MIN_LOG_LEVEL='2')
+    env.pop('TFLITE_NUM_THREADS', None)
+    log_path = tmp_path / 'serve.log'
+    log = open(log_path, 'w')
+    server = subprocess.Popen(
+        [sys.executable, SERVE, '--workers', '2', '--threads-per-worker', '2', '--no-pin',
+         '--model', str(tmp_path / 'stand_in.h5'), '--bind', f'127.0.0.1:{port}'],
+        env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        # Both workers must answer /ready and serve /predict with their own
+        # two-thread interpreters
+        stop = time.monotonic() + 120
+        seed = 0
+        while len(answering_pids(log_path)) < 2:
+            assert time.monotonic() < stop and server.poll() is None, log_path.read_text()
+            try:
+                status, body = predict(port, jpeg(seed))
+            except ConnectionRefusedError:
+                time.sleep(0.2)
+                continue
+            seed += 1
+            if status == 503:  # still loading
+                time.sleep(0.2)
+                continue
+            assert status == 200, body
+            assert json.loads(body)['success']
+    finally:
+        server.terminate()
+        server.wait(30)
+        log.close()
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+import app
+from similarity import SimilarityIndex, normalize, quantize
+from stubs import answering, predict, upload, versions  # noqa: F401 (fixture)
+
+
+def clustered(count, dim=16, clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, dim)))
+    labels = rng.integers(clusters, size=count)
+    return centers[labels] + 0.2 * rng.standard_normal((count, dim)).astype(np.float32) / np.sqrt(dim)
+
+
+@pytest.fixture
+def index(tmp_path):
+    # No background builds: segments are built explicitly
+    return SimilarityIndex(str(tmp_path), nprobe=2, min_segment_rows=2 ** 62)
+
+
+def test_search_before_any_segment_scans_every_row(index):
+    vectors = clustered(50)
+    index.add([f'case{i}' for i in range(50)], vectors, [{'plant': 'tomato', 'row': i} for i in range(50)])
+    similarity, case_id, metadata = index.search(vectors[17], k=1)[0]
+    assert (case_id, metadata) == ('case17', {'plant': 'tomato', 'row': 17})
+    assert similarity == pytest.approx(1.0, abs=0.01)
+    assert index.stats()['indexed'] == 0
+
+
+def test_search_covers_rows_added_after_the_segment(index):
+    vectors = clustered(600)
+    index.add([f'old{i}' for i in range(500)], vectors[:500])
+    assert index.rebuild(lists=8) == 500
+    index.add([f'new{i}' for i in range(100)], vectors[500:])
+    stats = index.stats()
+    assert (stats['entries'], stats['indexed'], stats['lists']) == (600, 500, 8)
+
+    # Unindexed rows are scanned exactly, indexed ones through the probed lists
+    assert index.search(vectors[550], k=1)[0][1] == 'new50'
+    assert index.search(vectors[123], k=1)[0][1] == 'old123'
+    # With every list probed, IVF search matches an exact scan of the
+    # stored (int8) vectors
+    query = vectors[7] + 0.05
+    stored, scales = quantize(normalize(vectors))
+    exact = np.argsort(-(stored.astype(np.float32) @ normalize(query)[0]) * scales, kind='stable')[:10]
+    found = [case_id for _, case_id, _ in index.search(query, k=10, nprobe=8)]
+    assert found == [f'old{i}' if i < 500 else f'new{i - 500}' for i in exact]
+
+
+def test_another_instance_sees_new_rows_and_segments(index, tmp_path):
+    vectors = clustered(300)
+    index.add([f'case{i}' for i in range(200)], vectors[:200])
+    reader = SimilarityIndex(str(tmp_path))
+    assert len(reader) == 200
+
+    index.rebuild(lists=4)
+    index.add([f'case{i}' for i in range(200, 300)], vectors[200:])
+    assert len(reader) == 300
+    assert reader.stats()['indexed'] == 200
+    assert reader.search(vectors[250], k=1)[0][1] == 'case250'
+
+
+def test_rebuild_with_the_same_rows_switches_to_a_new_segment(index, tmp_path):
+    vectors = clustered(200)
+    index.add([f'case{i}' for i in range(200)], vectors)
+    index.rebuild(lists=4)
+    first = (tmp_path / 'CURRENT').read_text().strip()
+
+    # The live segment is never replaced in place, only removed once
+    # CURRENT names its successor
+    index.rebuild(lists=4)
+    second = (tmp_path / 'CURRENT').read_text().strip()
+    assert second != first
+    assert sorted(entry.name for entry in tmp_path.iterdir() if entry.name.startswith('ivf-')) == [second]
+    reader = SimilarityIndex(str(tmp_path))
+    assert reader.stats()['indexed'] == 200
+    assert reader.search(vectors[42], k=1)[0][1] == 'case42'
+
+
+def test_partial_rows_of_a_crashed_writer_are_dropped(index, tmp_path):
+    vectors = clustered(20)
+    index.add([f'case{i}' for i in range(10)], vectors[:10])
+    with open(tmp_path / 'vectors.i8', 'ab') as f:
+        f.write(b'\x01' * 7)
+    assert index.add([f'case{i}' for i in range(10, 20)], vectors[10:]) == 20
+    assert index.search(vectors[15], k=1)[0][1] == 'case15'
+
+
+def test_rejects_mismatched_embeddings(index):
+    index.add(['a'], np.ones((1, 16)))
+    with pytest.raises(ValueError):
+        index.add(['b'], np.ones((1, 8)))
+    with pytest.raises(ValueError):
+        index.search(np.ones(8))
+    with pytest.raises(ValueError):
+        index.add(['c'], np.zeros((1, 16)))
+
+
+def test_predict_answers_a_zero_embedding_without_similar_cases(versions, monkeypatch, tmp_path):
+    # A post-ReLU embedding of a blank photo can be all zeros
+    stub = versions.define('v1', answering(3))
+    stub.embedding_size = 4
+    monkeypatch.setattr(stub, 'forward', lambda batch: (stub(batch), np.zeros((len(batch), 4), np.float32)))
+    monkeypatch.setattr(app, 'SIMILARITY_INDEX_DIR', str(tmp_path / 'similarity'))
+    monkeypatch.setattr(app, 'similarity_indexes', {})
+    versions.serve('v1')
+    app.similarity_index('v1').add(['case0'], np.ones((1, 4), np.float32))
+    skipped = app.similar_lookups_skipped_total.value()
+
+    status, body = predict(upload(), similar='3')
+    assert status == 200
+    assert body['success'] and body['similar_cases'] == []
+    assert app.similar_lookups_skipped_total.value() == skipped + 1
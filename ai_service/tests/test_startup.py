@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import threading
+
+import app
+
+AI_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_service_does_not_import_tensorflow():
+    check = "import sys, app; sys.exit('tensorflow' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', check], cwd=AI_SERVICE_DIR).returncode == 0
+
+
+def test_predictions_wait_for_the_model(monkeypatch):
+    monkeypatch.setattr(app, 'ready', threading.Event())
+    client = app.app.test_client()
+    assert client.get('/live').status_code == 200
+    response = client.get('/ready')
+    assert (response.status_code, response.get_json()['status']) == (503, 'loading')
+    response = client.post('/predict')
+    assert (response.status_code, response.headers['Retry-After']) == (503, '5')
+
+
+def test_a_failed_load_is_reported(monkeypatch):
+    monkeypatch.setattr(app, 'ready', threading.Event())
+    monkeypatch.setattr(app, 'load_error', 'model file not found')
+    client = app.app.test_client()
+    assert client.get('/ready').get_json()['status'] == 'failed'
+    assert client.post('/predict').status_code == 500
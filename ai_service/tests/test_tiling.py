@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from tiling import aggregate_tiles, heatmap, leaf_fractions, tile_batches, tile_grid, tiles
+
+LEAF = (60, 140, 40)
+SOIL = (120, 90, 70)
+
+
+@pytest.mark.parametrize('width, height, max_tiles', [
+    (1000, 750, 256), (4000, 3000, 64), (997, 331, 16), (225, 224, 4), (5471, 3079, 100), (300, 2000, 12)
+])
+def test_grid_covers_non_divisible_sizes(width, height, max_tiles):
+    grid = tile_grid(width, height, tile_size=224, overlap=0.25, max_tiles=max_tiles)
+    assert len(grid.xs) * len(grid.ys) <= max_tiles
+    for positions, length in zip((grid.xs, grid.ys), grid.image_size):
+        assert length >= 224
+        covered = np.zeros(length, dtype=bool)
+        for start in positions:
+            covered[start:start + 224] = True
+        assert covered.all()
+        # Edge-aligned, in order, no step wider than the stride
+        assert positions[0] == 0 and positions[-1] == length - 224
+        assert all(0 < step <= 168 for step in np.diff(positions))
+    # Scaled down (never up past one tile on the short side), keeping the shape
+    scale = grid.image_size[0] / width
+    assert scale <= 1.0 or min(grid.image_size) == 224
+    assert grid.image_size[1] == pytest.approx(height * scale, abs=1.5) or min(grid.image_size) == 224
+
+
+def test_small_photos_are_scaled_up_to_one_tile():
+    grid = tile_grid(100, 80)
+    assert grid.image_size == (280, 224)
+    assert grid.ys == [0]
+
+
+def test_grid_that_cannot_fit_the_budget():
+    with pytest.raises(ValueError):
+        tile_grid(224, 100000, max_tiles=4)
+
+
+def test_background_tiles_have_no_leaf_fraction():
+    grid = tile_grid(1100, 700, max_tiles=256)
+    width, height = grid.image_size
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[...] = SOIL
+    # Foliage on the left 300 columns, across several leaf_fractions() bands
+    pixels[:, :300] = LEAF
+    fractions = leaf_fractions(pixels, grid)
+    assert fractions.shape == (len(grid.ys), len(grid.xs))
+    for column, x in enumerate(grid.xs):
+        expected = np.clip(300 - x, 0, 224) / 224
+        assert fractions[:, column] == pytest.approx(np.full(len(grid.ys), expected))
+    assert (fractions[:, -1] == 0).all()
+
+
+def test_batches_hold_the_selected_tiles_in_order():
+    grid = tile_grid(600, 500, max_tiles=64)
+    pixels = np.random.default_rng(0).integers(0, 256, grid.image_size[::-1] + (3,), dtype=np.uint8)
+    views = {(row, column): view for row, column, view in tiles(pixels, grid)}
+    selected = [(0, 1), (1, 0), (1, 2), (2, 2), (0, 0)]
+    batches = list(tile_batches(pixels, grid, selected, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    for tile, position in zip(np.concatenate(batches), selected):
+        np.testing.assert_array_equal(tile, views[position])
+
+
+def test_aggregate_pools_each_classes_top_tiles():
+    outputs = np.array([[0.9, 0.1, 0.0],
+                        [0.2, 0.8, 0.0],
+                        [0.1, 0.3, 0.6],
+                        [0.5, 0.4, 0.1]], dtype=np.float32)
+    weights = np.array([1.0, 0.5, 1.0, 1.0])
+    # Top half of 4 tiles = 2 per class, weighted
+    expected = np.array([(0.9 + 0.5) / 2, (0.8 * 0.5 + 0.4) / 1.5, (0.6 + 0.1) / 2])
+    pooled = aggregate_tiles(outputs, weights, top_fraction=0.5)
+    np.testing.assert_allclose(pooled, expected / expected.sum(), rtol=1e-6)
+
+    # Tile order does not matter
+    order = [2, 0, 3, 1]
+    np.testing.assert_allclose(aggregate_tiles(outputs[order], weights[order], top_fraction=0.5), pooled, rtol=1e-6)
+
+    # One tile per class: its maximum; every tile: the weighted mean
+    maxima = outputs.max(axis=0)
+    np.testing.assert_allclose(aggregate_tiles(outputs, weights, top_fraction=0.01), maxima / maxima.sum(), rtol=1e-6)
+    mean = (outputs * weights[:, np.newaxis]).sum(axis=0) / weights.sum()
+    np.testing.assert_allclose(aggregate_tiles(outputs, weights, top_fraction=1.0), mean / mean.sum(), rtol=1e-6)
+
+
+def test_a_lesion_on_a_few_tiles_still_counts():
+    healthy, diseased = [0.95, 0.05], [0.1, 0.9]
+    outputs = np.array([healthy] * 18 + [diseased] * 2)
+    pooled = aggregate_tiles(outputs, np.ones(20), top_fraction=0.1)
+    # Close to an even split, where a plain mean over the tiles gives it 0.135
+    assert pooled[1] > 0.45
+    assert outputs.mean(axis=0)[1] == pytest.approx(0.135)
+
+
+def test_heatmap_leaves_skipped_tiles_empty():
+    grid = tile_grid(500, 300, max_tiles=16)
+    cells = heatmap([0.123456, 0.5], [(0, 1), (1, 0)], grid)
+    assert len(cells) == len(grid.ys) and len(cells[0]) == len(grid.xs)
+    assert cells[0][1] == 0.1235 and cells[1][0] == 0.5
+    assert sum(value is not None for row in cells for value in row) == 2
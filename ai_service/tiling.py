@@ -0,0 +1,128 @@
+"""
+Tiled inference for high-resolution field and drone photos.
+
+Squashing a 20-100 MP photo to the model's 224x224 input throws lesions
+away. In tiled mode the photo is instead decoded at a working resolution
+that fits a fixed tile budget (JPEGs at a reduced DCT scale, so the full
+resolution never sits in memory) and cut into overlapping model-size tiles:
+
+  1. tile_grid() picks the working size: the largest scale <= 1 whose
+     grid of overlapping tiles stays within max_tiles (small photos are
+     scaled up to one tile). The last tile in each direction is aligned
+     with the edge, so the grid covers the image without padding.
+  2. leaf_fractions() gives each tile's share of foliage-coloured pixels;
+     tiles below a minimum hold soil, sky or sheeting and are skipped.
+  3. The leaf tiles run through the model in large batches.
+  4. aggregate_tiles() pools the tile outputs into one probability vector:
+     per class, the mean of its highest tile probabilities over the top
+     share of leaf tiles (weighted by leaf fraction). A lesion on a few
+     leaves then still counts, while one odd tile does not decide the
+     result.
+
+Memory is bounded by the tile budget and the decode limit, whatever the
+upload's resolution.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from quality import green_mask
+
+# Working image size (width, height), model tile size, and the top-left
+# corners of the tile columns (xs) and rows (ys)
+TileGrid = namedtuple('TileGrid', ['image_size', 'tile_size', 'xs', 'ys'])
+
+# Rows of the image processed at once by leaf_fractions()
+_MASK_BAND_ROWS = 512
+
+
+def _positions(length, tile_size, stride):
+    count = 1 if length <= tile_size else math.ceil((length - tile_size) / stride) + 1
+    return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+
+def tile_grid(width, height, tile_size=224, overlap=0.25, max_tiles=256):
+    """
+    TileGrid for a width x height photo: tiles overlap by `overlap` of their
+    size, and the photo is scaled down until there are at most max_tiles
+    """
+    stride = max(1, int(round(tile_size * (1.0 - overlap))))
+    # Never below the scale at which the short side holds one tile
+    smallest = tile_size / min(width, height)
+    # Start where the tile area alone fills the budget, then shrink until
+    # the (edge-aligned) grid fits
+    scale = max(smallest, min(1.0, math.sqrt(max_tiles * stride * stride / (width * height))))
+    while True:
+        size = (max(tile_size, round(width * scale)), max(tile_size, round(height * scale)))
+        xs, ys = _positions(size[0], tile_size, stride), _positions(size[1], tile_size, stride)
+        if len(xs) * len(ys) <= max_tiles:
+            return TileGrid(size, tile_size, xs, ys)
+        if scale <= smallest:
+            raise ValueError(f'A {width}x{height} image needs more than {max_tiles} tiles at any scale')
+        scale = max(smallest, scale * 0.97)
+
+
+def tiles(pixels, grid):
+    """
+    (row, column, view) of every tile of a decoded working image
+    """
+    size = grid.tile_size
+    for row, y in enumerate(grid.ys):
+        for column, x in enumerate(grid.xs):
+            yield row, column, pixels[y:y + size, x:x + size]
+
+
+def leaf_fractions(pixels, grid):
+    """
+    (rows, columns) share of foliage-coloured pixels in every tile
+    """
+    mask = np.empty(pixels.shape[:2], dtype=bool)
+    for top in range(0, pixels.shape[0], _MASK_BAND_ROWS):
+        mask[top:top + _MASK_BAND_ROWS] = green_mask(pixels[top:top + _MASK_BAND_ROWS])
+    fractions = np.zeros((len(grid.ys), len(grid.xs)), dtype=np.float32)
+    for row, column, tile_mask in tiles(mask, grid):
+        fractions[row, column] = tile_mask.mean()
+    return fractions
+
+
+def tile_batches(pixels, grid, selected, batch_size=32):
+    """
+    Stacked (batch, tile, tile, 3) copies of the selected (row, column)
+    tiles, batch_size at a time, so only one batch is copied at once
+    """
+    size = grid.tile_size
+    for start in range(0, len(selected), batch_size):
+        yield np.stack([
+            pixels[grid.ys[row]:grid.ys[row] + size, grid.xs[column]:grid.xs[column] + size]
+            for row, column in selected[start:start + batch_size]
+        ])
+
+
+def aggregate_tiles(outputs, weights, top_fraction=0.1):
+    """
+    One probability vector from (tiles, classes) outputs: per class, the
+    weighted mean of its highest probabilities over ceil(top_fraction *
+    tiles) tiles, renormalized to sum to 1
+    """
+    outputs = np.asarray(outputs, dtype=np.float32)
+    weights = np.asarray(weights, dtype=np.float32)
+    count = max(1, min(len(outputs), math.ceil(top_fraction * len(outputs))))
+    # Per class, the rows of its `count` highest probabilities
+    top_rows = np.argpartition(-outputs, count - 1, axis=0)[:count]
+    top = np.take_along_axis(outputs, top_rows, axis=0)
+    top_weights = weights[top_rows]
+    pooled = (top * top_weights).sum(axis=0) / np.maximum(top_weights.sum(axis=0), 1e-12)
+    return pooled / max(float(pooled.sum()), 1e-12)
+
+
+def heatmap(values, selected, grid):
+    """
+    (rows, columns) nested lists holding each selected tile's value (e.g. its
+    probability of the predicted class), None for skipped tiles
+    """
+    cells = [[None] * len(grid.xs) for _ in grid.ys]
+    for (row, column), value in zip(selected, values):
+        cells[row][column] = round(float(value), 4)
+    return cells
@@ -29,6 +29,9 @@ const upload = multer({
 
 // AI service URL (adjust if running on different port/host)
 const AI_SERVICE_URL = 'http://localhost:5001';
+// How long we wait for a prediction; sent along so the AI service can drop
+// requests we have already given up on
+const AI_PREDICT_TIMEOUT_MS = 30000;
 
 // Check AI service health
 router.get('/health', async (req, res) => {
@@ -105,9 +108,11 @@ router.post('/detect', auth.protect, upload.single('image'), async (req, res) =>
         // Send image to AI service
         const aiResponse = await axios.post(`${AI_SERVICE_URL}/predict`, form, {
             headers: {
-                ...form.getHeaders()
+                ...form.getHeaders(),
+                'X-Deadline-Ms': String(AI_PREDICT_TIMEOUT_MS),
+                'X-Priority': 'interactive'
             },
-            timeout: 30000 // 30 second timeout
+            timeout: AI_PREDICT_TIMEOUT_MS
         });
 
         const processingTime = Date.now() - startTime;
@@ -173,7 +178,27 @@ router.post('/detect', auth.protect, upload.single('image'), async (req, res) =>
         
         // No need to clean up local files since we're using Cloudinary
 
-        if (error.response) {
+        if (error.response && [429, 503].includes(error.response.status)) {
+            // AI service is shedding load; pass its retry hint on to the client
+            const retryAfter = error.response.headers['retry-after'];
+            if (retryAfter) {
+                res.set('Retry-After', retryAfter);
+            }
+            res.status(503).json({
+                success: false,
+                error: 'AI service busy',
+                message: 'Plant disease detection service is busy, please try again shortly',
+                retryAfter: retryAfter ? Number(retryAfter) : undefined
+            });
+        } else if (error.response && error.response.status === 422) {
+            // The photo failed the AI service's quality checks; the client can ask for a retake
+            res.status(422).json({
+                success: false,
+                error: 'Unusable image',
+                reason: error.response.data.reason,
+                message: error.response.data.error
+            });
+        } else if (error.response) {
             // AI service returned an error
             res.status(500).json({
                 success: false,